@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from app.embedder import lemmatize_text
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Ключ кэша: отсортированный набор лемм вопроса (порядок слов и словоформы не важны).
+
+    Пустая строка — у вопроса нет значимых слов ("ок?", "🙂"): такие вопросы не кэшируются.
+    """
+    return " ".join(sorted(set(lemmatize_text(question).split())))
+
+
+class AnswerCache:
+    """LRU+TTL кэш готовых ответов: нормализованный вопрос -> (ответ, источники).
+
+    Записи привязаны к index_id: после пересборки индекса кэш сбрасывается.
+    При заданном path сохраняется на диск и переживает перезапуск: запись идёт
+    в фоновом таймере не чаще раза в flush_interval секунд и в close().
+    """
+
+    def __init__(self, maxsize: int = 5000, ttl: float = 86400, path: Path | None = None,
+                 flush_interval: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.flush_interval = flush_interval
+        self.index_id = ""
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, index_id: str):
+        self.index_id = index_id
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("index_id") != index_id:
+                logger.info("Answer cache at %s belongs to another index version, discarding", self.path)
+                return
+            now = time.time()
+            entries = OrderedDict(
+                (key, entry) for key, entry in data["entries"][-self.maxsize:]
+                if now - entry["created_at"] < self.ttl
+            )
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # битый файл (например, оборванная запись) — начинаем с пустого кэша
+            logger.warning("Failed to load answer cache from %s, starting empty: %s", self.path, e)
+            return
+        with self._lock:
+            self._entries = entries
+        logger.info("Loaded %d cached answers from %s", len(self._entries), self.path)
+
+    def save(self):
+        """Записывает кэш на диск; ошибки записи только логируются"""
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = {"index_id": self.index_id, "entries": list(self._entries.items())}
+            tmp_path = None
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # уникальный временный файл: несколько процессов пишут один и тот же путь
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent,
+                                                 prefix=self.path.name + ".", suffix=".tmp",
+                                                 delete=False) as f:
+                    tmp_path = f.name
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.error("Failed to save answer cache to %s: %s", self.path, e)
+                if tmp_path is not None:
+                    Path(tmp_path).unlink(missing_ok=True)
+
+    def _schedule_save(self):
+        """Откладывает запись: ответы, пришедшие за flush_interval, сохраняются одной записью"""
+        if self.path is None:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_interval, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+        self.save()
+
+    def close(self):
+        """Отменяет отложенную запись и сохраняет кэш сразу"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def _check_index(self, index_id: str):
+        if index_id != self.index_id:
+            logger.info("Index version changed (%s -> %s), clearing answer cache", self.index_id, index_id)
+            self._entries.clear()
+            self.index_id = index_id
+
+    def get(self, index_id: str, question: str) -> dict | None:
+        """{"answer": str, "sources": [(title, url)]} или None"""
+        key = normalize_question(question)
+        if not key:
+            return None
+        with self._lock:
+            self._check_index(index_id)
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["created_at"] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return {"answer": entry["answer"], "sources": [tuple(s) for s in entry["sources"]]}
+
+    def put(self, index_id: str, question: str, answer: str, sources: list[tuple[str, str]]):
+        key = normalize_question(question)
+        if not key:
+            return
+        with self._lock:
+            self._check_index(index_id)
+            self._entries[key] = {
+                "answer": answer,
+                "sources": [list(s) for s in sources],
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        self._schedule_save()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
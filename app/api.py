@@ -1,31 +1,114 @@
+"""HTTP API поверх того же пайплайна, что и бот (app/pipeline.py).
+
+    POST /ask         {"query", "user_id"?}    -> {"result", "sources", "cached"}
+    POST /ask/stream  {"query", "user_id"?}    -> text/event-stream: token..., затем done или error
+    POST /ask/batch   {"queries", "user_id"?}  -> {"results": [{"query", "result", "sources", "cached"}]}
+
+Лимиты те же, что у бота: пул ретрива RETRIEVAL_WORKERS, семафор LLM_CONCURRENCY и очередь
+вопросов одного user_id. Каждый воркер поднимает свой пайплайн, индекс читается через mmap:
+
+    gunicorn app.api:app -k uvicorn.workers.UvicornWorker -w 4
+"""
+import json
+import logging
+from contextlib import asynccontextmanager, nullcontext
+
 from fastapi import FastAPI, Request
-from pydantic import BaseModel
-from app.loader import load_and_split_documents
-from app.embedder import build_or_load_vectorstore
-from app.llm import get_llm
-from app.rag import build_rag_chain
-from app.config import CHROMA_PERSIST_DIR
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from app.rag import collect_sources
+from app.pipeline import build_rag_executor
+from app.executor import RagExecutor
+from app.config import API_MAX_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Загружаем один раз при старте воркера
+    app.state.rag_executor = build_rag_executor()
+    try:
+        yield
+    finally:
+        app.state.rag_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
 
 class QueryRequest(BaseModel):
     query: str
+    user_id: int | None = None
 
-# Загружаем один раз при старте
-if CHROMA_PERSIST_DIR.exists() and any(CHROMA_PERSIST_DIR.iterdir()):
-    vectorstore = build_or_load_vectorstore([])
-else:
-    chunks = load_and_split_documents()
-    vectorstore = build_or_load_vectorstore(chunks)
 
-retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-llm = get_llm()
-rag = build_rag_chain(llm, retriever)
+class BatchRequest(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=API_MAX_BATCH)
+    user_id: int | None = None
 
-@app.post("/ask")
-def ask(request: QueryRequest):
-    result = rag({"query": request.query})
-    return {
-        "result": result["result"],
-        "sources": [doc.metadata.get("page", "?") for doc in result["source_documents"]]
+
+def _turn(rag_executor: RagExecutor, user_id: int | None):
+    """Очередь вопросов пользователя, как в боте; без user_id запросы не упорядочиваются"""
+    return nullcontext() if user_id is None else rag_executor.user_turn(user_id)
+
+
+def _response(result: dict) -> dict:
+    response = {
+        "result": result["answer"],
+        "sources": [source for _, source in result["sources"]],
+        "cached": result["cached"],
     }
+    if "error" in result:
+        response["error"] = result["error"]
+    return response
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/ask")
+async def ask(request: QueryRequest, http_request: Request):
+    rag_executor = http_request.app.state.rag_executor
+    async with _turn(rag_executor, request.user_id):
+        result = await rag_executor.answer(request.query)
+    return _response(result)
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: QueryRequest, http_request: Request):
+    rag_executor = http_request.app.state.rag_executor
+
+    async def events():
+        async with _turn(rag_executor, request.user_id):
+            try:
+                cached = await rag_executor.cached(request.query)
+                if cached is not None:
+                    yield _sse("done", _response({"cached": True, **cached}))
+                    return
+                context = await rag_executor.retrieve(request.query)
+                answer = ""
+                async for token in rag_executor.stream(request.query, context):
+                    answer += token
+                    yield _sse("token", token)
+                sources = collect_sources(context)
+                await rag_executor.remember(request.query, answer, sources)
+                yield _sse("done", _response({"answer": answer, "sources": sources, "cached": False}))
+            except Exception as e:
+                logger.error("Error streaming answer: %s", str(e), exc_info=True)
+                yield _sse("error", {"detail": str(e)})
+
+    # X-Accel-Buffering: nginx перед воркерами не должен копить поток
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchRequest, http_request: Request):
+    rag_executor = http_request.app.state.rag_executor
+    async with _turn(rag_executor, request.user_id):
+        results = await rag_executor.answer_many(request.queries)
+    return {"results": [{"query": result["input"], **_response(result)} for result in results]}
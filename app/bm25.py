@@ -0,0 +1,682 @@
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterable, List, Mapping, NamedTuple
+
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.documents import Document
+from langchain.schema import BaseRetriever
+
+from app.chunkstore import ChunkStore, ChunkStoreWriter, map_file
+
+logger = logging.getLogger(__name__)
+
+# Формат каталога индекса; при несовместимых изменениях — увеличить
+FORMAT_VERSION = 4
+MANIFEST_FILE = "manifest.json"
+META_FILE = "meta.json"
+VOCAB_FILE = "vocab.bin"
+VOCAB_OFFSETS_FILE = "vocab.offsets.npy"
+DOC_ARTICLE_FILE = "doc_article.npy"
+_ARRAYS = (
+    "indptr", "doc_ids", "tfs", "impacts", "doc_len", "idf",
+    "doc_indptr", "doc_terms", "doc_tfs", "doc_norm",
+)
+
+
+def index_exists(path: Path) -> bool:
+    # manifest.json пишется последним, поэтому его наличие = индекс записан целиком
+    return (path / MANIFEST_FILE).exists()
+
+
+def _check_version(data: dict, path: Path):
+    if data.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index format version {data.get('format_version')} in {path} "
+            f"(expected {FORMAT_VERSION}), rebuild the index"
+        )
+
+
+def read_meta(path: Path) -> dict:
+    with open(path / META_FILE, encoding="utf-8") as f:
+        meta = json.load(f)
+    _check_version(meta, path)
+    return meta
+
+
+def read_manifest(path: Path) -> dict:
+    with open(path / MANIFEST_FILE, encoding="utf-8") as f:
+        manifest = json.load(f)
+    _check_version(manifest, path)
+    return manifest
+
+
+def write_manifest(path: Path, segments: list[dict], generation: int, watermark: str | None) -> dict:
+    """Атомарно заменяет manifest.json; каждая новая версия получает новый index_id"""
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "index_id": uuid.uuid4().hex,
+        "generation": generation,
+        "watermark": watermark,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "segments": segments,
+    }
+    tmp_path = path / (MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path / MANIFEST_FILE)
+    return manifest
+
+
+def segment_name(generation: int) -> str:
+    return f"seg-{generation:06d}"
+
+
+@contextmanager
+def index_lock(path: Path):
+    """Межпроцессная блокировка изменений индекса (обновление, компакция)"""
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _top_k(doc_ids: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k без полной сортировки: argpartition + сортировка только k лучших"""
+    if len(doc_ids) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        doc_ids, scores = doc_ids[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return doc_ids[order], scores[order]
+
+
+class Vocabulary:
+    """Отсортированный словарь терминов; term -> id бинарным поиском по UTF-8 блобу.
+
+    Порядок байт UTF-8 совпадает с порядком кодовых точек, т.е. с sorted() по строкам,
+    так что на диске словарь не нужно разворачивать в dict.
+    """
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def from_terms(cls, terms: List[str]) -> "Vocabulary":
+        encoded = [t.encode("utf-8") for t in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def open(cls, path: Path) -> "Vocabulary":
+        return cls(map_file(path / VOCAB_FILE), np.load(path / VOCAB_OFFSETS_FILE, mmap_mode="r"))
+
+    def save(self, path: Path):
+        with open(path / VOCAB_FILE, "wb") as f:
+            f.write(self._blob)
+        np.save(path / VOCAB_OFFSETS_FILE, np.asarray(self._offsets))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _key(self, i: int) -> bytes:
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])]
+
+    def term(self, i: int) -> str:
+        return bytes(self._key(i)).decode("utf-8")
+
+    def get(self, term: str, default: int = -1) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._key(lo) == key:
+            return lo
+        return default
+
+
+class ShardStats(NamedTuple):
+    """Прямой индекс части корпуса с локальными ID терминов (в порядке появления).
+
+    Шарды лемматизируются параллельно, а BM25Index.from_shards сливает их в один индекс.
+    """
+
+    terms: list[str]
+    doc_indptr: np.ndarray
+    doc_terms: np.ndarray
+    doc_tfs: np.ndarray
+
+    @classmethod
+    def from_counts(cls, corpus: Iterable[Mapping[str, int]]) -> "ShardStats":
+        vocab: dict[str, int] = {}
+        indptr = [0]
+        doc_terms: list[int] = []
+        doc_tfs: list[int] = []
+        for counts in corpus:
+            for term, tf in counts.items():
+                doc_terms.append(vocab.setdefault(term, len(vocab)))
+                doc_tfs.append(tf)
+            indptr.append(len(doc_terms))
+        return cls(
+            terms=list(vocab),
+            doc_indptr=np.asarray(indptr, dtype=np.int64),
+            doc_terms=np.asarray(doc_terms, dtype=np.int32),
+            doc_tfs=np.asarray(doc_tfs, dtype=np.int32),
+        )
+
+
+class BM25Index:
+    """Инвертированный индекс BM25 (Okapi, как в rank_bm25) одного сегмента.
+
+    Термины — целые ID (по алфавиту), постинги хранятся в CSR-виде:
+    документы термина t — doc_ids[indptr[t]:indptr[t+1]].
+    Для каждого постинга заранее посчитан вклад tf-нормализации (impacts),
+    поэтому запрос — это сумма idf * impact только по документам с терминами запроса.
+
+    Прямой индекс (термины документа d — doc_terms[doc_indptr[d]:doc_indptr[d+1]])
+    и L2-нормы TF-IDF векторов документов нужны для PRF без повторной токенизации.
+    """
+
+    def __init__(self, vocab: Vocabulary, indptr: np.ndarray, doc_ids: np.ndarray,
+                 tfs: np.ndarray, doc_len: np.ndarray, idf: np.ndarray,
+                 doc_indptr: np.ndarray, doc_terms: np.ndarray, doc_tfs: np.ndarray,
+                 doc_norm: np.ndarray | None = None,
+                 k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 avgdl: float | None = None, mean_idf: float = 0.0,
+                 impacts: np.ndarray | None = None):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.doc_indptr = doc_indptr
+        self.doc_terms = doc_terms
+        self.doc_tfs = doc_tfs
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        # средний idf до замены отрицательных — нижняя граница idf при слиянии сегментов
+        self.mean_idf = mean_idf
+        self.num_docs = len(doc_len)
+        if avgdl is None:
+            avgdl = float(doc_len.mean()) if self.num_docs else 0.0
+        self.avgdl = avgdl
+        self.impacts = impacts if impacts is not None else self._compute_impacts()
+        self.doc_norm = doc_norm if doc_norm is not None else self._compute_doc_norm()
+
+    def df(self, term_id: int) -> int:
+        return int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def tfidf_idf(self, term_ids: np.ndarray) -> np.ndarray:
+        """Idf сегмента в варианте sklearn TfidfVectorizer (smooth_idf): ln((1+N)/(1+df)) + 1"""
+        df = self.indptr[term_ids + 1] - self.indptr[term_ids]
+        return np.log((1 + self.num_docs) / (1 + df)) + 1
+
+    def _compute_doc_norm(self) -> np.ndarray:
+        weights = self.doc_tfs * self.tfidf_idf(np.asarray(self.doc_terms, dtype=np.int64))
+        doc_of_entry = np.repeat(np.arange(self.num_docs), np.diff(self.doc_indptr))
+        return np.sqrt(np.bincount(doc_of_entry, weights=weights ** 2, minlength=self.num_docs)).astype(np.float32)
+
+    def _compute_impacts(self) -> np.ndarray:
+        tf = self.tfs.astype(np.float32)
+        dl = self.doc_len[self.doc_ids].astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * dl / max(self.avgdl, 1e-9))
+        return tf * (self.k1 + 1) / (tf + norm)
+
+    @classmethod
+    def build(cls, corpus: Iterable[List[str]], k1: float = 1.5, b: float = 0.75,
+              epsilon: float = 0.25) -> "BM25Index":
+        """Строит индекс по токенизированным (лемматизированным) документам"""
+        return cls.from_term_counts((Counter(tokens) for tokens in corpus), k1=k1, b=b, epsilon=epsilon)
+
+    @classmethod
+    def from_term_counts(cls, corpus: Iterable[Mapping[str, int]], k1: float = 1.5, b: float = 0.75,
+                         epsilon: float = 0.25) -> "BM25Index":
+        """Строит индекс по частотам терминов документов (term -> tf)"""
+        return cls.from_shards([ShardStats.from_counts(corpus)], k1=k1, b=b, epsilon=epsilon)
+
+    @classmethod
+    def from_shards(cls, shards: Iterable["ShardStats"], k1: float = 1.5, b: float = 0.75,
+                    epsilon: float = 0.25) -> "BM25Index":
+        """Сливает статистики шардов (в порядке документов) в один индекс.
+
+        Результат побайтно совпадает с построением по всему корпусу сразу:
+        ID терминов всё равно назначаются по алфавиту.
+        """
+        vocab: dict[str, int] = {}
+        f_indptr = [np.zeros(1, dtype=np.int64)]
+        f_terms: list[np.ndarray] = []
+        f_tfs: list[np.ndarray] = []
+        offset = 0
+        for shard in shards:
+            local = np.asarray([vocab.setdefault(t, len(vocab)) for t in shard.terms], dtype=np.int32)
+            f_terms.append(local[shard.doc_terms])
+            f_tfs.append(shard.doc_tfs)
+            f_indptr.append(shard.doc_indptr[1:] + offset)
+            offset += len(shard.doc_terms)
+
+        f_indptr_arr = np.concatenate(f_indptr)
+        f_tfs_arr = np.concatenate(f_tfs) if f_tfs else np.empty(0, dtype=np.int32)
+        n = len(f_indptr_arr) - 1
+        doc_entries = np.diff(f_indptr_arr)
+        doc_len = np.bincount(
+            np.repeat(np.arange(n), doc_entries), weights=f_tfs_arr, minlength=n,
+        ).astype(np.int32)
+
+        # ID терминов по алфавиту — результат не зависит от порядка появления
+        terms = sorted(vocab)
+        remap = np.empty(len(vocab), dtype=np.int32)
+        for new_id, term in enumerate(terms):
+            remap[vocab[term]] = new_id
+        f_terms_arr = remap[np.concatenate(f_terms)] if f_terms else np.empty(0, dtype=np.int32)
+
+        f_docs = np.repeat(np.arange(n, dtype=np.int32), doc_entries)
+        order = np.argsort(f_terms_arr, kind="stable")
+        df = np.bincount(f_terms_arr, minlength=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        mean_idf = float(idf.mean()) if len(idf) else 0.0
+        idf[idf < 0] = epsilon * mean_idf
+
+        logger.info("BM25 index built: %d docs, %d terms, %d postings", n, len(terms), len(f_terms_arr))
+        return cls(
+            vocab=Vocabulary.from_terms(terms),
+            indptr=indptr,
+            doc_ids=f_docs[order],
+            tfs=f_tfs_arr[order],
+            doc_len=doc_len,
+            idf=idf.astype(np.float32),
+            doc_indptr=f_indptr_arr,
+            doc_terms=f_terms_arr,
+            doc_tfs=f_tfs_arr,
+            k1=k1,
+            b=b,
+            epsilon=epsilon,
+            mean_idf=mean_idf,
+        )
+
+    def save(self, path: Path) -> dict:
+        """Пишет массивы в каталог сегмента; возвращает поля для meta.json"""
+        self.vocab.save(path)
+        for name in _ARRAYS:
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name)))
+        return {
+            "num_docs": self.num_docs,
+            "num_terms": len(self.vocab),
+            "avgdl": self.avgdl,
+            "mean_idf": self.mean_idf,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+        }
+
+    @classmethod
+    def open(cls, path: Path, meta: dict) -> "BM25Index":
+        """Открывает индекс через np.memmap: страницы подгружаются лениво и общие между процессами"""
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        return cls(
+            vocab=Vocabulary.open(path),
+            k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"],
+            avgdl=meta["avgdl"], mean_idf=meta["mean_idf"],
+            **arrays,
+        )
+
+    def term_counts(self, doc_ids: Iterable[int]) -> Iterable[dict[str, int]]:
+        """Частоты терминов документов из прямого индекса (компакция без повторной лемматизации)"""
+        terms = [self.vocab.term(i) for i in range(len(self.vocab))]
+        for d in doc_ids:
+            lo, hi = int(self.doc_indptr[d]), int(self.doc_indptr[d + 1])
+            yield {terms[t]: int(tf) for t, tf in zip(self.doc_terms[lo:hi].tolist(), self.doc_tfs[lo:hi])}
+
+    def feedback_scores(self, doc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Сумма L2-нормированных TF-IDF векторов документов: (term_ids, веса).
+
+        То же, что TfidfVectorizer по текстам этих документов, но tf берутся из прямого
+        индекса, а idf считается по всему сегменту.
+        """
+        spans = [(int(self.doc_indptr[d]), int(self.doc_indptr[d + 1])) for d in doc_ids]
+        terms = np.concatenate([self.doc_terms[lo:hi] for lo, hi in spans]).astype(np.int64)
+        tfs = np.concatenate([self.doc_tfs[lo:hi] for lo, hi in spans])
+        norms = np.repeat(np.asarray(self.doc_norm)[doc_ids], [hi - lo for lo, hi in spans])
+
+        weights = tfs * self.tfidf_idf(terms) / np.maximum(norms, 1e-9)
+        unique_terms, inverse = np.unique(terms, return_inverse=True)
+        return unique_terms, np.bincount(inverse, weights=weights)
+
+
+class SegmentWriter:
+    """Потоковая запись сегмента: чанки и их article_id пишутся на диск батчами
+    по мере лемматизации, индекс — в finish(). До finish() сегмент лежит во временном каталоге.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+        self._tmp_path.mkdir(parents=True)
+        self._chunks = ChunkStoreWriter(self._tmp_path)
+        self._doc_article: list[int] = []
+
+    def add(self, documents: List[Document]):
+        self._chunks.extend(documents)
+        self._doc_article.extend(doc.metadata.get("article_id", -1) for doc in documents)
+
+    def finish(self, index: BM25Index) -> dict:
+        self._chunks.close()
+        if index.num_docs != self._chunks.count:
+            raise ValueError(f"Index has {index.num_docs} documents, segment has {self._chunks.count} chunks")
+        meta = index.save(self._tmp_path)
+        np.save(self._tmp_path / DOC_ARTICLE_FILE, np.asarray(self._doc_article, dtype=np.int64))
+        meta.update(format_version=FORMAT_VERSION, created_at=datetime.now(timezone.utc).isoformat())
+        with open(self._tmp_path / META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._tmp_path.rename(self.path)
+        return meta
+
+
+def write_segment(path: Path, documents: List[Document], index: BM25Index) -> dict:
+    """Пишет сегмент (индекс, тексты чанков, article_id чанков) в каталог path"""
+    writer = SegmentWriter(path)
+    writer.add(documents)
+    return writer.finish(index)
+
+
+class Segment:
+    """Сегмент индекса: BM25, тексты чанков и article_id каждого чанка.
+
+    Чанки статей, изменённых или удалённых после записи сегмента, помечены
+    в манифесте (deleted_articles) и исключаются из выдачи через маску live.
+    """
+
+    def __init__(self, name: str, index: BM25Index, chunks: ChunkStore,
+                 doc_article: np.ndarray, deleted_articles: Iterable[int] = ()):
+        self.name = name
+        self.index = index
+        self.chunks = chunks
+        self.doc_article = doc_article
+        self.deleted_articles = sorted(set(deleted_articles))
+        self.live = None
+        if self.deleted_articles:
+            self.live = ~np.isin(doc_article, self.deleted_articles)
+
+    @classmethod
+    def open(cls, root: Path, entry: dict) -> "Segment":
+        path = root / entry["name"]
+        meta = read_meta(path)
+        return cls(
+            name=entry["name"],
+            index=BM25Index.open(path, meta),
+            chunks=ChunkStore.open(path),
+            doc_article=np.load(path / DOC_ARTICLE_FILE, mmap_mode="r"),
+            deleted_articles=entry.get("deleted_articles", ()),
+        )
+
+    @property
+    def num_live(self) -> int:
+        return self.index.num_docs if self.live is None else int(self.live.sum())
+
+    def live_ids(self) -> np.ndarray:
+        if self.live is None:
+            return np.arange(self.index.num_docs)
+        return np.flatnonzero(self.live)
+
+
+class ScoreAccumulator:
+    """Накопленные BM25-оценки запроса: плотный массив + документы, затронутые постингами.
+
+    Позволяет досчитать термины расширения поверх уже посчитанного запроса.
+    Документы вне маски live (удалённые чанки) в top_k не попадают.
+    """
+
+    def __init__(self, num_docs: int, live: np.ndarray | None = None):
+        self.scores = np.zeros(num_docs, dtype=np.float32)
+        self.live = live
+        self._touched: list[np.ndarray] = []
+        self._candidates: np.ndarray | None = None
+
+    def touch(self, doc_ids: np.ndarray):
+        self._touched.append(doc_ids)
+        self._candidates = None
+
+    def candidates(self) -> np.ndarray:
+        if self._candidates is None:
+            if not self._touched:
+                self._candidates = np.empty(0, dtype=np.int64)
+            else:
+                self._candidates = np.unique(np.concatenate(self._touched))
+                self._touched = [self._candidates]
+        return self._candidates
+
+    def top_k(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        candidates = self.candidates()
+        if self.live is not None:
+            candidates = candidates[self.live[candidates]]
+        return _top_k(candidates, self.scores[candidates], k)
+
+
+class SegmentedIndex:
+    """Базовый сегмент + дельта-сегменты инкрементальных обновлений, объединяемые на запросе.
+
+    ID документа глобальный: смещение сегмента + локальный ID. С одним сегментом
+    оценки совпадают с BM25Index; с несколькими idf термина запроса считается по df,
+    просуммированному по сегментам, а PRF использует idf каждого сегмента
+    (приближение до ближайшей компакции).
+    """
+
+    def __init__(self, segments: list[Segment], index_id: str = ""):
+        self.segments = segments
+        self.index_id = index_id
+        self.offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([seg.index.num_docs for seg in segments], out=self.offsets[1:])
+        self.num_docs = int(self.offsets[-1])
+        self.num_live = sum(seg.num_live for seg in segments)
+        self.live = None
+        if any(seg.live is not None for seg in segments):
+            self.live = np.concatenate([
+                seg.live if seg.live is not None else np.ones(seg.index.num_docs, dtype=bool)
+                for seg in segments
+            ])
+
+    @classmethod
+    def open(cls, root: Path, manifest: dict) -> "SegmentedIndex":
+        segments = [Segment.open(root, entry) for entry in manifest["segments"]]
+        return cls(segments, index_id=manifest["index_id"])
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def __getitem__(self, doc_id: int) -> Document:
+        s = int(np.searchsorted(self.offsets, doc_id, side="right")) - 1
+        return self.segments[s].chunks[int(doc_id - self.offsets[s])]
+
+    def _resolve(self, term: str) -> tuple[list[int], float]:
+        """ID термина в каждом сегменте (-1 — нет) и его idf по всему индексу"""
+        term_ids = [seg.index.vocab.get(term) for seg in self.segments]
+        if len(self.segments) == 1:
+            tid = term_ids[0]
+            return term_ids, float(self.segments[0].index.idf[tid]) if tid >= 0 else 0.0
+
+        df = sum(seg.index.df(tid) for seg, tid in zip(self.segments, term_ids) if tid >= 0)
+        if df == 0:
+            return term_ids, 0.0
+        idf = float(np.log(self.num_docs - df + 0.5) - np.log(df + 0.5))
+        if idf < 0:
+            base = max(self.segments, key=lambda seg: seg.index.num_docs).index
+            idf = base.epsilon * base.mean_idf
+        return term_ids, idf
+
+    def query_terms(self, tokens: List[str]) -> list[tuple[str, float]]:
+        """(term, вес); повтор термина = больший вес"""
+        return [(t, float(c)) for t, c in Counter(tokens).items()]
+
+    def accumulate(self, terms: Iterable[tuple[str, float]],
+                   acc: ScoreAccumulator | None = None) -> ScoreAccumulator:
+        """Добавляет вклад взвешенных терминов в аккумулятор (новый, если acc=None)"""
+        if acc is None:
+            acc = ScoreAccumulator(self.num_docs, self.live)
+        for term, weight in terms:
+            term_ids, idf = self._resolve(term)
+            for seg, offset, tid in zip(self.segments, self.offsets, term_ids):
+                if tid < 0:
+                    continue
+                index = seg.index
+                lo, hi = index.indptr[tid], index.indptr[tid + 1]
+                docs = index.doc_ids[lo:hi] + offset
+                # внутри одного термина документы уникальны, поэтому += без np.add.at
+                acc.scores[docs] += weight * idf * index.impacts[lo:hi]
+                acc.touch(docs)
+        return acc
+
+    def search(self, tokens: List[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Возвращает (doc_ids, scores) top-k документов, отсортированных по убыванию"""
+        return self.accumulate(self.query_terms(tokens)).top_k(k)
+
+    def feedback_terms(self, doc_ids: np.ndarray, exclude: set[str],
+                       top_terms: int) -> list[tuple[str, float]]:
+        """PRF: термины с наибольшим средним TF-IDF (L2-нормированным) по документам doc_ids"""
+        if len(doc_ids) == 0:
+            return []
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        seg_of_doc = np.searchsorted(self.offsets, doc_ids, side="right") - 1
+
+        totals: dict[str, float] = defaultdict(float)
+        for s in np.unique(seg_of_doc):
+            index = self.segments[s].index
+            term_ids, weights = index.feedback_scores(doc_ids[seg_of_doc == s] - self.offsets[s])
+            # строки нужны только для лучших терминов: идём по убыванию веса
+            # и пропускаем исключённые, пока не наберём top_terms
+            taken = 0
+            for i in np.argsort(-weights, kind="stable"):
+                term = index.vocab.term(int(term_ids[i]))
+                if term in exclude:
+                    continue
+                totals[term] += float(weights[i])
+                taken += 1
+                if taken == top_terms and len(self.segments) == 1:
+                    break
+
+        ranked = sorted(totals.items(), key=lambda x: x[1], reverse=True)[:top_terms]
+        return [(term, score / len(doc_ids)) for term, score in ranked]
+
+
+class BM25SparseRetriever(BaseRetriever):
+    """Замена BM25Retriever из langchain поверх SegmentedIndex.
+
+    Каталог индекса (версия FORMAT_VERSION):
+        manifest.json — index_id, поколение, watermark (articles.last_updated)
+                        и сегменты с article_id удалённых из них статей
+        seg-NNNNNN/   — базовый сегмент и дельты инкрементальных обновлений:
+            meta.json                 — статистики BM25
+            vocab.bin, vocab.offsets.npy — отсортированный словарь
+            indptr/doc_ids/tfs/impacts.npy — CSR-постинги
+            doc_indptr/doc_terms/doc_tfs/doc_norm.npy — прямой индекс для PRF
+            doc_len.npy, idf.npy, doc_article.npy
+            chunks.bin, chunks.offsets.npy — исходные тексты чанков и метаданные (см. ChunkStore)
+
+    Лемматизированный текст нужен только для построения постингов и не хранится;
+    поиск работает с ID, а тексты читаются из ChunkStore только для финальных кандидатов.
+    После обновления или компакции (новый manifest.json) refresh() переоткрывает индекс.
+    """
+
+    path: Path
+    index: SegmentedIndex
+    k: int = 4
+
+    _manifest_mtime: int = PrivateAttr(default=0)
+    _refresh_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def index_id(self) -> str:
+        return self.index.index_id
+
+    @classmethod
+    def build(cls, documents: List[Document], path: Path,
+              tokenize: Callable[[str], List[str]], watermark: str | None = None,
+              **kwargs) -> "BM25SparseRetriever":
+        """Строит индекс из одного сегмента по tokenize(page_content), записывает в path и открывает"""
+        index = BM25Index.build(tokenize(doc.page_content) for doc in documents)
+        return cls.create(path, lambda seg_path: write_segment(seg_path, documents, index), watermark, **kwargs)
+
+    @classmethod
+    def create(cls, path: Path, write_base: Callable[[Path], object],
+               watermark: str | None = None, **kwargs) -> "BM25SparseRetriever":
+        """Новый индекс в path: write_base(каталог) пишет базовый сегмент; затем индекс открывается с диска"""
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        name = segment_name(0)
+        write_base(tmp_path / name)
+        manifest = write_manifest(tmp_path, [{"name": name}], generation=0, watermark=watermark)
+
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_path.rename(path)
+        logger.info("BM25 index %s written to %s", manifest["index_id"], path)
+        return cls.load(path, **kwargs)
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "BM25SparseRetriever":
+        mtime = (path / MANIFEST_FILE).stat().st_mtime_ns
+        retriever = cls(path=path, index=SegmentedIndex.open(path, read_manifest(path)), **kwargs)
+        retriever._manifest_mtime = mtime
+        return retriever
+
+    def refresh(self) -> bool:
+        """Переоткрывает индекс, если manifest.json изменился; True — индекс заменён"""
+        try:
+            mtime = (self.path / MANIFEST_FILE).stat().st_mtime_ns
+        except FileNotFoundError:
+            # полная пересборка как раз подменяет каталог индекса
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        with self._refresh_lock:
+            if mtime == self._manifest_mtime:
+                return False
+            try:
+                index = SegmentedIndex.open(self.path, read_manifest(self.path))
+            except FileNotFoundError as e:
+                # компакция удалила сегменты между чтением манифеста и открытием — повторим позже
+                logger.warning("Index changed while reopening (%s), will retry", e)
+                return False
+            self.index = index
+            self._manifest_mtime = mtime
+        logger.info(
+            "Reopened BM25 index %s: %d segments, %d live chunks",
+            index.index_id, len(index.segments), index.num_live,
+        )
+        return True
+
+    def search(self, tokens: List[str], k: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        return self.index.search(tokens, k or self.k)
+
+    def hydrate(self, doc_ids: Iterable[int]) -> List[Document]:
+        return [self.index[i] for i in doc_ids]
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        # query уже лемматизирован — как и в BM25Retriever, просто split()
+        self.refresh()
+        doc_ids, _ = self.search(query.split())
+        return self.hydrate(doc_ids)
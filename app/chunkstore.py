@@ -0,0 +1,87 @@
+import json
+import mmap
+import logging
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+CHUNKS_FILE = "chunks.bin"
+CHUNK_OFFSETS_FILE = "chunks.offsets.npy"
+
+
+def map_file(path: Path):
+    """Read-only mmap файла (пустой файл отобразить нельзя — для него b"")"""
+    with open(path, "rb") as f:
+        if path.stat().st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ChunkStore:
+    """Чанки корпуса в одном UTF-8 блобе: запись i — blob[offsets[i]:offsets[i+1]].
+
+    Блоб отображается в память через mmap, поэтому документы читаются лениво,
+    а несколько процессов на одной машине делят одни и те же страницы.
+    """
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    @staticmethod
+    def write(path: Path, documents: Iterable[Document]) -> int:
+        """Записывает документы в каталог индекса; возвращает их количество"""
+        with ChunkStoreWriter(path) as writer:
+            writer.extend(documents)
+        return writer.count
+
+    @classmethod
+    def open(cls, path: Path) -> "ChunkStore":
+        return cls(
+            blob=map_file(path / CHUNKS_FILE),
+            offsets=np.load(path / CHUNK_OFFSETS_FILE, mmap_mode="r"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> Document:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        record = json.loads(self._blob[start:end].decode("utf-8"))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+
+class ChunkStoreWriter:
+    """Потоковая запись ChunkStore: документы пишутся в блоб по мере поступления"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path / CHUNKS_FILE, "wb")
+        self._offsets = [0]
+
+    @property
+    def count(self) -> int:
+        return len(self._offsets) - 1
+
+    def extend(self, documents: Iterable[Document]):
+        for doc in documents:
+            record = json.dumps(
+                {"page_content": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            self._file.write(record)
+            self._offsets.append(self._offsets[-1] + len(record))
+
+    def close(self):
+        self._file.close()
+        np.save(self.path / CHUNK_OFFSETS_FILE, np.asarray(self._offsets, dtype=np.int64))
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -11,3 +11,60 @@ OPENROUTER_API_BASE = os.getenv("OPENROUTER_API_BASE")
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
 MAX_RESPONSE_LENGTH = int(os.getenv("MAX_RESPONSE_LENGTH"))
 MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH"))
+
+# Ограничения параллелизма пайплайна (см. app/executor.py)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "2"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+
+# Стриминг ответа правками сообщения (Telegram ограничивает частоту edit_text)
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Размер LRU-кэша лемм (app/lemmatizer.py)
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "300000"))
+
+# Micro-batching реранкера: окно сбора пар от параллельных запросов и предел батча
+RERANK_BATCH_WINDOW_MS = float(os.getenv("RERANK_BATCH_WINDOW_MS", "10"))
+RERANK_MAX_BATCH = int(os.getenv("RERANK_MAX_BATCH", "128"))
+
+# Кэш оценок реранкера (запрос, чанк) -> score; 0 — отключить
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "200000"))
+
+# Реранкер: модель и бэкенд (torch | onnx | onnx-int8); ONNX-экспорт кэшируется в RERANKER_ONNX_DIR
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-v2-m3")
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")
+RERANKER_ONNX_DIR = Path(os.getenv("RERANKER_ONNX_DIR", "onnx_models"))
+
+# Адаптивный каскад ретривера (см. BM25PrfRerankRetriever._plan)
+CASCADE_ADAPTIVE = os.getenv("CASCADE_ADAPTIVE", "0") == "1"
+CASCADE_SKIP_PRF_GAP = float(os.getenv("CASCADE_SKIP_PRF_GAP", "0.6"))
+CASCADE_SKIP_PRF_TITLE = float(os.getenv("CASCADE_SKIP_PRF_TITLE", "1.0"))
+CASCADE_SHRINK_GAP = float(os.getenv("CASCADE_SHRINK_GAP", "0.8"))
+CASCADE_RERANK_CANDIDATES = int(os.getenv("CASCADE_RERANK_CANDIDATES", "10"))
+
+# Кэш ответов (app/answer_cache.py); ANSWER_CACHE_FILE пустой — только в памяти,
+# иначе файл перезаписывается не чаще раза в ANSWER_CACHE_FLUSH_INTERVAL секунд
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_FLUSH_INTERVAL = float(os.getenv("ANSWER_CACHE_FLUSH_INTERVAL", "5"))
+ANSWER_CACHE_FILE = Path(os.getenv("ANSWER_CACHE_FILE")) if os.getenv("ANSWER_CACHE_FILE") else None
+
+# Инкрементальное обновление индекса по articles.last_updated (app/indexer.py); 0 — только вручную.
+# Компакция сегментов — когда дельт больше INDEX_COMPACT_MAX_SEGMENTS или их доля > INDEX_COMPACT_RATIO
+INDEX_UPDATE_INTERVAL = float(os.getenv("INDEX_UPDATE_INTERVAL", "0"))
+INDEX_COMPACT_MAX_SEGMENTS = int(os.getenv("INDEX_COMPACT_MAX_SEGMENTS", "8"))
+INDEX_COMPACT_RATIO = float(os.getenv("INDEX_COMPACT_RATIO", "0.2"))
+
+# Параллельная сборка индекса: процессов лемматизации (0 — все ядра), чанков на шард,
+# период логирования прогресса в секундах (0 — не логировать)
+INDEX_BUILD_WORKERS = int(os.getenv("INDEX_BUILD_WORKERS", "0"))
+INDEX_BUILD_SHARD_SIZE = int(os.getenv("INDEX_BUILD_SHARD_SIZE", "2000"))
+INDEX_BUILD_PROGRESS_INTERVAL = float(os.getenv("INDEX_BUILD_PROGRESS_INTERVAL", "10"))
+
+# Первый этап каскада: bm25 — сегментированный индекс в памяти (mmap), fts — SQLite FTS5 на диске
+# (app/fts.py); FTS_CANDIDATES — сколько документов FTS5 отдаёт на каждый MATCH
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "bm25")
+FTS_CANDIDATES = int(os.getenv("FTS_CANDIDATES", "1000"))
+
+# HTTP API (app/api.py): сколько вопросов принимает /ask/batch за один запрос
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", "32"))
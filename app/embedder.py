@@ -1,131 +1,243 @@
+import os
 import re
-import pickle
+import time
 import logging
+import multiprocessing
+from collections import Counter, defaultdict, deque
 from pathlib import Path
-from typing import List
+from typing import Any, Iterable, List
 
-from pymorphy2 import MorphAnalyzer
+import numpy as np
 from pydantic import Field
 from langchain_core.documents import Document
-from langchain_community.retrievers import BM25Retriever
 from langchain.schema import BaseRetriever
-from sentence_transformers import CrossEncoder
-from sklearn.feature_extraction.text import TfidfVectorizer
 from stop_words import get_stop_words
 
-from app.config import CHROMA_PERSIST_DIR
+from app.config import (
+    CHROMA_PERSIST_DIR, LEMMA_CACHE_SIZE, RERANK_BATCH_WINDOW_MS, RERANK_MAX_BATCH, RERANK_CACHE_SIZE,
+    RERANKER_MODEL, RERANKER_BACKEND, RERANKER_ONNX_DIR,
+    CASCADE_ADAPTIVE, CASCADE_SKIP_PRF_GAP, CASCADE_SKIP_PRF_TITLE, CASCADE_SHRINK_GAP, CASCADE_RERANK_CANDIDATES,
+    INDEX_BUILD_WORKERS, INDEX_BUILD_SHARD_SIZE, INDEX_BUILD_PROGRESS_INTERVAL, RETRIEVAL_BACKEND, FTS_CANDIDATES,
+)
+from app.lemmatizer import LemmaCache
+from app.bm25 import (
+    BM25Index, BM25SparseRetriever, ScoreAccumulator, SegmentedIndex, SegmentWriter, ShardStats, index_exists,
+    index_lock,
+)
+from app.fts import FtsAccumulator, FtsIndex, FtsIndexWriter, FtsRetriever, fts_index_exists
+from app.reranker import BatchingReranker, RerankScoreCache, load_reranker
 
 logger = logging.getLogger(__name__)
 
-VECTORSTORE_FILE = CHROMA_PERSIST_DIR / "bm25_vectorstore.pkl"
-morph = MorphAnalyzer()
+INDEX_DIR = CHROMA_PERSIST_DIR / "bm25_index"
+FTS_INDEX_FILE = CHROMA_PERSIST_DIR / "fts_index.db"
+# индексы первого этапа с общим интерфейсом запросов (см. FtsIndex)
+LexicalIndex = SegmentedIndex | FtsIndex
+Accumulator = ScoreAccumulator | FtsAccumulator
+LEMMA_CACHE_FILE = CHROMA_PERSIST_DIR / "lemmas.json"
+RERANK_CACHE_FILE = CHROMA_PERSIST_DIR / "rerank_cache.pkl"
+lemma_cache = LemmaCache(maxsize=LEMMA_CACHE_SIZE)
 
 # ---------- базовые утилиты ----------
+def _words(text: str) -> list[str]:
+    # токенизация; отбрасываем очень короткие токены
+    return [w for w in re.findall(r"\w+", text.lower()) if len(w) > 2]
+
 def _tokenize_ru(text: str) -> list[str]:
-    # токенизация + лемматизация; отбрасываем очень короткие токены
-    return [morph.parse(w)[0].normal_form
-            for w in re.findall(r"\w+", text.lower())
-            if len(w) > 2]
+    # токенизация + лемматизация
+    return [lemma_cache.lemma(w) for w in _words(text)]
 
 def lemmatize_text(text: str) -> str:
     return " ".join(_tokenize_ru(text))
 
-# ---------- BM25 индекс ----------
-def build_bm25_retriever(documents: list[Document]) -> BM25Retriever:
-    if VECTORSTORE_FILE.exists():
-        logger.info("Loading an existing BM25 retriever")
-        with open(VECTORSTORE_FILE, "rb") as f:
-            return pickle.load(f)
-
-    logger.info("Building a new BM25 retriever")
-
-    lemmatized_docs = [
-        Document(
-            page_content=lemmatize_text(doc.page_content),
-            metadata={"original": doc.page_content, **doc.metadata}
+# ---------- построение BM25 индекса ----------
+def _lemmatize_shard(texts: list[str]) -> tuple[ShardStats, list[tuple[str, str]]]:
+    """Лемматизация шарда (в процессе пула): статистики шарда + его словарь word -> lemma"""
+    docs = [_words(text) for text in texts]
+    lemmas: dict[str, str] = {}
+    for words in docs:
+        for w in words:
+            if w not in lemmas:
+                lemmas[w] = lemma_cache.lemma(w)
+    stats = ShardStats.from_counts(Counter(lemmas[w] for w in words) for words in docs)
+    return stats, list(lemmas.items())
+
+def _collect_shards(results, progress_interval: float):
+    """Пробрасывает статистики шардов в from_shards, пополняя кэш лемм и логируя прогресс"""
+    start = last_report = time.monotonic()
+    done = 0
+    for stats, lemmas in results:
+        lemma_cache.update(lemmas)
+        done += len(stats.doc_indptr) - 1
+        now = time.monotonic()
+        if progress_interval and now - last_report >= progress_interval:
+            last_report = now
+            logger.info("Lemmatized %d chunks (%.0f chunks/s)", done, done / max(now - start, 1e-9))
+        yield stats
+    logger.info("Lemmatized %d chunks in %.1fs", done, time.monotonic() - start)
+
+def _map_shards(shards: Iterable[list[str]], workers: int):
+    """_lemmatize_shard по шардам в порядке поступления; в работе не больше 2 * workers шардов"""
+    if workers == 1:
+        yield from map(_lemmatize_shard, shards)
+        return
+
+    # fork: воркеры наследуют загруженный pymorphy2 и кэш лемм.
+    # Pool.imap вычитал бы весь генератор шардов сразу, поэтому окно задач — вручную
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.apply_async(_lemmatize_shard, (shard,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def build_segment(path: Path, documents: Iterable[Document], workers: int = INDEX_BUILD_WORKERS,
+                  shard_size: int = INDEX_BUILD_SHARD_SIZE,
+                  progress_interval: float = INDEX_BUILD_PROGRESS_INTERVAL) -> dict:
+    """
+    Потоковая сборка сегмента индекса из документов (генератор лоадера подходит).
+    Чанки пишутся на диск шардами по shard_size, так что в памяти одновременно
+    только несколько шардов, а не весь корпус. pymorphy2 — чистый Python, поэтому
+    лемматизация шардов идёт в пуле из workers процессов (0 — все ядра). Шарды
+    сливаются в порядке документов: индекс побайтно совпадает с последовательным.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = SegmentWriter(path)
+
+    def shards():
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == shard_size:
+                writer.add(batch)
+                yield [d.page_content for d in batch]
+                batch = []
+        if batch:
+            writer.add(batch)
+            yield [d.page_content for d in batch]
+
+    logger.info("Building index segment %s (%d workers, %d chunks per shard)", path.name, workers, shard_size)
+    index = BM25Index.from_shards(_collect_shards(_map_shards(shards(), workers), progress_interval))
+    return writer.finish(index)
+
+def build_bm25_retriever(documents: Iterable[Document], watermark: str | None = None,
+                         workers: int = INDEX_BUILD_WORKERS) -> BM25SparseRetriever:
+    # воркеры API и бот стартуют одновременно: индекс строит первый, остальные ждут
+    # блокировку и открывают готовый (create удаляет чужой незаконченный .tmp)
+    with index_lock(INDEX_DIR):
+        if index_exists(INDEX_DIR):
+            logger.info("Opening an existing BM25 index")
+            lemma_cache.load(LEMMA_CACHE_FILE)
+            return BM25SparseRetriever.load(INDEX_DIR, k=200)
+
+        logger.info("Building a new BM25 retriever")
+
+        # в индекс идут только леммы, тексты чанков хранятся один раз — в исходном виде
+        retriever = BM25SparseRetriever.create(
+            INDEX_DIR, lambda path: build_segment(path, documents, workers=workers), watermark=watermark, k=200,
         )
-        for doc in documents
-    ]
 
-    
+        # словарь корпуса — затравка для кэша лемм на запросах
+        lemma_cache.save(LEMMA_CACHE_FILE)
+        logger.info("Lemma cache after build: %s", lemma_cache.stats())
 
-    retriever = BM25Retriever.from_documents(lemmatized_docs)
-    retriever.k = 200
+        return retriever
 
-    CHROMA_PERSIST_DIR.mkdir(parents=True, exist_ok=True)
-    with open(VECTORSTORE_FILE, "wb") as f:
-        pickle.dump(retriever, f)
 
-    return retriever
+def build_fts_index(path: Path, documents: Iterable[Document], watermark: str | None = None,
+                    workers: int = INDEX_BUILD_WORKERS, shard_size: int = INDEX_BUILD_SHARD_SIZE,
+                    progress_interval: float = INDEX_BUILD_PROGRESS_INTERVAL, **meta) -> dict:
+    """
+    Потоковая сборка FTS-индекса (app/fts.py): та же лемматизация шардами в пуле,
+    что и у build_segment, но леммы и прямой индекс пишутся в SQLite-файл.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = FtsIndexWriter(path)
+    pending: deque[list[Document]] = deque()
+
+    def shards():
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == shard_size:
+                pending.append(batch)
+                yield [d.page_content for d in batch]
+                batch = []
+        if batch:
+            pending.append(batch)
+            yield [d.page_content for d in batch]
+
+    logger.info("Building FTS index %s (%d workers, %d chunks per shard)", path.name, workers, shard_size)
+    # шарды возвращаются в порядке подачи, так что документы шарда — первые в очереди
+    for stats in _collect_shards(_map_shards(shards(), workers), progress_interval):
+        writer.add(pending.popleft(), stats)
+    return writer.finish(watermark, **meta)
+
+def first_stage_exists(backend: str = RETRIEVAL_BACKEND) -> bool:
+    """Построен ли индекс первого этапа для бэкенда (иначе нужен поток чанков из базы)"""
+    return fts_index_exists(FTS_INDEX_FILE) if backend == "fts" else index_exists(INDEX_DIR)
+
+def build_fts_retriever(documents: Iterable[Document], watermark: str | None = None,
+                        workers: int = INDEX_BUILD_WORKERS) -> FtsRetriever:
+    # как и для BM25: строит один процесс, остальные после блокировки открывают готовый файл
+    with index_lock(FTS_INDEX_FILE):
+        if fts_index_exists(FTS_INDEX_FILE):
+            logger.info("Opening an existing FTS index")
+            lemma_cache.load(LEMMA_CACHE_FILE)
+            return FtsRetriever.load(FTS_INDEX_FILE, candidates=FTS_CANDIDATES, k=200)
+
+        logger.info("Building a new FTS index")
+        build_fts_index(FTS_INDEX_FILE, documents, watermark=watermark, workers=workers)
+        lemma_cache.save(LEMMA_CACHE_FILE)
+        logger.info("Lemma cache after build: %s", lemma_cache.stats())
+        return FtsRetriever.load(FTS_INDEX_FILE, candidates=FTS_CANDIDATES, k=200)
 
 # ---------- PRF на TF-IDF ----------
+PRF_STOP_WORDS = set(get_stop_words("ru")) | {"заголовок", "статья"}
+
 def _build_prf_expansion_terms(
     query: str,
-    docs: List[Document],
+    index: LexicalIndex,
+    doc_ids: np.ndarray,
     top_terms: int = 8,
-) -> list[str]:
+) -> list[tuple[str, float]]:
     """
-    Возвращает список терминов (леммы) для расширения запроса.
-    Используем TF-IDF по top-N документах.
+    Возвращает термины (леммы) для расширения запроса с их весами.
+    TF-IDF по top-N документам: tf из прямого индекса, idf — глобальный по корпусу,
+    так что ни токенизации текстов, ни обучения векторизатора на запросе нет.
     """
-    if not docs:
+    if len(doc_ids) == 0:
         return []
 
-    # корпус = тексты top-N (оригиналы, а не лемматизированные)
-    texts = [d.metadata.get("original", d.page_content) for d in docs]
-
-    # Векторизатор: используем наш токенизатор, без стоп-слов (они уже выпиливаются лемматизацией и df)
+    # термины исходного запроса и стоп-слова не добавляем
+    exclude = PRF_STOP_WORDS | set(_tokenize_ru(query))
+    return index.feedback_terms(doc_ids, exclude, top_terms)
 
-    russian_stopwords = set(get_stop_words("ru")) | {"заголовок", "статья"} 
-    vectorizer = TfidfVectorizer(tokenizer=_tokenize_ru, lowercase=True, stop_words=russian_stopwords)
-    tfidf = vectorizer.fit_transform(texts)  # shape: (N_docs, V)
-
-    # Средний вес термина по всем документах (centroid в терм-пространстве TF-IDF)
-    mean_scores = tfidf.mean(axis=0).A1  # -> np.array shape (V,)
-    vocab = vectorizer.get_feature_names_out()
-
-    # термины исходного запроса (чтобы не дублировать)
-    q_terms = set(_tokenize_ru(query))
-
-    # сортируем по весу, исключая термины из запроса
-    ranked = [(term, score) for term, score in zip(vocab, mean_scores) if term not in q_terms]
-    ranked.sort(key=lambda x: x[1], reverse=True)
-
-    return [t for t, _ in ranked[:top_terms]]
-
-def _expand_query_with_terms(
-    query: str,
-    terms: list[str],
-    weights: list[float] | None = None,
-    max_repeat: int = 3,
-) -> str:
+def _weight_expansion_terms(
+    terms: list[tuple[str, float]],
+    max_weight: float = 3.0,
+) -> list[tuple[str, float]]:
     """
-    Для BM25 нет явных весов, поэтому моделируем веса повторением терминов.
-    Если weights не заданы — используем единичные.
+    Переводит PRF-оценки терминов в веса запроса: линейно в [1, max_weight].
+    Если оценки равны — все веса единичные.
     """
     if not terms:
-        return query
-
-    if weights is None:
-        weights = [1.0] * len(terms)
-
-    # нормируем в [0, 1]
-    w_min, w_max = min(weights), max(weights)
-    if w_max == w_min:
-        reps = [1] * len(terms)
-    else:
-        reps = [1 + int((w - w_min) / (w_max - w_min) * (max_repeat - 1)) for w in weights]
-
-    expanded_tail = []
-    for term, r in zip(terms, reps):
-        expanded_tail.extend([term] * r)
+        return []
 
-    return (query + " " + " ".join(expanded_tail)).strip()
+    scores = [s for _, s in terms]
+    s_min, s_max = min(scores), max(scores)
+    if s_max == s_min:
+        return [(t, 1.0) for t, _ in terms]
+    return [(t, 1.0 + (s - s_min) / (s_max - s_min) * (max_weight - 1.0)) for t, s in terms]
 
-# ---------- Каскад: BM25 → PRF(BM25) → CrossEncoder ----------
+# ---------- Каскад: BM25 → PRF(+BM25 по терминам расширения) → CrossEncoder ----------
 class BM25PrfRerankRetriever(BaseRetriever):
-    bm25_retriever: BM25Retriever = Field(...)
-    reranker: CrossEncoder = Field(...)
+    # первый этап: BM25 в памяти или FTS5 на диске — интерфейс индекса один
+    bm25_retriever: BM25SparseRetriever | FtsRetriever = Field(...)
+    reranker: Any = Field(...)  # CrossEncoder или BatchingReranker — нужен только predict(pairs)
+    score_cache: RerankScoreCache | None = Field(default=None)
 
     # Stage 1: начальный BM25
     top_k_stage1: int = Field(default=200)
@@ -134,69 +246,197 @@ class BM25PrfRerankRetriever(BaseRetriever):
     prf_enable: bool = Field(default=True)
     prf_top_docs: int = Field(default=10)   # на скольких документах считаем TF-IDF
     prf_top_terms: int = Field(default=8)   # сколько слов добавить
-    prf_max_repeat: int = Field(default=3)  # макс. кратность добавления термина
+    prf_max_repeat: float = Field(default=3)  # макс. вес термина расширения
 
     # Stage 2: финальный срез + порог
     top_k_final: int = Field(default=20)
     score_threshold: float = Field(default=0.3)
 
-    def _stage1(self, query: str) -> List[Document]:
-        return self.bm25_retriever.get_relevant_documents(lemmatize_text(query))[:self.top_k_stage1]
-
-    def _apply_prf(self, query: str, candidates: List[Document]) -> str:
-        if not self.prf_enable:
-            return query
-        top_for_prf = candidates[: self.prf_top_docs]
-        terms = _build_prf_expansion_terms(query, top_for_prf, top_terms=self.prf_top_terms)
-
-        # можно прокинуть веса (если захочешь) — сейчас используем равные
-        q_expanded = _expand_query_with_terms(
-            query=query,
-            terms=terms,
-            weights=None,
-            max_repeat=self.prf_max_repeat
+    # Адаптивный каскад: пропуск PRF / сокращение реранка, если stage 1 уверен
+    adaptive_enable: bool = Field(default=False)
+    adaptive_gap_rank: int = Field(default=10)            # gap = (s[0] - s[k-1]) / s[0]
+    adaptive_skip_prf_gap: float = Field(default=0.6)     # gap >= порога → без PRF
+    adaptive_skip_prf_title: float = Field(default=1.0)   # доля лемм запроса в заголовке top-1 → без PRF
+    adaptive_shrink_gap: float = Field(default=0.8)       # gap >= порога → реранк только top-N
+    adaptive_rerank_candidates: int = Field(default=10)
+
+    # stage_timer(stage, seconds) после каждого выполненного этапа: stage1, prf, stage2, rerank
+    # (benchmarks/retrieval.py); пропущенные каскадом этапы не сообщаются
+    stage_timer: Any = Field(default=None)
+
+    @property
+    def index_id(self) -> str:
+        return self.bm25_retriever.index_id
+
+    def refresh(self) -> bool:
+        """Переоткрывает индекс первого этапа, если его заменили на диске; True — индекс заменён"""
+        return self.bm25_retriever.refresh()
+
+    def _timed(self, stage: str, started: float) -> float:
+        now = time.perf_counter()
+        if self.stage_timer is not None:
+            self.stage_timer(stage, now - started)
+        return now
+
+    def _stage1(self, index: LexicalIndex, query: str) -> tuple[Accumulator, np.ndarray, np.ndarray]:
+        acc = index.accumulate(index.query_terms(_tokenize_ru(query)))
+        doc_ids, scores = acc.top_k(self.top_k_stage1)
+        return acc, doc_ids, scores
+
+    def _title_match(self, index: LexicalIndex, query: str, doc_id: int) -> float:
+        """Доля значимых лемм запроса, входящих в заголовок статьи чанка"""
+        q_terms = set(_tokenize_ru(query)) - PRF_STOP_WORDS
+        if not q_terms:
+            return 0.0
+        title = index[doc_id].metadata.get("title") or ""
+        return len(q_terms & set(_tokenize_ru(title))) / len(q_terms)
+
+    def _plan(self, index: LexicalIndex, query: str, doc_ids: np.ndarray, scores: np.ndarray) -> tuple[bool, int]:
+        """Решение каскада по stage 1: (делать ли PRF, сколько кандидатов реранкать)"""
+        if not self.adaptive_enable or len(scores) == 0 or scores[0] <= 0:
+            return self.prf_enable, self.top_k_stage1
+
+        # если кандидатов меньше k, недостающие оценки считаем нулевыми
+        kth = scores[self.adaptive_gap_rank - 1] if len(scores) >= self.adaptive_gap_rank else 0.0
+        gap = float((scores[0] - kth) / scores[0])
+        title_match = self._title_match(index, query, int(doc_ids[0]))
+
+        use_prf = self.prf_enable and gap < self.adaptive_skip_prf_gap \
+            and title_match < self.adaptive_skip_prf_title
+        n_rerank = self.top_k_stage1
+        if gap >= self.adaptive_shrink_gap:
+            n_rerank = min(self.adaptive_rerank_candidates, self.top_k_stage1)
+
+        logger.info(
+            "Cascade decision: query=%r gap=%.3f title_match=%.2f prf=%s rerank=%d",
+            query, gap, title_match, use_prf, n_rerank,
         )
-        return q_expanded
+        return use_prf, n_rerank
 
-    def _stage2(self, query: str) -> List[Document]:
-        # повторный BM25 уже по расширенному запросу
-        return self.bm25_retriever.get_relevant_documents(lemmatize_text(query))[:self.top_k_stage1]
+    def _apply_prf(self, index: LexicalIndex, query: str, candidates: np.ndarray) -> list[tuple[str, float]]:
+        """Взвешенные термины расширения (term, weight)"""
+        terms = _build_prf_expansion_terms(
+            query, index, candidates[: self.prf_top_docs], top_terms=self.prf_top_terms,
+        )
+        return _weight_expansion_terms(terms, max_weight=self.prf_max_repeat)
+
+    def _stage2(self, index: LexicalIndex, acc: Accumulator,
+                expansion: list[tuple[str, float]]) -> np.ndarray:
+        # досчитываем только термины расширения поверх оценок stage 1
+        index.accumulate(expansion, acc)
+        doc_ids, _ = acc.top_k(self.top_k_stage1)
+        return doc_ids
+
+    def _rerank_many(self, index_id: str, queries: list[str], candidate_ids: list[np.ndarray],
+                     candidates: list[List[Document]]) -> list[list[float]]:
+        """CrossEncoder только по парам, которых нет в кэше оценок; пары всех запросов — один predict"""
+        if self.score_cache is None:
+            scores = [[None] * len(docs) for docs in candidates]
+        else:
+            query_keys = [lemmatize_text(query) for query in queries]
+            scores = [
+                self.score_cache.get_many(index_id, key, ids)
+                for key, ids in zip(query_keys, candidate_ids)
+            ]
+        missing = [(q, i) for q, query_scores in enumerate(scores)
+                   for i, score in enumerate(query_scores) if score is None]
+        if missing:
+            fresh = self.reranker.predict([(queries[q], candidates[q][i].page_content) for q, i in missing])
+            for (q, i), score in zip(missing, fresh):
+                scores[q][i] = float(score)
+            if self.score_cache is not None:
+                fresh_by_query = defaultdict(list)
+                for q, i in missing:
+                    fresh_by_query[q].append(i)
+                for q, fresh_ids in fresh_by_query.items():
+                    self.score_cache.put_many(
+                        index_id, query_keys[q], [candidate_ids[q][i] for i in fresh_ids],
+                        [scores[q][i] for i in fresh_ids],
+                    )
+        logger.debug(
+            "Rerank: %d queries, %d cached, %d scored",
+            len(queries), sum(map(len, scores)) - len(missing), len(missing),
+        )
+        return scores
 
-    def _get_relevant_documents(self, query: str) -> List[Document]:
+    def _candidates(self, index: LexicalIndex, query: str) -> np.ndarray:
+        """Этапы до реранка: id кандидатов для CrossEncoder"""
         # 1) первичный BM25
-        initial = self._stage1(query)
-
-        # 2) PRF: строим q'
-        q_prime = self._apply_prf(query, initial)
-        print(q_prime)
-
-        # 3) вторичный BM25 на q'
-        candidates = self._stage2(q_prime)
-
-        # 4) реранкинг CrossEncoder (по ОРИГИНАЛАМ текстов)
-        pairs = [(query, doc.metadata.get("original", doc.page_content)) for doc in candidates]
-        scores = self.reranker.predict(pairs)
-
+        started = time.perf_counter()
+        acc, initial, initial_scores = self._stage1(index, query)
+        use_prf, n_rerank = self._plan(index, query, initial, initial_scores)
+        started = self._timed("stage1", started)
+
+        # 2) PRF: взвешенные термины расширения
+        expansion = []
+        if use_prf:
+            expansion = self._apply_prf(index, query, initial)
+            started = self._timed("prf", started)
+        logger.debug("PRF expansion for %r: %s", query, expansion)
+
+        # 3) BM25 по q' = q + расширение (исходные термины уже в аккумуляторе)
+        candidate_ids = initial
+        if expansion:
+            candidate_ids = self._stage2(index, acc, expansion)
+            self._timed("stage2", started)
+        return candidate_ids[:n_rerank]
+
+    def _select(self, candidates: List[Document], scores: list[float]) -> List[Document]:
         reranked = [
-            (Document(page_content=doc.metadata.get("original", doc.page_content), metadata=doc.metadata), score)
+            (doc, score)
             for doc, score in zip(candidates, scores)
             if score >= self.score_threshold
         ]
         reranked.sort(key=lambda x: x[1], reverse=True)
         return [doc for doc, _ in reranked[: self.top_k_final]]
 
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        return self.retrieve_many([query])[0]
+
+    def retrieve_many(self, queries: list[str]) -> list[List[Document]]:
+        """Документы для нескольких запросов: одна версия индекса и один проход реранкера на всех"""
+        # весь запрос работает с одной версией индекса, даже если её заменит обновление
+        self.refresh()
+        index = self.bm25_retriever.index
+
+        candidate_ids = [self._candidates(index, query) for query in queries]
+
+        # 4) реранкинг CrossEncoder (по ОРИГИНАЛАМ текстов — читаем их только для кандидатов)
+        started = time.perf_counter()
+        candidates = [[index[i] for i in ids] for ids in candidate_ids]
+        scores = self._rerank_many(index.index_id, queries, candidate_ids, candidates)
+        self._timed("rerank", started)
+        logger.debug("Lemma cache: %s", lemma_cache.stats())
+        return [self._select(docs, doc_scores) for docs, doc_scores in zip(candidates, scores)]
+
 # ---------- фабрика ----------
-def build_or_load_vectorstore(documents: list[Document]) -> BM25PrfRerankRetriever:
-    logger.info("Create or download Cascade Retriever (BM25 → PRF → Reranker)")
+def build_or_load_vectorstore(documents: Iterable[Document], watermark: str | None = None,
+                              backend: str = RETRIEVAL_BACKEND) -> BM25PrfRerankRetriever:
+    logger.info("Create or download Cascade Retriever (%s → PRF → Reranker)", backend.upper())
+
+    if backend == "fts":
+        bm25_retriever = build_fts_retriever(documents, watermark=watermark)
+    elif backend == "bm25":
+        bm25_retriever = build_bm25_retriever(documents, watermark=watermark)
+    else:
+        raise ValueError(f"Unknown retrieval backend: {backend!r} (expected 'bm25' or 'fts')")
 
-    bm25_retriever = build_bm25_retriever(documents)
+    logger.info("Load reranker %s (backend=%s)", RERANKER_MODEL, RERANKER_BACKEND)
+    reranker = BatchingReranker(
+        load_reranker(RERANKER_BACKEND, RERANKER_MODEL, RERANKER_ONNX_DIR),
+        batch_window=RERANK_BATCH_WINDOW_MS / 1000,
+        max_batch_size=RERANK_MAX_BATCH,
+    )
 
-    logger.info("Load CrossEncoder (reranker)")
-    reranker = CrossEncoder("BAAI/bge-reranker-v2-m3")
+    score_cache = None
+    if RERANK_CACHE_SIZE > 0:
+        score_cache = RerankScoreCache(RERANK_CACHE_FILE, maxsize=RERANK_CACHE_SIZE)
+        score_cache.load(bm25_retriever.index_id)
 
     return BM25PrfRerankRetriever(
         bm25_retriever=bm25_retriever,
         reranker=reranker,
+        score_cache=score_cache,
         top_k_stage1=50,
         top_k_final=6,
         prf_enable=True,
@@ -204,4 +444,9 @@ def build_or_load_vectorstore(documents: list[Document]) -> BM25PrfRerankRetriev
         prf_top_terms=7,
         prf_max_repeat=3,
         score_threshold=0.3,
+        adaptive_enable=CASCADE_ADAPTIVE,
+        adaptive_skip_prf_gap=CASCADE_SKIP_PRF_GAP,
+        adaptive_skip_prf_title=CASCADE_SKIP_PRF_TITLE,
+        adaptive_shrink_gap=CASCADE_SHRINK_GAP,
+        adaptive_rerank_candidates=CASCADE_RERANK_CANDIDATES,
     )
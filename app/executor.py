@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from app.config import RETRIEVAL_WORKERS, LLM_CONCURRENCY
+from app.rag import collect_sources
+from app.answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+
+class RagExecutor:
+    """Выполняет RAG-пайплайн вне event loop.
+
+    Ретрив (BM25, PRF, CrossEncoder) — CPU-bound, идёт в отдельный пул потоков.
+    Генерация — I/O-bound, идёт через async API цепочки под своим семафором.
+    Вопросы одного пользователя обрабатываются строго по очереди (FIFO).
+    Готовые ответы берутся из AnswerCache, если он передан.
+    Пачка вопросов (answer_many) ретривится одной задачей пула с общим проходом реранкера.
+    """
+
+    def __init__(self, retriever, answer_chain,
+                 retrieval_workers: int = RETRIEVAL_WORKERS,
+                 llm_concurrency: int = LLM_CONCURRENCY,
+                 answer_cache=None):
+        self.retriever = retriever
+        self.answer_chain = answer_chain
+        self.answer_cache = answer_cache
+        self._retrieval_pool = ThreadPoolExecutor(
+            max_workers=retrieval_workers,
+            thread_name_prefix="retrieval",
+        )
+        self._llm_slots = asyncio.Semaphore(llm_concurrency)
+        # user_id -> [lock, число ожидающих]; asyncio.Lock отдаёт захват в порядке очереди
+        self._user_turns: dict[int, list] = {}
+        logger.info(
+            "RagExecutor initialized (retrieval_workers=%d, llm_concurrency=%d)",
+            retrieval_workers, llm_concurrency,
+        )
+
+    @asynccontextmanager
+    async def user_turn(self, user_id: int):
+        """Очередь вопросов одного пользователя"""
+        turn = self._user_turns.setdefault(user_id, [asyncio.Lock(), 0])
+        turn[1] += 1
+        try:
+            async with turn[0]:
+                yield
+        finally:
+            turn[1] -= 1
+            if turn[1] == 0:
+                del self._user_turns[user_id]
+
+    async def retrieve(self, question: str) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._retrieval_pool, self.retriever.invoke, question)
+
+    async def retrieve_many(self, questions: list[str]) -> list[list]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._retrieval_pool, self.retriever.retrieve_many, questions)
+
+    async def generate(self, question: str, context: list) -> str:
+        async with self._llm_slots:
+            return await self.answer_chain.ainvoke({"input": question, "context": context})
+
+    async def stream(self, question: str, context: list):
+        """Генерация по токенам; слот LLM держится до конца стрима"""
+        async with self._llm_slots:
+            async for token in self.answer_chain.astream({"input": question, "context": context}):
+                yield token
+
+    @property
+    def index_id(self) -> str:
+        return getattr(self.retriever, "index_id", "")
+
+    async def current_index_id(self) -> str:
+        """index_id после проверки индекса на диске: пересборка или update сбрасывают кэш ответов сразу"""
+        refresh = getattr(self.retriever, "refresh", None)
+        if refresh is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._retrieval_pool, refresh)
+        return self.index_id
+
+    async def cached(self, question: str) -> dict | None:
+        """{"answer", "sources"} из кэша ответов или None"""
+        if self.answer_cache is None:
+            return None
+        index_id = await self.current_index_id()
+        loop = asyncio.get_running_loop()
+        # ключ кэша — леммы вопроса, лемматизация не должна идти в event loop
+        return await loop.run_in_executor(None, self.answer_cache.get, index_id, question)
+
+    async def remember(self, question: str, answer: str, sources: list[tuple[str, str]]):
+        if self.answer_cache is None or not answer:
+            return
+        loop = asyncio.get_running_loop()
+        # put лемматизирует вопрос — не делаем это в event loop
+        try:
+            index_id = await self.current_index_id()
+            await loop.run_in_executor(None, self.answer_cache.put, index_id, question, answer, sources)
+        except Exception as e:
+            # ответ уже получен: без записи в кэш пользователь его всё равно увидит
+            logger.error("Failed to cache answer: %s", str(e), exc_info=True)
+
+    async def answer(self, question: str) -> dict:
+        """{"input", "answer", "sources": [(title, url)], "cached"}"""
+        cached = await self.cached(question)
+        if cached is not None:
+            return {"input": question, "cached": True, **cached}
+
+        context = await self.retrieve(question)
+        answer = await self.generate(question, context)
+        sources = collect_sources(context)
+        await self.remember(question, answer, sources)
+        return {"input": question, "answer": answer, "sources": sources, "cached": False}
+
+    async def answer_many(self, questions: list[str]) -> list[dict]:
+        """answer для пачки вопросов, в исходном порядке.
+
+        Одинаковые после нормализации вопросы считаются один раз; ошибка генерации
+        одного вопроса не роняет остальные — у него будет "error" вместо "answer".
+        """
+        loop = asyncio.get_running_loop()
+        keys = await loop.run_in_executor(None, lambda: [normalize_question(question) for question in questions])
+        # вопросы без значимых слов не склеиваются: "ок" и "hi" — разные вопросы
+        keys = [key or i for i, key in enumerate(keys)]
+        unique = {}
+        for key, question in zip(keys, questions):
+            unique.setdefault(key, question)
+        results, pending = {}, []
+        for key, question in unique.items():
+            cached = await self.cached(question)
+            if cached is not None:
+                results[key] = {"cached": True, **cached}
+            else:
+                pending.append((key, question))
+
+        if pending:
+            contexts = await self.retrieve_many([question for _, question in pending])
+            answers = await asyncio.gather(
+                *(self.generate(question, context) for (_, question), context in zip(pending, contexts)),
+                return_exceptions=True,
+            )
+            for (key, question), context, answer in zip(pending, contexts, answers):
+                sources = collect_sources(context)
+                if isinstance(answer, Exception):
+                    logger.error("Batch answer failed for %r: %s", question, answer)
+                    results[key] = {"answer": None, "error": str(answer), "sources": sources, "cached": False}
+                    continue
+                await self.remember(question, answer, sources)
+                results[key] = {"answer": answer, "sources": sources, "cached": False}
+        logger.info(
+            "Batch of %d questions: %d unique, %d answered from cache",
+            len(questions), len(unique), len(unique) - len(pending),
+        )
+        return [{"input": question, **results[key]} for question, key in zip(questions, keys)]
+
+    def shutdown(self):
+        self._retrieval_pool.shutdown(wait=False, cancel_futures=True)
+        if self.answer_cache is not None:
+            self.answer_cache.close()
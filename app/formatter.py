@@ -1,176 +1,284 @@
 import re
-from typing import List, Tuple
+from bisect import bisect_left
+from typing import List, NamedTuple
 from app.config import MAX_MESSAGE_LENGTH
 
+# Экранирование MarkdownV2: в обычном тексте, внутри ```pre``` и в URL ссылки
+_ESCAPE = str.maketrans({char: '\\' + char for char in '\\_*[]()~`>#+-=|{}.!'})
+_ESCAPE_CODE = str.maketrans({'\\': '\\\\', '`': '\\`'})
+_ESCAPE_URL = str.maketrans({'\\': '\\\\', ')': '\\)'})
+
+_FENCE = re.compile(r'```')
+_LANGUAGE = re.compile(r'[\w+#.-]{1,30}')
+_SPACES = re.compile(r' +')
+# Разметка вне код-блоков, один проход finditer. Текст ссылки не содержит '[', URL — пробелов
+# и вложенных скобок глубже одной (вики-адреса вида Хорус_(примарх)), поэтому неудачная
+# попытка не просматривает текст дальше следующей — разбор линейный даже на "[[[[...".
+# Пары '**' считаются уже по списку токенов.
+_INLINE = re.compile(
+    r'^#{1,6}[ \t]+(?P<header>[^\n]*)'
+    r'|\[(?P<link_text>[^\[\]\n]*)\]\((?P<url>(?:[^()\s]|\([^()\s]*\))*)\)'
+    r'|(?P<bold>\*\*)'
+    r'|(?P<newline>\n)',
+    re.MULTILINE,
+)
+# Недописанная ссылка в конце стримящегося текста: "[текст", "[текст]", "[текст](url"
+_PARTIAL_LINK = re.compile(r'\[[^\[\]\n]*+(?:\](?:\((?:[^()\s]++|\([^()\s]*+\)?)*+)?)?\Z')
+# Начало заголовка без текста или '`', '``' — возможно, начало ``` — в конце стримящегося текста
+_PARTIAL_MARKER = re.compile(r'(?:^#{1,6}[ \t]*|(?<!`)`{1,2})\Z', re.MULTILINE)
+
+# Приоритеты мест разреза длинного ответа
+_CUT_TOKEN, _CUT_SPACE, _CUT_LINE, _CUT_PARAGRAPH = 0, 1, 2, 3
+
+
+class _Cut(NamedTuple):
+    pos: int
+    priority: int
+    close: str   # чем закрыть открытую сущность в конце сообщения
+    reopen: str  # чем открыть её заново в начале следующего
+
+
+class _Output:
+    """Результат одного форматирования: куски текста и места, где его можно разрезать"""
+
+    __slots__ = ('parts', 'size', 'cuts', 'spans', 'track_cuts')
+
+    def __init__(self, track_cuts: bool = True):
+        # format места разреза не нужны — без них разметка заметно быстрее
+        self.track_cuts = track_cuts
+        self.parts = []
+        self.size = 0
+        self.cuts = []
+        # участки экранированного текста (start, end, close, reopen), которые можно резать
+        # посимвольно, если подходящего места разреза нет
+        self.spans = []
+
+    def add(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def plain(self, text: str, close: str = '', reopen: str = ''):
+        start = self.size
+        self.add(text)
+        if not self.track_cuts:
+            return
+        self.spans.append((start, self.size, close, reopen))
+        if ' ' not in text:
+            return
+        for m in _SPACES.finditer(text):
+            self.cuts.append(_Cut(start + m.end(), _CUT_SPACE, close, reopen))
+
+    def newline(self, close: str = '', reopen: str = ''):
+        paragraph = bool(self.parts) and self.parts[-1] == '\n'
+        self.add('\n')
+        self.cut(_Cut(self.size, _CUT_PARAGRAPH if paragraph else _CUT_LINE, close, reopen))
+
+    def cut(self, cut: _Cut):
+        if self.track_cuts:
+            self.cuts.append(cut)
+
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+
 class TelegramMarkdownFormatter:
-    """Форматирование текста для Telegram MarkdownV2"""
-    
-    _ESCAPE_CHARS = '_[]()~`>#+-=|{}.!'
-    _CODE_BLOCK_PATTERN = r'```(.*?)```'
-    
+    """Форматирование текста для Telegram MarkdownV2.
+
+    Состояние разбора живёт только в локальных переменных, поэтому форматировать можно
+    из нескольких потоков и задач одновременно.
+    """
+
     @classmethod
     def format(cls, text: str) -> str:
-        """Основной метод форматирования текста"""
+        """Основной метод форматирования текста (без ограничения длины, см. split)"""
         if not text:
             return text
-            
-        truncated = cls._truncate(text)
-
-        text = cls._preserve_code_blocks(truncated)
-        
-        formatted = cls._process_text(text)
-        
-        formatted = cls._restore_code_blocks(formatted)
-        
-        return formatted
-    
+        return cls._render(text, track_cuts=False).text()
+
     @classmethod
-    def _preserve_code_blocks(cls, text: str) -> str:
-        """Сохраняет код-блоки перед обработкой"""
-        cls._code_blocks = []
-        def replace_code(match):
-            cls._code_blocks.append(match.group(0))
-            return f'__CODE_BLOCK_{len(cls._code_blocks)-1}__'
-            
-        return re.sub(cls._CODE_BLOCK_PATTERN, replace_code, text, flags=re.DOTALL)
-    
+    def split(cls, text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+        """Форматирует текст и делит его на сообщения не длиннее limit.
+
+        Режет по абзацам, затем по строкам, затем по пробелам; разрезанные жирный текст
+        и код-блоки закрываются в конце сообщения и открываются в начале следующего.
+        """
+        if not text:
+            return []
+        rendered = cls.format(text)
+        if len(rendered) <= limit:
+            return [rendered]
+        out = cls._render(text)
+        messages = []
+        start, prefix, i = 0, '', 0
+        while len(prefix) + len(rendered) - start > limit:
+            end = start + limit - len(prefix)
+            half = start + (end - start) // 2
+            while i < len(out.cuts) and out.cuts[i].pos <= start:
+                i += 1
+            best, best_key = None, None
+            j = i
+            while j < len(out.cuts) and out.cuts[j].pos <= end:
+                cut = out.cuts[j]
+                # граница между словами лучше границы между токенами; среди них — поздний разрез
+                # во второй половине сообщения, затем — более крупная граница
+                key = (cut.priority > _CUT_TOKEN, cut.pos >= half, cut.priority)
+                if cut.pos + len(cut.close) <= end and (best_key is None or key >= best_key):
+                    best, best_key = cut, key
+                j += 1
+            if best is None:
+                best = cls._hard_cut(rendered, out.spans, start, end)
+            messages.append(prefix + rendered[start:best.pos] + best.close)
+            start, prefix = best.pos, best.reopen
+        messages.append(prefix + rendered[start:])
+        return messages
+
     @classmethod
-    def _restore_code_blocks(cls, text: str) -> str:
-        """Восстанавливает код-блоки после обработки"""
-        for i, code in enumerate(cls._code_blocks):
-            text = text.replace(f'__CODE_BLOCK_{i}__', code)
-        return text
-    
+    def format_partial(cls, text: str, limit: int = MAX_MESSAGE_LENGTH) -> str:
+        """Форматирование незавершённого текста (стриминг): незакрытая разметка не должна ломать MarkdownV2.
+
+        Возвращает только первое сообщение — то, что помещается в редактируемый плейсхолдер.
+        """
+        if not text:
+            return text
+        messages = cls.split(cls._close_partial(text), limit)
+        return messages[0] if messages else ''
+
     @classmethod
-    def _process_text(cls, text: str) -> str:
-        """Обработка текста (без код-блоков)"""
-        formatted_text = []
-        i = 0
-        n = len(text)
-        
-        while i < n:
-            # Пропускаем временные метки код-блоков
-            if text.startswith('__CODE_BLOCK_', i):
-                end = text.find('__', i + 13)
-                if end != -1:
-                    formatted_text.append(text[i:end+2])
-                    i = end + 2
-                    continue
-            
-            # Обработка ссылок [текст](url)
-            if text[i] == '[':
-                i, link_part = cls._process_link(text, i, n)
-                if link_part:
-                    formatted_text.append(link_part)
-                    continue
-            
-            # Обработка заголовков (начинаются с #)
-            if text[i] == '#':
-                i, header_part = cls._process_header(text, i, n)
-                if header_part:
-                    formatted_text.append(header_part)
-                    continue
-            
-            # Обработка жирного текста **text**
-            if i + 1 < n and text[i] == '*' and text[i+1] == '*':
-                i, bold_part = cls._process_bold(text, i, n)
-                if bold_part:
-                    formatted_text.append(bold_part)
-                    continue
-            
-            # Экранирование обычных символов
-            char = text[i]
-            if char in cls._ESCAPE_CHARS:
-                formatted_text.append(f'\\{char}')
-            else:
-                formatted_text.append(char)
-            i += 1
-        
-        return ''.join(formatted_text)
-    
+    def _close_partial(cls, text: str) -> str:
+        """Доводит незавершённый текст до того, что будет видно в итоговом ответе.
+
+        Оборванный код-блок закрывается; недописанные ссылка, начало заголовка или ```
+        в конце прячутся до следующих токенов; непарный '**' последнего участка убирается.
+        """
+        fences = [m.start() for m in _FENCE.finditer(text)]
+        if len(fences) % 2:
+            # '`' или '``' в конце кода — возможно, начало закрывающего ```
+            code = fences[-1] + 3
+            return text[:code] + text[code:].rstrip('`') + '\n```'
+
+        # разметка после последнего код-блока размечается отдельно, как в _render
+        start = fences[-1] + 3 if fences else 0
+        tail = text[start:]
+        # хвост из нечётного числа '*' — половина маркера '**', который ещё не дописан
+        stripped = tail.rstrip('*')
+        if (len(tail) - len(stripped)) % 2:
+            tail = tail[:-1]
+
+        line = tail[tail.rfind('\n') + 1:]
+        # ищем только в последней строке: ссылка и заголовок не переходят на следующую
+        for pattern in (_PARTIAL_LINK, _PARTIAL_MARKER):
+            m = pattern.search(line)
+            if m:
+                tail, line = tail[:len(tail) - len(line) + m.start()], line[:m.start()]
+
+        # '**' парные в пределах участка после последнего заголовка (см. _render_text)
+        bold = []
+        for m in _INLINE.finditer(tail):
+            if m.lastgroup == 'bold':
+                bold.append(m.start())
+            elif m.lastgroup == 'header':
+                bold = []
+        if len(bold) % 2:
+            tail = tail[:bold[-1]] + tail[bold[-1] + 2:]
+        return text[:start] + tail
+
     @classmethod
-    def _process_link(cls, text: str, i: int, n: int) -> Tuple[int, str]:
-        """Обработка ссылки [текст](url)"""
-        j = i + 1
-        while j < n and text[j] != ']':
-            j += 1
-        
-        if j < n and text[j] == ']' and j + 1 < n and text[j+1] == '(':
-            k = j + 2
-            while k < n and text[k] != ')':
-                k += 1
-            
-            if k < n and text[k] == ')':
-                link_text = text[i+1:j]
-                url = text[j+2:k]
-                
-                escaped_link_text = []
-                for char in link_text:
-                    if char in cls._ESCAPE_CHARS:
-                        escaped_link_text.append(f'\\{char}')
-                    else:
-                        escaped_link_text.append(char)
-                
-                return k + 1, f'[{"".join(escaped_link_text)}]({url})'
-        
-        return i, ''
-    
+    def _render(cls, text: str, track_cuts: bool = True) -> _Output:
+        """Один проход по тексту: код-блоки копируются как есть, остальное размечается"""
+        out = _Output(track_cuts)
+        fences = [m.start() for m in _FENCE.finditer(text)]
+        pos = 0
+        # непарный последний ``` остаётся в хвосте и экранируется как обычный текст
+        for start, end in zip(fences[::2], fences[1::2]):
+            cls._render_text(text[pos:start], out)
+            cls._render_code(text[start + 3:end], out)
+            pos = end + 3
+        cls._render_text(text[pos:], out)
+        return out
+
     @classmethod
-    def _process_header(cls, text: str, i: int, n: int) -> Tuple[int, str]:
-        """Обработка заголовка (# Header)"""
-        header_level = 0
-        start = i
-        while i < n and text[i] == '#':
-            header_level += 1
-            i += 1
-        
-        while i < n and text[i] == ' ':
-            i += 1
-        
-        j = i
-        while j < n and text[j] != '\n':
-            j += 1
-        
-        header_text = []
-        k = i
-        while k < j:
-            char = text[k]
-            if char in cls._ESCAPE_CHARS:
-                header_text.append(f'\\{char}')
-            else:
-                header_text.append(char)
-            k += 1
-        
-        if header_text:
-            return j, f'*{"".join(header_text)}*'
-        
-        return start, ''
-    
+    def _render_code(cls, code: str, out: _Output):
+        """Код-блок: внутри pre экранируются только '`' и '\\'"""
+        first_line, newline, _ = code.partition('\n')
+        language = first_line if newline and _LANGUAGE.fullmatch(first_line) else ''
+        reopen = f'```{language}\n'
+        out.cut(_Cut(out.size, _CUT_TOKEN, '', ''))
+        out.add('```')
+        escaped = code.translate(_ESCAPE_CODE)
+        start = out.size
+        out.add(escaped)
+        if out.track_cuts:
+            out.spans.append((start, out.size, '```', reopen))
+            for m in re.finditer('\n', escaped):
+                out.cuts.append(_Cut(start + m.end(), _CUT_LINE, '```', reopen))
+        out.add('```')
+        out.cut(_Cut(out.size, _CUT_TOKEN, '', ''))
+
     @classmethod
-    def _process_bold(cls, text: str, i: int, n: int) -> Tuple[int, str]:
-        """Обработка жирного текста (**bold**)"""
-        j = i + 2
-        while j < n and not (text[j] == '*' and j + 1 < n and text[j+1] == '*'):
-            j += 1
-        
-        if j + 1 < n and text[j] == '*' and text[j+1] == '*':
-            bold_text = []
-            k = i + 2
-            while k < j:
-                char = text[k]
-                if char in cls._ESCAPE_CHARS:
-                    bold_text.append(f'\\{char}')
+    def _render_text(cls, text: str, out: _Output):
+        """Текст вне код-блоков: заголовки, ссылки, **жирный** и экранирование"""
+        tokens = list(_INLINE.finditer(text))
+
+        # '**' парные в пределах участка между заголовками; последний непарный — обычный текст
+        literal, scope = set(), []
+        for k, m in enumerate(tokens):
+            if m.lastgroup == 'bold':
+                scope.append(k)
+            elif m.lastgroup == 'header':
+                if len(scope) % 2:
+                    literal.add(scope[-1])
+                scope = []
+        if len(scope) % 2:
+            literal.add(scope[-1])
+
+        bold = False
+        pos = 0
+        for k, m in enumerate(tokens):
+            close = reopen = '*' if bold else ''
+            if m.start() > pos:
+                out.plain(text[pos:m.start()].translate(_ESCAPE), close, reopen)
+            pos = m.end()
+
+            kind = m.lastgroup
+            if kind == 'bold':
+                if k in literal:
+                    out.plain('\\*\\*')
+                else:
+                    bold = not bold
+                    out.add('*')
+                    if not bold:
+                        out.cut(_Cut(out.size, _CUT_TOKEN, '', ''))
+            elif kind == 'newline':
+                out.newline(close, reopen)
+            elif kind == 'header':
+                # заголовок целиком жирный, вложенный жирный Telegram не примет
+                header = m.group('header').replace('**', '').strip()
+                if header:
+                    out.add('*')
+                    out.plain(header.translate(_ESCAPE), '*', '*')
+                    out.add('*')
                 else:
-                    bold_text.append(char)
-                k += 1
-            
-            return j + 2, f'*{"".join(bold_text)}*'
-        
-        return i, ''
-    
+                    out.plain(m.group(0).translate(_ESCAPE))
+            else:
+                link_text = m.group('link_text').translate(_ESCAPE)
+                out.add(f"[{link_text}]({m.group('url').translate(_ESCAPE_URL)})")
+                out.cut(_Cut(out.size, _CUT_TOKEN, close, reopen))
+        if pos < len(text):
+            out.plain(text[pos:].translate(_ESCAPE))
+
     @classmethod
-    def _truncate(cls, text: str) -> str:
-        """Обрезка длинных сообщений"""
-        if len(text) > MAX_MESSAGE_LENGTH:
-            return text[:MAX_MESSAGE_LENGTH-50] + "...\n\n[ответ сокращен]"
-        return text
\ No newline at end of file
+    def _hard_cut(cls, rendered: str, spans: list, start: int, end: int) -> _Cut:
+        """Разрез внутри слова, когда в пределах лимита нет ни пробела, ни перевода строки"""
+        k = bisect_left(spans, end, key=lambda span: span[0]) - 1
+        if k >= 0:
+            span_start, span_end, close, reopen = spans[k]
+            pos = min(span_end, end - len(close))
+            # не отрываем экранирующий '\' от символа
+            slashes = 0
+            while pos - slashes > span_start and rendered[pos - slashes - 1] == '\\':
+                slashes += 1
+            pos -= slashes % 2
+            if pos > max(start, span_start):
+                return _Cut(pos, _CUT_TOKEN, close, reopen)
+        # длиннее лимита только неделимая ссылка — режем как есть
+        return _Cut(end, _CUT_TOKEN, '', '')
@@ -0,0 +1,332 @@
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from itertools import chain
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.documents import Document
+from langchain.schema import BaseRetriever
+
+from app.bm25 import ShardStats, _top_k
+
+logger = logging.getLogger(__name__)
+
+# Формат файла FTS-индекса; при несовместимых изменениях — увеличить
+FTS_FORMAT_VERSION = 2
+# Леммы уже нормализованы: без снятия диакритики (ё) и с "_" внутри токена,
+# чтобы FTS5 делил текст на те же токены, что и _words()
+FTS_TOKENIZER = "unicode61 remove_diacritics 0 tokenchars '_'"
+FTS_SCHEMA = f'''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE chunks (id INTEGER PRIMARY KEY, article_id INTEGER, document TEXT NOT NULL);
+CREATE VIRTUAL TABLE chunks_fts USING fts5(lemmas, content='', tokenize="{FTS_TOKENIZER}");
+-- длина чанка (dl) повторена в каждой строке: постинги термина читаются без join с chunks
+CREATE TABLE chunk_terms (chunk_id INTEGER, term TEXT, tf INTEGER, dl INTEGER, PRIMARY KEY (chunk_id, term)) WITHOUT ROWID;
+'''
+# Параметры bm25() FTS5 — с ними же досчитываются термины расширения
+FTS_K1, FTS_B = 1.2, 0.75
+# плейсхолдеров в одном IN (...) — с запасом ниже SQLITE_MAX_VARIABLE_NUMBER старых сборок
+_IN_BATCH = 500
+
+
+def fts_index_exists(path: Path) -> bool:
+    # файл появляется атомарной заменой после полной записи
+    return path.exists()
+
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _placeholders(n: int) -> str:
+    return ",".join("?" * n)
+
+
+class FtsIndexWriter:
+    """Потоковая запись FTS-индекса: чанки, леммы в FTS5 и прямой индекс (chunk_terms) для PRF
+    и оценки терминов расширения.
+
+    Пишется во временный файл, который в finish() атомарно заменяет path.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._tmp_path = path.with_name(path.name + ".tmp")
+        self._tmp_path.unlink(missing_ok=True)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self._tmp_path)
+        # файл до finish() никто не читает, а при сбое сборка начинается заново
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.executescript(FTS_SCHEMA)
+        self.count = 0
+        self.total_length = 0
+
+    def add(self, documents: List[Document], stats: ShardStats):
+        """Документы шарда и их частоты лемм (в том же порядке)"""
+        chunks, lemmas, chunk_terms = [], [], []
+        for i, doc in enumerate(documents):
+            doc_id = self.count + i
+            lo, hi = int(stats.doc_indptr[i]), int(stats.doc_indptr[i + 1])
+            counts = [(stats.terms[t], int(tf)) for t, tf in zip(stats.doc_terms[lo:hi], stats.doc_tfs[lo:hi])]
+            record = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False)
+            length = sum(tf for _, tf in counts)
+            self.total_length += length
+            chunks.append((doc_id, doc.metadata.get("article_id", -1), record))
+            # порядок слов для bm25() не важен — достаточно повторить лемму tf раз
+            lemmas.append((doc_id, " ".join(" ".join([term] * tf) for term, tf in counts)))
+            chunk_terms.extend((doc_id, term, tf, length) for term, tf in counts)
+
+        self._conn.executemany("INSERT INTO chunks (id, article_id, document) VALUES (?, ?, ?)", chunks)
+        self._conn.executemany("INSERT INTO chunks_fts (rowid, lemmas) VALUES (?, ?)", lemmas)
+        self._conn.executemany("INSERT INTO chunk_terms (chunk_id, term, tf, dl) VALUES (?, ?, ?, ?)", chunk_terms)
+        self.count += len(documents)
+
+    def finish(self, watermark: str | None = None, **extra) -> dict:
+        conn = self._conn
+        conn.execute("CREATE TABLE terms (term TEXT PRIMARY KEY, df INTEGER) WITHOUT ROWID")
+        conn.execute("INSERT INTO terms SELECT term, COUNT(*) FROM chunk_terms GROUP BY term")
+        num_terms = conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        # постинги термина для stage 2: покрывающий индекс, чанк не читается
+        conn.execute("CREATE INDEX chunk_terms_term ON chunk_terms (term, tf, dl)")
+        conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('optimize')")
+        meta = {
+            "format_version": FTS_FORMAT_VERSION,
+            "index_id": uuid.uuid4().hex,
+            "num_docs": self.count,
+            "num_terms": num_terms,
+            "avgdl": self.total_length / self.count if self.count else 0.0,
+            "watermark": watermark,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                         [(key, json.dumps(value)) for key, value in meta.items()])
+        conn.commit()
+        conn.close()
+        os.replace(self._tmp_path, self.path)
+        logger.info("FTS index %s: %d chunks, %d terms written to %s",
+                    meta["index_id"], self.count, num_terms, self.path)
+        return meta
+
+
+def read_fts_meta(path: Path) -> dict:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+    finally:
+        conn.close()
+    if meta.get("format_version") != FTS_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported FTS index format version {meta.get('format_version')} in {path} "
+            f"(expected {FTS_FORMAT_VERSION}), rebuild the index"
+        )
+    return meta
+
+
+class FtsAccumulator:
+    """Оценки BM25 кандидатов FTS-запроса (только документы, которые вернул FTS5)"""
+
+    def __init__(self):
+        self.scores: dict[int, float] = {}
+
+    def add(self, rows: Iterable[tuple[int, float]], weight: float = 1.0):
+        for doc_id, score in rows:
+            self.scores[doc_id] = self.scores.get(doc_id, 0.0) + weight * score
+
+    def top_k(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        doc_ids = np.fromiter(self.scores, dtype=np.int64, count=len(self.scores))
+        scores = np.fromiter(self.scores.values(), dtype=np.float32, count=len(self.scores))
+        return _top_k(doc_ids, scores, k)
+
+
+class FtsIndex:
+    """Первый этап каскада на SQLite FTS5: тот же интерфейс, что у SegmentedIndex.
+
+    Постинги, тексты чанков и прямой индекс лежат в одном файле и читаются через
+    страничный кэш SQLite, поэтому резидентная память почти не растёт с корпусом,
+    а процессы-воркеры открывают один и тот же файл. Оценка — встроенный bm25()
+    FTS5 (k1=1.2, b=0.75, idf без отрицательных значений), поэтому числа отличаются
+    от BM25Index. Stage 1 — один MATCH по OR терминов запроса (повтор термина = вес).
+    Термины расширения с дробными весами досчитываются по одному запросу на термин:
+    постинги из покрывающего индекса chunk_terms(term, tf, dl), оценка — та же формула bm25().
+    """
+
+    def __init__(self, path: Path, candidates: int = 1000):
+        self.path = path
+        self.candidates = candidates
+        meta = read_fts_meta(path)
+        self.index_id = meta["index_id"]
+        self.num_docs = meta["num_docs"]
+        self.watermark = meta["watermark"]
+        self.avgdl = meta["avgdl"]
+        self._local = threading.local()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # соединение на поток: запросы идут из пула потоков ретривера
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def __getitem__(self, doc_id: int) -> Document:
+        row = self._conn.execute("SELECT document FROM chunks WHERE id = ?", (int(doc_id),)).fetchone()
+        if row is None:
+            raise IndexError(doc_id)
+        record = json.loads(row[0])
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def query_terms(self, tokens: List[str]) -> list[tuple[str, float]]:
+        """(term, вес); повтор термина = больший вес"""
+        return [(t, float(c)) for t, c in Counter(tokens).items()]
+
+    def _match(self, expression: str, limit: int) -> list[tuple[int, float]]:
+        return self._conn.execute(
+            "SELECT rowid, -bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+            (expression, limit),
+        ).fetchall()
+
+    def _term_scores(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """(doc_ids, оценки bm25()) всех чанков с термином — как у FTS5, без MATCH"""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        row = self._conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+        if row is None:
+            return empty
+        # idf как в fts5_bm25_function, только неположительный там заменяется на 1e-6:
+        # вклад такого термина (есть в большинстве чанков) не меняет порядок, а его
+        # постинги — самые длинные, поэтому их не читаем
+        df = row[0]
+        idf = np.log((self.num_docs - df + 0.5) / (df + 0.5))
+        if idf <= 0:
+            return empty
+        rows = self._conn.execute("SELECT chunk_id, tf, dl FROM chunk_terms WHERE term = ?", (term,)).fetchall()
+        postings = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+        doc_ids, tf, dl = postings[:, 0], postings[:, 1].astype(np.float64), postings[:, 2]
+        norm = FTS_K1 * (1 - FTS_B + FTS_B * dl / max(self.avgdl, 1e-9))
+        return doc_ids, idf * tf * (FTS_K1 + 1) / (tf + norm)
+
+    def accumulate(self, terms: Iterable[tuple[str, float]],
+                   acc: FtsAccumulator | None = None) -> FtsAccumulator:
+        """Добавляет вклад взвешенных терминов в аккумулятор (новый, если acc=None)"""
+        terms = [(t, w) for t, w in terms if t]
+        if acc is None:
+            acc = FtsAccumulator()
+            if terms:
+                # bm25() суммирует вклад фраз запроса, так что повтор фразы = целый вес
+                expression = " OR ".join(_phrase(t) for t, w in terms for _ in range(max(1, round(w))))
+                acc.add(self._match(expression, self.candidates))
+            return acc
+
+        for term, weight in terms:
+            doc_ids, scores = self._term_scores(term)
+            acc.add(zip(doc_ids.tolist(), scores.tolist()), weight)
+        return acc
+
+    def search(self, tokens: List[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Возвращает (doc_ids, scores) top-k документов, отсортированных по убыванию"""
+        return self.accumulate(self.query_terms(tokens)).top_k(k)
+
+    def feedback_terms(self, doc_ids: np.ndarray, exclude: set[str],
+                       top_terms: int) -> list[tuple[str, float]]:
+        """PRF: термины с наибольшим средним TF-IDF (L2-нормированным) по документам doc_ids"""
+        if len(doc_ids) == 0:
+            return []
+        doc_ids = [int(d) for d in doc_ids]
+        rows = []
+        for lo in range(0, len(doc_ids), _IN_BATCH):
+            batch = doc_ids[lo:lo + _IN_BATCH]
+            rows.extend(self._conn.execute(
+                f"SELECT ct.chunk_id, ct.term, ct.tf, t.df FROM chunk_terms ct "
+                f"JOIN terms t ON t.term = ct.term WHERE ct.chunk_id IN ({_placeholders(len(batch))})",
+                batch,
+            ))
+        if not rows:
+            return []
+
+        # idf как в sklearn TfidfVectorizer (smooth_idf), как и у SegmentedIndex
+        chunk_ids = np.asarray([r[0] for r in rows], dtype=np.int64)
+        weights = np.asarray([r[2] for r in rows], dtype=np.float64) * (
+            np.log((1 + self.num_docs) / (1 + np.asarray([r[3] for r in rows], dtype=np.float64))) + 1
+        )
+        docs, doc_of_row = np.unique(chunk_ids, return_inverse=True)
+        norms = np.sqrt(np.bincount(doc_of_row, weights=weights ** 2, minlength=len(docs)))
+        weights /= np.maximum(norms[doc_of_row], 1e-9)
+
+        totals: dict[str, float] = defaultdict(float)
+        for (_, term, _, _), weight in zip(rows, weights.tolist()):
+            if term not in exclude:
+                totals[term] += weight
+        ranked = sorted(totals.items(), key=lambda x: x[1], reverse=True)[:top_terms]
+        return [(term, score / len(doc_ids)) for term, score in ranked]
+
+
+class FtsRetriever(BaseRetriever):
+    """Ретривер первого этапа поверх FtsIndex (файл SQLite, общий для процессов).
+
+    Файл заменяется целиком при пересборке; refresh() переоткрывает индекс.
+    """
+
+    path: Path
+    index: FtsIndex
+    k: int = 4
+
+    _file_id: tuple = PrivateAttr(default=())
+    _refresh_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def index_id(self) -> str:
+        return self.index.index_id
+
+    @staticmethod
+    def _stat(path: Path) -> tuple:
+        st = path.stat()
+        return st.st_ino, st.st_mtime_ns
+
+    @classmethod
+    def load(cls, path: Path, candidates: int = 1000, **kwargs) -> "FtsRetriever":
+        file_id = cls._stat(path)
+        retriever = cls(path=path, index=FtsIndex(path, candidates=candidates), **kwargs)
+        retriever._file_id = file_id
+        return retriever
+
+    def refresh(self) -> bool:
+        """Переоткрывает индекс, если файл заменён пересборкой; True — индекс заменён"""
+        try:
+            file_id = self._stat(self.path)
+        except FileNotFoundError:
+            return False
+        if file_id == self._file_id:
+            return False
+        with self._refresh_lock:
+            if file_id == self._file_id:
+                return False
+            index = FtsIndex(self.path, candidates=self.index.candidates)
+            self.index = index
+            self._file_id = file_id
+        logger.info("Reopened FTS index %s: %d chunks", index.index_id, index.num_docs)
+        return True
+
+    def search(self, tokens: List[str], k: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        return self.index.search(tokens, k or self.k)
+
+    def hydrate(self, doc_ids: Iterable[int]) -> List[Document]:
+        return [self.index[i] for i in doc_ids]
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        # query уже лемматизирован — как и в BM25SparseRetriever, просто split()
+        self.refresh()
+        doc_ids, _ = self.search(query.split())
+        return self.hydrate(doc_ids)
@@ -0,0 +1,274 @@
+"""Инкрементальное обновление BM25-индекса из базы краулера.
+
+Индекс содержит статьи с articles.last_updated < watermark — часов базы на момент
+сборки. Обновление берёт статьи с last_updated не раньше watermark (и удалённые
+из базы), помечает их старые чанки удалёнными в существующих сегментах и пишет
+изменённые статьи новым дельта-сегментом. Компакция сливает сегменты в один по
+прямому индексу, без повторной лемматизации. Работающие бот/API подхватывают
+новую версию на следующем запросе (BM25SparseRetriever.refresh).
+
+FTS-бэкенд (--backend fts, app/fts.py) — один SQLite-файл без сегментов: update
+пересобирает его целиком, если база изменилась с прошлой сборки.
+
+    python -m app.indexer build [--workers 8]   # полная пересборка из базы
+    python -m app.indexer update [--db warhammer_articles.db]
+    python -m app.indexer compact
+    python -m app.indexer build --backend fts
+"""
+import time
+import shutil
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app.bm25 import (
+    BM25Index, BM25SparseRetriever, Segment, SegmentWriter, ShardStats,
+    index_lock, read_manifest, segment_name, write_manifest,
+)
+from app.config import (
+    INDEX_COMPACT_MAX_SEGMENTS, INDEX_COMPACT_RATIO, INDEX_BUILD_WORKERS, INDEX_BUILD_PROGRESS_INTERVAL,
+    RETRIEVAL_BACKEND,
+)
+from app.embedder import INDEX_DIR, FTS_INDEX_FILE, LEMMA_CACHE_FILE, lemma_cache, build_segment, build_fts_index
+from app.fts import fts_index_exists, read_fts_meta
+from app.loader import DatabaseTextLoader
+
+logger = logging.getLogger(__name__)
+
+COMPACT_BATCH_SIZE = 1000
+
+
+def _open_segments(index_dir: Path, manifest: dict) -> list[Segment]:
+    return [Segment.open(index_dir, entry) for entry in manifest["segments"]]
+
+
+def _remove_segments(index_dir: Path, names):
+    # процессы, открывшие старую версию, продолжают читать уже удалённые файлы через mmap
+    for name in names:
+        shutil.rmtree(index_dir / name, ignore_errors=True)
+
+
+def rebuild_index(loader: DatabaseTextLoader, index_dir: Path = INDEX_DIR,
+                  workers: int = INDEX_BUILD_WORKERS,
+                  progress_interval: float = INDEX_BUILD_PROGRESS_INTERVAL) -> BM25SparseRetriever:
+    """Полная пересборка индекса из базы (один базовый сегмент)"""
+    with index_lock(index_dir):
+        # часы базы до чтения: статьи, сохранённые во время сборки, возьмёт update
+        until = loader.current_timestamp()
+        retriever = BM25SparseRetriever.create(
+            index_dir,
+            lambda path: build_segment(path, loader.iter_chunks(until=until), workers=workers,
+                                       progress_interval=progress_interval),
+            watermark=until,
+        )
+        lemma_cache.save(LEMMA_CACHE_FILE)
+        return retriever
+
+
+def update_index(loader: DatabaseTextLoader, index_dir: Path = INDEX_DIR, workers: int = 1) -> dict | None:
+    """Добавляет в индекс изменения базы с момента прошлого обновления; None — изменений нет.
+
+    Дельты обычно маленькие, поэтому по умолчанию лемматизация в текущем процессе
+    (fork из многопоточного бота небезопасен).
+    """
+    with index_lock(index_dir):
+        manifest = read_manifest(index_dir)
+        segments = _open_segments(index_dir, manifest)
+        indexed = set()
+        for seg in segments:
+            indexed.update(np.unique(seg.doc_article[seg.live_ids()]).tolist())
+
+        until = loader.current_timestamp()
+        seen = loader.changed_articles(manifest["watermark"], until)
+        changed = seen
+        if manifest["watermark"] is None:
+            # индекс построен без watermark — добавляем только статьи, которых в нём нет
+            changed = {a: ts for a, ts in seen.items() if a not in indexed}
+        removed = indexed - loader.article_ids()
+        if not changed and not removed:
+            logger.info("Index is up to date (watermark %s)", manifest["watermark"])
+            return None
+
+        logger.info(
+            "Updating index: %d changed, %d removed articles (last crawler run: %s)",
+            len(changed), len(removed), loader.last_update_run(),
+        )
+        stale = np.asarray(sorted(set(changed) | removed), dtype=np.int64)
+        generation = manifest["generation"] + 1
+        entries, dead = [], []
+        for seg, entry in zip(segments, manifest["segments"]):
+            hit = np.intersect1d(seg.doc_article, stale).tolist()
+            deleted = sorted(set(entry.get("deleted_articles", ())) | set(hit))
+            if deleted and not np.isin(seg.doc_article, deleted, invert=True).any():
+                # все чанки сегмента устарели — убираем сегмент целиком
+                dead.append(seg.name)
+                continue
+            entries.append({"name": seg.name, "deleted_articles": deleted} if deleted else {"name": seg.name})
+
+        new_chunks = 0
+        if changed:
+            name = segment_name(generation)
+            meta = build_segment(
+                index_dir / name, loader.iter_chunks(limit=len(changed), article_ids=changed), workers=workers,
+            )
+            new_chunks = meta["num_docs"]
+            if new_chunks:
+                entries.append({"name": name})
+            else:
+                _remove_segments(index_dir, [name])
+            lemma_cache.save(LEMMA_CACHE_FILE)
+
+        manifest = write_manifest(index_dir, entries, generation, until)
+        _remove_segments(index_dir, dead)
+        logger.info(
+            "Index %s: generation %d, %d segments, %d new chunks",
+            manifest["index_id"], generation, len(entries), new_chunks,
+        )
+        return manifest
+
+
+def rebuild_fts_index(loader: DatabaseTextLoader, path: Path = FTS_INDEX_FILE,
+                      workers: int = INDEX_BUILD_WORKERS,
+                      progress_interval: float = INDEX_BUILD_PROGRESS_INTERVAL) -> dict:
+    """Полная пересборка FTS-индекса из базы"""
+    with index_lock(path):
+        until = loader.current_timestamp()
+        articles = len(loader.article_ids())
+        meta = build_fts_index(
+            path, loader.iter_chunks(until=until), watermark=until, workers=workers,
+            progress_interval=progress_interval, articles=articles,
+        )
+        lemma_cache.save(LEMMA_CACHE_FILE)
+        return meta
+
+
+def update_fts_index(loader: DatabaseTextLoader, path: Path = FTS_INDEX_FILE, workers: int = 1) -> dict | None:
+    """Пересобирает FTS-индекс, если статьи менялись или удалялись после сборки; None — изменений нет"""
+    if fts_index_exists(path):
+        meta = read_fts_meta(path)
+        last_updated = loader.max_last_updated()
+        fresh = meta["watermark"] is not None and (last_updated is None or last_updated < meta["watermark"])
+        if fresh and meta.get("articles") == len(loader.article_ids()):
+            logger.info("FTS index is up to date (watermark %s)", meta["watermark"])
+            return None
+    return rebuild_fts_index(loader, path, workers=workers)
+
+
+def needs_compaction(index_dir: Path = INDEX_DIR, max_segments: int = INDEX_COMPACT_MAX_SEGMENTS,
+                     max_ratio: float = INDEX_COMPACT_RATIO) -> bool:
+    """Пора ли компактировать: много дельт или велика доля удалённых чанков и дельт"""
+    manifest = read_manifest(index_dir)
+    if len(manifest["segments"]) > max_segments:
+        return True
+    segments = _open_segments(index_dir, manifest)
+    total = sum(seg.index.num_docs for seg in segments)
+    if not total:
+        return False
+    dead = sum(seg.index.num_docs - seg.num_live for seg in segments)
+    delta = sum(seg.num_live for seg in segments[1:])
+    return (dead + delta) / total > max_ratio
+
+
+def compact_index(index_dir: Path = INDEX_DIR) -> dict | None:
+    """Сливает все сегменты (без удалённых чанков) в один; None — уже компактен"""
+    with index_lock(index_dir):
+        manifest = read_manifest(index_dir)
+        segments = _open_segments(index_dir, manifest)
+        if len(segments) == 1 and segments[0].live is None:
+            return None
+
+        start = time.perf_counter()
+        generation = manifest["generation"] + 1
+        name = segment_name(generation)
+        writer = SegmentWriter(index_dir / name)
+        shards = []
+        for seg in segments:
+            # чанки копируются на диск сразу, в памяти — только прямой индекс
+            live_ids = seg.live_ids()
+            for lo in range(0, len(live_ids), COMPACT_BATCH_SIZE):
+                writer.add([seg.chunks[int(d)] for d in live_ids[lo:lo + COMPACT_BATCH_SIZE]])
+            shards.append(ShardStats.from_counts(seg.index.term_counts(live_ids)))
+        meta = writer.finish(BM25Index.from_shards(shards))
+
+        manifest = write_manifest(index_dir, [{"name": name}], generation, manifest["watermark"])
+        _remove_segments(index_dir, [seg.name for seg in segments])
+        logger.info(
+            "Compacted %d segments into %s (%d chunks) in %.1fs",
+            len(segments), name, meta["num_docs"], time.perf_counter() - start,
+        )
+        return manifest
+
+
+class BackgroundIndexer:
+    """Фоновый поток: раз в interval секунд обновляет индекс и компактирует его при необходимости"""
+
+    def __init__(self, loader: DatabaseTextLoader, interval: float, index_dir: Path = INDEX_DIR,
+                 backend: str = RETRIEVAL_BACKEND):
+        self.loader = loader
+        self.interval = interval
+        self.index_dir = index_dir
+        self.backend = backend
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="index-updater", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info("Background index updates every %.0fs", self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.backend == "fts":
+                    update_fts_index(self.loader)
+                    continue
+                update_index(self.loader, self.index_dir)
+                if needs_compaction(self.index_dir):
+                    compact_index(self.index_dir)
+            except Exception:
+                logger.exception("Background index update failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "update", "compact"])
+    parser.add_argument("--db", default="warhammer_articles.db")
+    parser.add_argument("--index-dir", type=Path, default=INDEX_DIR)
+    parser.add_argument("--backend", choices=["bm25", "fts"], default=RETRIEVAL_BACKEND)
+    parser.add_argument("--fts-file", type=Path, default=FTS_INDEX_FILE)
+    parser.add_argument("--workers", type=int, default=INDEX_BUILD_WORKERS,
+                        help="процессов лемматизации (0 — все ядра)")
+    parser.add_argument("--progress-interval", type=float, default=INDEX_BUILD_PROGRESS_INTERVAL,
+                        help="период логирования прогресса, с (0 — выключить)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    lemma_cache.load(LEMMA_CACHE_FILE)
+    loader = DatabaseTextLoader(args.db)
+    if args.backend == "fts":
+        if args.command == "build":
+            rebuild_fts_index(loader, args.fts_file, workers=args.workers, progress_interval=args.progress_interval)
+        elif args.command == "update":
+            update_fts_index(loader, args.fts_file, workers=args.workers)
+        else:
+            logger.info("FTS index has no segments to compact")
+        return
+
+    if args.command == "build":
+        rebuild_index(loader, args.index_dir, workers=args.workers, progress_interval=args.progress_interval)
+    elif args.command == "update":
+        update_index(loader, args.index_dir, workers=args.workers)
+        if needs_compaction(args.index_dir):
+            compact_index(args.index_dir)
+    else:
+        compact_index(args.index_dir)
+
+
+if __name__ == "__main__":
+    main()
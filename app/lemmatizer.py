@@ -0,0 +1,81 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from pymorphy2 import MorphAnalyzer
+
+logger = logging.getLogger(__name__)
+
+
+class LemmaCache:
+    """LRU-кэш word -> lemma поверх pymorphy2.
+
+    Заполняется словарём корпуса при построении индекса и сохраняется рядом с ним,
+    так что на запросах pymorphy2 вызывается только для новых слов.
+    """
+
+    def __init__(self, maxsize: int = 300_000, morph: MorphAnalyzer | None = None):
+        self.maxsize = maxsize
+        self._morph = morph or MorphAnalyzer()
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lemma(self, word: str) -> str:
+        with self._lock:
+            lemma = self._cache.get(word)
+            if lemma is not None:
+                self._cache.move_to_end(word)
+                self.hits += 1
+                return lemma
+            self.misses += 1
+
+        lemma = self._morph.parse(word)[0].normal_form
+
+        with self._lock:
+            self._cache[word] = lemma
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return lemma
+
+    def update(self, items):
+        """Добавляет готовые пары (word, lemma), например из воркеров параллельной сборки"""
+        with self._lock:
+            for word, lemma in items:
+                self._cache[word] = lemma
+                self._cache.move_to_end(word)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self, path: Path):
+        """Сохраняет словарь в порядке LRU (самые свежие — в конце)"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with self._lock:
+            items = list(self._cache.items())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        tmp_path.replace(path)
+        logger.info("Saved %d lemmas to %s", len(items), path)
+
+    def load(self, path: Path):
+        if not path.exists():
+            logger.info("No lemma dictionary at %s", path)
+            return
+        with open(path, encoding="utf-8") as f:
+            items = json.load(f)
+        self.update(items[-self.maxsize:])
+        logger.info("Loaded %d lemmas from %s", len(items), path)
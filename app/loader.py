@@ -7,8 +7,9 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 logger = logging.getLogger(__name__)
 
 class DatabaseTextLoader:
-    def __init__(self, db_path='warhammer_articles.db'):
+    def __init__(self, db_path='warhammer_articles.db', batch_size=500):
         self.db_path = db_path
+        self.batch_size = batch_size
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=50,
@@ -16,66 +17,155 @@ class DatabaseTextLoader:
         )
         logger.info(f"Initialized DatabaseTextLoader with database at: {db_path}")
 
-    def load_and_split_documents(self, limit=50000):
-        """Loads the first `limit` articles from database with sources in metadata.
-        Returns a tuple of (chunks, titles) where both are in the same Document format."""
-        chunks = []
-        titles = []
+    # Источники подтягиваем подзапросом по индексу sources(article_id) —
+    # без GROUP BY по JOIN всей таблицы
+    ARTICLES_QUERY = '''
+        SELECT a.id, a.original_title, a.content, a.article_url,
+            (SELECT GROUP_CONCAT(s.source_text, '|||') FROM sources s WHERE s.article_id = a.id) as sources
+        FROM articles a
+        WHERE {where}
+        ORDER BY a.id
+        LIMIT ?
+    '''
+
+    def _ensure_sources_index(self, conn):
+        try:
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sources_article_id ON sources(article_id)')
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # read-only база: работаем без индекса, только медленнее
+            logger.warning(f"Could not create index on sources.article_id: {e}")
+
+    def iter_articles(self, limit=50000, article_ids=None, until=None):
+        """Yields (id, title, content, article_url, sources) rows page by page.
 
+        Keyset pagination on articles.id: each page is one short query with `batch_size`
+        rows, so memory does not grow with the corpus. If `article_ids` is given, yields
+        only these articles (used by incremental indexing). If `until` is given, yields only
+        articles with last_updated < `until` (see changed_articles)."""
+        conn = sqlite3.connect(self.db_path)
         try:
-            conn = sqlite3.connect(self.db_path)
+            self._ensure_sources_index(conn)
             cursor = conn.cursor()
-            logger.info("Connected to database, starting data loading")
-
-            # Добавляем article_url в выборку
-            cursor.execute(f'''
-                SELECT a.id, a.original_title, a.content, a.article_url,
-                    GROUP_CONCAT(s.source_text, '|||') as sources
-                FROM articles a
-                LEFT JOIN sources s ON a.id = s.article_id
-                GROUP BY a.id
-                LIMIT ?
-            ''', (limit,))
-
-            articles = cursor.fetchall()
-            logger.info(f"Found {len(articles)} articles in database (limit={limit})")
-
-            for article_id, title, content, article_url, sources in articles:
-                metadata = {
-                    'article_id': article_id,
-                    'title': title,
-                    'source': article_url if article_url else 'https://warhammer40k.fandom.com/ru/wiki/Warhammer_40000_Wiki',
-                    'sources': sources.replace(';;;', ', ') if sources else None
-                }
-
-                # Создаем документ для заголовка
-                title_doc = Document(
-                    page_content=title,
-                    metadata=metadata.copy()
-                )
-                titles.append(title_doc)
+            if article_ids is not None:
+                ids = sorted(article_ids)[:limit]
+                for start in range(0, len(ids), self.batch_size):
+                    batch = ids[start:start + self.batch_size]
+                    where = f"a.id IN ({','.join('?' * len(batch))})"
+                    cursor.execute(self.ARTICLES_QUERY.format(where=where), (*batch, len(batch)))
+                    yield from cursor.fetchall()
+                return
 
-                # Создаем документ для контента и разбиваем на чанки
-                doc = Document(
-                    page_content=content,
-                    metadata=metadata
+            where, params = "a.id > ?", ()
+            if until is not None:
+                where, params = "a.id > ? AND a.last_updated < ?", (until,)
+            last_id, remaining = 0, limit
+            while remaining > 0:
+                cursor.execute(
+                    self.ARTICLES_QUERY.format(where=where),
+                    (last_id, *params, min(self.batch_size, remaining)),
                 )
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield from rows
+                last_id = rows[-1][0]
+                remaining -= len(rows)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            raise
+        finally:
+            conn.close()
+
+    def _split_article(self, article_id, title, content, article_url, sources):
+        """Returns (title_doc, chunks) for one article row"""
+        metadata = {
+            'article_id': article_id,
+            'title': title,
+            'source': article_url if article_url else 'https://warhammer40k.fandom.com/ru/wiki/Warhammer_40000_Wiki',
+            'sources': sources.replace(';;;', ', ') if sources else None
+        }
 
-                article_chunks = self.splitter.split_documents([doc])
+        # Создаем документ для заголовка
+        title_doc = Document(
+            page_content=title,
+            metadata=metadata.copy()
+        )
 
-                for chunk in article_chunks:
-                    chunk.page_content = f"[ЗАГОЛОВОК СТАТЬИ]: {title} {title} {title} {title} {title}\n{chunk.page_content}"
-                    chunks.append(chunk)
+        # Создаем документ для контента и разбиваем на чанки
+        doc = Document(
+            page_content=content,
+            metadata=metadata
+        )
 
-                logger.debug(f"Processed article: {title} ({len(article_chunks)} chunks)")
+        article_chunks = self.splitter.split_documents([doc])
+        for chunk in article_chunks:
+            chunk.page_content = f"[ЗАГОЛОВОК СТАТЬИ]: {title} {title} {title} {title} {title}\n{chunk.page_content}"
 
-            logger.info(f"Successfully loaded {len(titles)} titles and {len(chunks)} chunks")
-            return chunks, titles
+        logger.debug(f"Processed article: {title} ({len(article_chunks)} chunks)")
+        return title_doc, article_chunks
 
-        except sqlite3.Error as e:
-            logger.error(f"Database error: {e}")
+    def iter_chunks(self, limit=50000, article_ids=None, until=None):
+        """Streams chunk Documents article by article; see iter_articles for arguments"""
+        articles = chunks = 0
+        for row in self.iter_articles(limit=limit, article_ids=article_ids, until=until):
+            _, article_chunks = self._split_article(*row)
+            articles += 1
+            chunks += len(article_chunks)
+            yield from article_chunks
+        logger.info(f"Streamed {chunks} chunks from {articles} articles")
+
+    def load_and_split_documents(self, limit=50000, article_ids=None):
+        """Loads the first `limit` articles from database with sources in metadata.
+        If `article_ids` is given, loads only these articles (used by incremental indexing).
+        Returns a tuple of (chunks, titles) where both are in the same Document format.
+        Materializes the whole corpus; use iter_chunks to feed the index builder."""
+        chunks = []
+        titles = []
+
+        try:
+            for row in self.iter_articles(limit=limit, article_ids=article_ids):
+                title_doc, article_chunks = self._split_article(*row)
+                titles.append(title_doc)
+                chunks.extend(article_chunks)
+        except sqlite3.Error:
             return [], []
+
+        logger.info(f"Successfully loaded {len(titles)} titles and {len(chunks)} chunks")
+        return chunks, titles
+
+    def _query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
         finally:
-            if 'conn' in locals():
-                conn.close()
-                logger.info("Database connection closed")
+            conn.close()
+
+    def current_timestamp(self):
+        """Database clock in the format of articles.last_updated"""
+        return self._query("SELECT CURRENT_TIMESTAMP")[0][0]
+
+    def max_last_updated(self):
+        return self._query("SELECT MAX(last_updated) FROM articles")[0][0]
+
+    def article_ids(self):
+        return {row[0] for row in self._query("SELECT id FROM articles")}
+
+    def changed_articles(self, since, until):
+        """Articles with `since` <= last_updated < `until` as a dict id -> last_updated.
+
+        `until` should be the database clock taken before reading and becomes the next
+        `since`: articles saved later within the same second are picked up by the next
+        update instead of being lost."""
+        if since is None:
+            rows = self._query("SELECT id, last_updated FROM articles WHERE last_updated < ?", (until,))
+        else:
+            rows = self._query(
+                "SELECT id, last_updated FROM articles WHERE last_updated >= ? AND last_updated < ?",
+                (since, until),
+            )
+        return dict(rows)
+
+    def last_update_run(self):
+        """Date of the last crawler run from update_history (None if never logged)"""
+        return self._query("SELECT MAX(run_date) FROM update_history")[0][0]
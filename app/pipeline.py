@@ -0,0 +1,37 @@
+"""Сборка RAG-пайплайна при старте процесса — общая для бота (bot.py) и HTTP API (app/api.py)"""
+import logging
+
+from app.loader import DatabaseTextLoader
+from app.embedder import build_or_load_vectorstore, first_stage_exists
+from app.llm import get_llm
+from app.rag import build_answer_chain
+from app.answer_cache import AnswerCache
+from app.executor import RagExecutor
+from app.config import (
+    CHROMA_PERSIST_DIR, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_FILE, ANSWER_CACHE_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_rag_executor(loader: DatabaseTextLoader | None = None) -> RagExecutor:
+    """Ретривер (готовый индекс или сборка из базы), цепочка ответа, кэш ответов и лимиты RagExecutor"""
+    if first_stage_exists():
+        logger.info("Loading existing vectorstore from %s", CHROMA_PERSIST_DIR)
+        retriever = build_or_load_vectorstore([])
+    else:
+        logger.info("Creating new vectorstore")
+        loader = loader or DatabaseTextLoader()
+        # watermark — часы базы до чтения статей: в индекс идут статьи старше него,
+        # всё, что краулер запишет позже (даже в ту же секунду), подхватит обновление
+        until = loader.current_timestamp()
+        # чанки идут из базы потоком прямо в построение индекса
+        retriever = build_or_load_vectorstore(loader.iter_chunks(until=until), watermark=until)
+        logger.info("Vectorstore created and persisted at %s", CHROMA_PERSIST_DIR)
+
+    answer_cache = None
+    if ANSWER_CACHE_SIZE > 0:
+        answer_cache = AnswerCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, path=ANSWER_CACHE_FILE,
+                                   flush_interval=ANSWER_CACHE_FLUSH_INTERVAL)
+        answer_cache.load(retriever.index_id)
+    return RagExecutor(retriever, build_answer_chain(get_llm()), answer_cache=answer_cache)
@@ -20,13 +20,27 @@ TELEGRAM_PROMPT_TEMPLATE = """Ты эксперт по вселенной Warham
 Ответ:
 """
 
-def build_rag_chain(llm, retriever):
+def build_answer_chain(llm):
+    """Цепочка генерации: {"input", "context": [Document]} -> str"""
     prompt = ChatPromptTemplate.from_template(
         TELEGRAM_PROMPT_TEMPLATE,
         partial_variables={"max_length": str(MAX_RESPONSE_LENGTH)}
     )
-    
-    document_chain = create_stuff_documents_chain(llm, prompt)
+    return create_stuff_documents_chain(llm, prompt)
+
+def build_rag_chain(llm, retriever):
+    document_chain = build_answer_chain(llm)
     retrieval_chain = create_retrieval_chain(retriever, document_chain)
     
     return retrieval_chain
+
+def collect_sources(documents) -> list[tuple[str, str]]:
+    """Уникальные (заголовок, ссылка) документов контекста, отсортированные"""
+    return sorted({
+        (
+            doc.metadata.get("document_title", doc.metadata.get("title", "Без названия")),
+            doc.metadata.get("source")
+        )
+        for doc in documents
+        if doc.metadata.get("source")
+    })
@@ -0,0 +1,303 @@
+import os
+import time
+import queue
+import pickle
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RERANKER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+
+class OnnxCrossEncoder:
+    """CrossEncoder на ONNX Runtime (CPU); predict совместим с CrossEncoder.predict.
+
+    Модель с одним логитом (bge-reranker), как и в CrossEncoder к нему применяется сигмоида.
+    """
+
+    def __init__(self, model_dir: Path, onnx_file: str = ONNX_FILE,
+                 max_length: int | None = None, num_threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_dir / onnx_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        pairs = list(pairs)
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            encoded = self.tokenizer(
+                [q for q, _ in batch], [d for _, d in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np",
+            )
+            inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self._input_names}
+            logits = self.session.run(None, inputs)[0][:, 0]
+            scores.append(1 / (1 + np.exp(-logits)))
+        return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+
+def export_onnx(model_name: str, model_dir: Path, quantize: bool = False):
+    """Экспорт HF-модели реранкера в ONNX и (опционально) динамическая int8-квантизация"""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    model_dir.mkdir(parents=True, exist_ok=True)
+    onnx_path = model_dir / ONNX_FILE
+    if not onnx_path.exists():
+        logger.info("Exporting %s to ONNX at %s", model_name, onnx_path)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        tokenizer.save_pretrained(model_dir)
+
+        sample = tokenizer(["вопрос"], ["документ"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        with torch.no_grad():
+            # модель > 2 ГБ — веса уходят во внешние файлы рядом с model.onnx
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                str(onnx_path),
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+
+    int8_path = model_dir / ONNX_INT8_FILE
+    if quantize and not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info("Quantizing %s to int8", onnx_path)
+        quantize_dynamic(
+            str(onnx_path), str(int8_path),
+            weight_type=QuantType.QInt8,
+            use_external_data_format=True,
+        )
+
+
+def load_reranker(backend: str, model_name: str, onnx_dir: Path):
+    """Реранкер по имени бэкенда: torch (CrossEncoder), onnx (fp32) или onnx-int8"""
+    if backend == "torch":
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+
+    if backend not in RERANKER_BACKENDS:
+        raise ValueError(f"Unknown reranker backend {backend!r}, expected one of {RERANKER_BACKENDS}")
+
+    model_dir = onnx_dir / model_name.replace("/", "--")
+    quantize = backend == "onnx-int8"
+    export_onnx(model_name, model_dir, quantize=quantize)
+    return OnnxCrossEncoder(model_dir, ONNX_INT8_FILE if quantize else ONNX_FILE)
+
+
+class BatchingReranker:
+    """Динамический micro-batching поверх CrossEncoder.
+
+    predict(pairs) из разных потоков кладёт запрос в очередь; фоновый поток собирает
+    пары всех запросов, пришедших за batch_window секунд (или пока не наберётся
+    max_batch_size пар), делает один forward pass и раздаёт оценки по future.
+    Интерфейс совпадает с CrossEncoder.predict, поэтому это drop-in замена.
+    """
+
+    def __init__(self, model, batch_window: float = 0.01, max_batch_size: int = 128,
+                 batch_size: int = 32):
+        self.model = model
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batch_size = batch_size  # размер батча внутри model.predict
+        self._requests: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._worker.start()
+        logger.info(
+            "BatchingReranker started (window=%.0fms, max_batch_size=%d)",
+            batch_window * 1000, max_batch_size,
+        )
+
+    def predict(self, pairs, **kwargs) -> np.ndarray:
+        pairs = list(pairs)
+        if not pairs:
+            return np.empty(0, dtype=np.float32)
+        future: Future = Future()
+        self._requests.put((pairs, future))
+        return future.result()
+
+    def close(self):
+        self._requests.put(None)
+        self._worker.join()
+
+    def _collect(self, first) -> list:
+        """Добирает запросы в батч, пока не истечёт окно или не наберётся max_batch_size"""
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.batch_window
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # сигнал остановки — вернём его в очередь, обработаем после батча
+                self._requests.put(None)
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+
+            pairs = [pair for request_pairs, _ in batch for pair in request_pairs]
+            try:
+                scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            logger.debug("Reranked %d pairs from %d requests in one pass", len(pairs), len(batch))
+            offset = 0
+            for request_pairs, future in batch:
+                future.set_result(scores[offset:offset + len(request_pairs)])
+                offset += len(request_pairs)
+
+
+class RerankScoreCache:
+    """LRU-кэш оценок реранкера: (лемматизированный запрос, chunk_id) -> score.
+
+    chunk_id — позиция чанка в индексе, поэтому кэш привязан к index_id:
+    при смене версии индекса (пересборка) все записи сбрасываются.
+    Сохраняется на диск в фоновом потоке каждые flush_every новых записей.
+    """
+
+    def __init__(self, path: Path | None = None, maxsize: int = 200_000, flush_every: int = 1000):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_every = flush_every
+        self.index_id = ""
+        self._scores: OrderedDict[tuple[str, int], float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = 0
+        self._flushing = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, index_id: str):
+        self.index_id = index_id
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("index_id") != index_id:
+                logger.info("Rerank cache at %s belongs to another index version, discarding", self.path)
+                return
+            scores = OrderedDict(data["scores"][-self.maxsize:])
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, ValueError, TypeError, AttributeError) as e:
+            # оборванная или чужая запись — кэш только ускоряет реранк, начинаем с холодного
+            logger.warning("Failed to load rerank cache from %s, starting cold: %s", self.path, e)
+            return
+        with self._lock:
+            self._scores = scores
+        logger.info("Loaded %d rerank scores from %s", len(self._scores), self.path)
+
+    def save(self):
+        """Записывает кэш на диск; ошибки записи только логируются"""
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = {"index_id": self.index_id, "scores": list(self._scores.items())}
+                self._dirty = 0
+            tmp_path = None
+            try:
+                # уникальный временный файл: кэш общий для процессов-воркеров
+                with tempfile.NamedTemporaryFile("wb", dir=self.path.parent, prefix=self.path.name + ".",
+                                                 suffix=".tmp", delete=False) as f:
+                    tmp_path = f.name
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.path)
+            except (OSError, pickle.PicklingError) as e:
+                logger.error("Failed to save rerank cache to %s: %s", self.path, e)
+                if tmp_path is not None:
+                    Path(tmp_path).unlink(missing_ok=True)
+
+    def _flush(self):
+        try:
+            self.save()
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _check_index(self, index_id: str):
+        if index_id != self.index_id:
+            logger.info("Index version changed (%s -> %s), clearing rerank cache", self.index_id, index_id)
+            self._scores.clear()
+            self.index_id = index_id
+
+    def get_many(self, index_id: str, query: str, chunk_ids) -> list[float | None]:
+        with self._lock:
+            self._check_index(index_id)
+            result = []
+            for chunk_id in chunk_ids:
+                key = (query, int(chunk_id))
+                score = self._scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._scores.move_to_end(key)
+                    self.hits += 1
+                result.append(score)
+            return result
+
+    def put_many(self, index_id: str, query: str, chunk_ids, scores):
+        with self._lock:
+            self._check_index(index_id)
+            for chunk_id, score in zip(chunk_ids, scores):
+                self._scores[(query, int(chunk_id))] = float(score)
+            while len(self._scores) > self.maxsize:
+                self._scores.popitem(last=False)
+            self._dirty += len(chunk_ids)
+            need_flush = self._dirty >= self.flush_every and not self._flushing
+            if need_flush:
+                self._flushing = True
+        if need_flush:
+            # запись на диск не на пути запроса; пока она идёт, новые не запускаются
+            threading.Thread(target=self._flush, name="rerank-cache-flush", daemon=True).start()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._scores),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,101 @@
+"""Скорость и размер результата clean_html на сохранённых HTML-страницах фэндома.
+
+Режимы: bs4-legacy — прежняя версия (селекторы вида "div.portable-infobox" понимались
+как имена тегов, инфобоксы и сноски оставались в тексте), bs4 и selectolax — текущие
+бэкенды с настоящими CSS-селекторами. differ — сколько страниц дали текст,
+отличный от bs4; cited — в скольких остались маркеры сносок вида [1].
+
+Страницы — настоящий HTML статей из API фэндома (--fetch сохраняет его тем же
+fetch_articles_html, что и краулер): разметка Cite, инфобоксы и оглавление как в базе.
+Синтетические страницы не подходят — на них селекторы проверяются сами на себе.
+
+    python -m benchmarks.clean_html --fixtures html_fixtures --fetch 200   # скачать страницы
+    python -m benchmarks.clean_html --fixtures html_fixtures --repeat 3
+"""
+import re
+import time
+import argparse
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from parser.warhammer_wiki import CLEANERS, FandomParser, LexborHTMLParser, WarhammerDatabase
+
+# маркер сноски Cite (<sup class="reference">[1]</sup>), оставшийся в тексте
+_CITE_MARKER = re.compile(r"\[\d+\]")
+
+
+def _clean_html_legacy(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup([
+        "script", "style", "table", "div.portable-infobox",
+        "div.references", "span.mw-editsection", "div.notice",
+        "div.hatnote", "div.redirectMsg", "nav", "footer",
+        "aside", "figure", "img", "svg", "noscript"
+    ]):
+        element.decompose()
+    text_parts = []
+    for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li']):
+        text = element.get_text(' ', strip=True)
+        if text and len(text) > 10:
+            if element.name.startswith('h'):
+                text = f"\n{text.upper()}\n"
+            text_parts.append(text)
+    return '\n'.join(text_parts)
+
+
+def _fetch_fixtures(path: Path, n_pages: int):
+    """Сохраняет HTML первых n_pages статей вики (с задержкой краулера)"""
+    path.mkdir(parents=True, exist_ok=True)
+    db = WarhammerDatabase(str(path / "fixtures.db"))
+    parser = FandomParser(db)
+    titles = [title for title, _, _ in parser.fetch_page_info(n_pages)]
+    saved = 0
+    for lo in range(0, len(titles), 50):
+        for html, _ in parser.fetch_articles_html(titles[lo:lo + 50]).values():
+            if html:
+                (path / f"{saved:05d}.html").write_text(html, encoding="utf-8")
+                saved += 1
+    db.close()
+    (path / "fixtures.db").unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", type=Path, required=True, help="каталог с *.html")
+    parser.add_argument("--fetch", type=int, default=0, help="сначала скачать столько страниц в --fixtures")
+    parser.add_argument("--repeat", type=int, default=3, help="проходов по всем страницам")
+    args = parser.parse_args()
+
+    if args.fetch:
+        _fetch_fixtures(args.fixtures, args.fetch)
+    pages = [p.read_text(encoding="utf-8") for p in sorted(args.fixtures.glob("*.html"))]
+    if not pages:
+        parser.error(f"no *.html fixtures in {args.fixtures} (use --fetch N)")
+    input_mb = sum(len(html.encode("utf-8")) for html in pages) / 2 ** 20
+    print(f"{len(pages)} pages, {input_mb:.1f} MB of HTML")
+
+    cleaners = {"bs4-legacy": _clean_html_legacy, **CLEANERS}
+    if LexborHTMLParser is None:
+        del cleaners["selectolax"]
+        print("selectolax is not installed, skipping it")
+    reference = [CLEANERS["bs4"](html) for html in pages]
+    print(f"{'backend':>12} {'pages/s':>9} {'MB/s':>7} {'avg chars':>10} {'output, MB':>11} {'differ':>7} "
+          f"{'cited':>6}")
+    for name, clean in cleaners.items():
+        outputs = [clean(html) for html in pages]  # заодно прогрев
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for html in pages:
+                clean(html)
+        elapsed = time.perf_counter() - start
+
+        differ = sum(a != b for a, b in zip(outputs, reference))
+        cited = sum(bool(_CITE_MARKER.search(text)) for text in outputs)
+        output_mb = sum(len(text.encode("utf-8")) for text in outputs) / 2 ** 20
+        print(f"{name:>12} {len(pages) * args.repeat / elapsed:9.1f} {input_mb * args.repeat / elapsed:7.2f} "
+              f"{sum(map(len, outputs)) / len(pages):10.0f} {output_mb:11.2f} {differ:>7} {cited:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Скорость TelegramMarkdownFormatter.
+
+Сравнивает прежний посимвольный форматтер (legacy, с обрезкой до MAX_MESSAGE_LENGTH)
+с текущими format и split на типичных ответах и показывает, как время format растёт
+с длиной на патологических входах (непарные '**', "[[[[", "```"). Корректность вывода
+проверяют property-тесты в tests/test_formatter.py.
+
+    python -m benchmarks.formatter --repeat 200
+"""
+import re
+import time
+import random
+import argparse
+from typing import Tuple
+
+from app.config import MAX_MESSAGE_LENGTH
+from app.formatter import TelegramMarkdownFormatter
+
+FRAGMENTS = [
+    "Император", "Хорус", "ересь", "примарх", "легион", "космодесант", "варп", "C#", "x_y",
+    "**", "*", "#", "## ", "\n", "\n\n", "\n### Заголовок\n", " ", " ", " ", "`", "```", "```python\n",
+    "[", "]", "(", ")", "[Ересь Хоруса](https://warhammer40k.fandom.com/ru/wiki/Ересь_Хоруса)",
+    "[Хорус](https://warhammer40k.fandom.com/ru/wiki/Хорус_(примарх))",
+    "\\", ".", "!", "-", "1.", "(M31)", ">", "|", "{", "}", "~", "=", "+",
+]
+
+
+class _LegacyFormatter:
+    """Прежняя реализация (до перехода на токенизатор): посимвольный цикл, код-блоки в атрибуте класса"""
+
+    _ESCAPE_CHARS = '_[]()~`>#+-=|{}.!'
+    _CODE_BLOCK_PATTERN = r'```(.*?)```'
+
+    @classmethod
+    def format(cls, text: str) -> str:
+        """Основной метод форматирования текста"""
+        if not text:
+            return text
+
+        truncated = cls._truncate(text)
+
+        text = cls._preserve_code_blocks(truncated)
+
+        formatted = cls._process_text(text)
+
+        formatted = cls._restore_code_blocks(formatted)
+
+        return formatted
+
+    @classmethod
+    def _preserve_code_blocks(cls, text: str) -> str:
+        """Сохраняет код-блоки перед обработкой"""
+        cls._code_blocks = []
+        def replace_code(match):
+            cls._code_blocks.append(match.group(0))
+            return f'__CODE_BLOCK_{len(cls._code_blocks)-1}__'
+
+        return re.sub(cls._CODE_BLOCK_PATTERN, replace_code, text, flags=re.DOTALL)
+
+    @classmethod
+    def _restore_code_blocks(cls, text: str) -> str:
+        """Восстанавливает код-блоки после обработки"""
+        for i, code in enumerate(cls._code_blocks):
+            text = text.replace(f'__CODE_BLOCK_{i}__', code)
+        return text
+
+    @classmethod
+    def _process_text(cls, text: str) -> str:
+        """Обработка текста (без код-блоков)"""
+        formatted_text = []
+        i = 0
+        n = len(text)
+
+        while i < n:
+            # Пропускаем временные метки код-блоков
+            if text.startswith('__CODE_BLOCK_', i):
+                end = text.find('__', i + 13)
+                if end != -1:
+                    formatted_text.append(text[i:end+2])
+                    i = end + 2
+                    continue
+
+            # Обработка ссылок [текст](url)
+            if text[i] == '[':
+                i, link_part = cls._process_link(text, i, n)
+                if link_part:
+                    formatted_text.append(link_part)
+                    continue
+
+            # Обработка заголовков (начинаются с #)
+            if text[i] == '#':
+                i, header_part = cls._process_header(text, i, n)
+                if header_part:
+                    formatted_text.append(header_part)
+                    continue
+
+            # Обработка жирного текста **text**
+            if i + 1 < n and text[i] == '*' and text[i+1] == '*':
+                i, bold_part = cls._process_bold(text, i, n)
+                if bold_part:
+                    formatted_text.append(bold_part)
+                    continue
+
+            # Экранирование обычных символов
+            char = text[i]
+            if char in cls._ESCAPE_CHARS:
+                formatted_text.append(f'\\{char}')
+            else:
+                formatted_text.append(char)
+            i += 1
+
+        return ''.join(formatted_text)
+
+    @classmethod
+    def _process_link(cls, text: str, i: int, n: int) -> Tuple[int, str]:
+        """Обработка ссылки [текст](url)"""
+        j = i + 1
+        while j < n and text[j] != ']':
+            j += 1
+
+        if j < n and text[j] == ']' and j + 1 < n and text[j+1] == '(':
+            k = j + 2
+            while k < n and text[k] != ')':
+                k += 1
+
+            if k < n and text[k] == ')':
+                link_text = text[i+1:j]
+                url = text[j+2:k]
+
+                escaped_link_text = []
+                for char in link_text:
+                    if char in cls._ESCAPE_CHARS:
+                        escaped_link_text.append(f'\\{char}')
+                    else:
+                        escaped_link_text.append(char)
+
+                return k + 1, f'[{"".join(escaped_link_text)}]({url})'
+
+        return i, ''
+
+    @classmethod
+    def _process_header(cls, text: str, i: int, n: int) -> Tuple[int, str]:
+        """Обработка заголовка (# Header)"""
+        header_level = 0
+        start = i
+        while i < n and text[i] == '#':
+            header_level += 1
+            i += 1
+
+        while i < n and text[i] == ' ':
+            i += 1
+
+        j = i
+        while j < n and text[j] != '\n':
+            j += 1
+
+        header_text = []
+        k = i
+        while k < j:
+            char = text[k]
+            if char in cls._ESCAPE_CHARS:
+                header_text.append(f'\\{char}')
+            else:
+                header_text.append(char)
+            k += 1
+
+        if header_text:
+            return j, f'*{"".join(header_text)}*'
+
+        return start, ''
+
+    @classmethod
+    def _process_bold(cls, text: str, i: int, n: int) -> Tuple[int, str]:
+        """Обработка жирного текста (**bold**)"""
+        j = i + 2
+        while j < n and not (text[j] == '*' and j + 1 < n and text[j+1] == '*'):
+            j += 1
+
+        if j + 1 < n and text[j] == '*' and text[j+1] == '*':
+            bold_text = []
+            k = i + 2
+            while k < j:
+                char = text[k]
+                if char in cls._ESCAPE_CHARS:
+                    bold_text.append(f'\\{char}')
+                else:
+                    bold_text.append(char)
+                k += 1
+
+            return j + 2, f'*{"".join(bold_text)}*'
+
+        return i, ''
+
+    @classmethod
+    def _truncate(cls, text: str) -> str:
+        """Обрезка длинных сообщений"""
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return text[:MAX_MESSAGE_LENGTH-50] + "...\n\n[ответ сокращен]"
+        return text
+
+
+def random_text(rnd: random.Random, max_fragments: int) -> str:
+    return ''.join(rnd.choices(FRAGMENTS, k=rnd.randint(1, max_fragments)))
+
+
+def _time(func, text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="повторов на типичном ответе")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    answers = {
+        "short": random_text(rnd, 60),
+        "typical": ''.join(rnd.choices(FRAGMENTS[:9] + [" "] * 6 + ["**", "\n", "."], k=700)),
+        "long": ''.join(rnd.choices(FRAGMENTS[:9] + [" "] * 6 + ["**", "\n", "\n\n", "."], k=6000)),
+    }
+    print(f"{'input':>8} {'chars':>7} {'legacy, us':>11} {'format, us':>11} {'split, us':>10} "
+          f"{'partial, us':>12} {'messages':>9}")
+    for name, text in answers.items():
+        legacy = _time(_LegacyFormatter.format, text, args.repeat)
+        new = _time(TelegramMarkdownFormatter.format, text, args.repeat)
+        split = _time(TelegramMarkdownFormatter.split, text, args.repeat)
+        partial = _time(TelegramMarkdownFormatter.format_partial, text, args.repeat)
+        print(f"{name:>8} {len(text):7d} {legacy * 1e6:11.0f} {new * 1e6:11.0f} {split * 1e6:10.0f} "
+              f"{partial * 1e6:12.0f} {len(TelegramMarkdownFormatter.split(text)):9d}")
+
+    # время на символ не должно расти с длиной входа; legacy обрезает вход до MAX_MESSAGE_LENGTH
+    sizes = (4000, 16000, 64000)
+    print(f"\n{'pattern':>12} {'legacy 4000':>12} " + " ".join(f"{n:>9}" for n in sizes) + "   (ns/char)")
+    for pattern in ("**a", "[[", "[a](", "[a](b(", "```x", "# **"):
+        texts = [(pattern * (n // len(pattern) + 1))[:n] for n in sizes]
+        legacy = _time(_LegacyFormatter.format, texts[0], 3) / sizes[0] * 1e9
+        row = [_time(TelegramMarkdownFormatter.format, text, 5) / n * 1e9 for text, n in zip(texts, sizes)]
+        print(f"{pattern!r:>12} {legacy:12.0f} " + " ".join(f"{v:9.0f}" for v in row))
+
+if __name__ == "__main__":
+    main()
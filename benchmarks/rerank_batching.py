@@ -0,0 +1,83 @@
+"""Пропускная способность и p95-латентность реранкера при разных окнах micro-batching.
+
+    python -m benchmarks.rerank_batching --windows 0,5,10,20 --clients 8
+"""
+import time
+import random
+import argparse
+import threading
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from app.reranker import BatchingReranker
+
+WORDS = (
+    "император хорус ересь варп легион космодесант примарх терра хаос кузница "
+    "инквизиция орден крестовый поход демон корабль сектор мир улей битва"
+).split()
+
+
+def _make_requests(n_requests: int, pairs_per_request: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    return [
+        [
+            (" ".join(rnd.choices(WORDS, k=4)), " ".join(rnd.choices(WORDS, k=120)))
+            for _ in range(pairs_per_request)
+        ]
+        for _ in range(n_requests)
+    ]
+
+
+def _run(reranker, requests: list, clients: int) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+    lock = threading.Lock()
+    chunks = [requests[i::clients] for i in range(clients)]
+
+    def client(my_requests):
+        for pairs in my_requests:
+            start = time.perf_counter()
+            reranker.predict(pairs)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in chunks]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="BAAI/bge-reranker-v2-m3")
+    parser.add_argument("--windows", default="0,5,10,20", help="окна батчинга в мс")
+    parser.add_argument("--max-batch", type=int, default=128)
+    parser.add_argument("--clients", type=int, default=8, help="параллельные запросы")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--pairs", type=int, default=16, help="пар на запрос")
+    args = parser.parse_args()
+
+    model = CrossEncoder(args.model)
+    requests = _make_requests(args.requests, args.pairs)
+    model.predict(requests[0])  # прогрев
+
+    total_pairs = args.requests * args.pairs
+    print(f"{'mode':>14} {'pairs/s':>9} {'p50, ms':>9} {'p95, ms':>9}")
+
+    elapsed, latencies = _run(model, requests, args.clients)
+    print(f"{'direct':>14} {total_pairs / elapsed:9.1f} "
+          f"{np.percentile(latencies, 50) * 1000:9.1f} {np.percentile(latencies, 95) * 1000:9.1f}")
+
+    for window_ms in (float(w) for w in args.windows.split(",")):
+        reranker = BatchingReranker(model, batch_window=window_ms / 1000, max_batch_size=args.max_batch)
+        elapsed, latencies = _run(reranker, requests, args.clients)
+        reranker.close()
+        print(f"{f'window={window_ms:g}ms':>14} {total_pairs / elapsed:9.1f} "
+              f"{np.percentile(latencies, 50) * 1000:9.1f} {np.percentile(latencies, 95) * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Сравнение бэкендов реранкера: pairs/s и согласованность ранжирования с fp32-моделью.
+
+Кандидаты для каждого запроса берутся из локального BM25-индекса (stage 1),
+эталон — оценки PyTorch CrossEncoder (fp32).
+
+    python -m benchmarks.reranker_backends --queries queries.txt --backends torch,onnx,onnx-int8
+"""
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from app.config import RERANKER_MODEL, RERANKER_ONNX_DIR
+from app.bm25 import BM25SparseRetriever, index_exists
+from app.embedder import INDEX_DIR, _tokenize_ru
+from app.reranker import RERANKER_BACKENDS, load_reranker
+
+
+def read_queries(path: Path) -> list[str]:
+    """Текстовый файл (запрос на строку) или JSONL с полем "query" """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def ndcg_at_k(reference: np.ndarray, predicted: np.ndarray, k: int) -> float:
+    """NDCG@k ранжирования predicted, где релевантность — эталонные оценки"""
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = np.sort(reference)[::-1][:k]
+    ranked = reference[np.argsort(-predicted, kind="stable")][:k]
+    idcg = float((ideal * discounts[:len(ideal)]).sum())
+    return float((ranked * discounts[:len(ranked)]).sum()) / idcg if idcg > 0 else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=Path, required=True)
+    parser.add_argument("--backends", default=",".join(RERANKER_BACKENDS))
+    parser.add_argument("--model", default=RERANKER_MODEL)
+    parser.add_argument("--candidates", type=int, default=50, help="кандидатов BM25 на запрос")
+    parser.add_argument("--k", type=int, default=10, help="k для NDCG@k")
+    args = parser.parse_args()
+
+    # только готовый индекс бота: build_bm25_retriever([]) на пустом месте записал бы пустой индекс
+    if not index_exists(INDEX_DIR):
+        parser.error(f"BM25 index not found in {INDEX_DIR}, build it first: python -m app.indexer build --backend bm25")
+    bm25 = BM25SparseRetriever.load(INDEX_DIR, k=args.candidates)
+    queries = read_queries(args.queries)
+    query_pairs = []
+    for query in queries:
+        doc_ids, _ = bm25.search(_tokenize_ru(query), args.candidates)
+        query_pairs.append([(query, doc.page_content) for doc in bm25.hydrate(doc_ids)])
+    total_pairs = sum(len(p) for p in query_pairs)
+    print(f"{len(queries)} queries, {total_pairs} pairs")
+
+    reference = None
+    print(f"{'backend':>10} {'pairs/s':>9} {f'NDCG@{args.k}':>9} {'top-1 agr':>10}")
+    for backend in ["torch"] + [b for b in args.backends.split(",") if b != "torch"]:
+        model = load_reranker(backend, args.model, RERANKER_ONNX_DIR)
+        model.predict(query_pairs[0][:8])  # прогрев
+
+        start = time.perf_counter()
+        scores = [np.asarray(model.predict(pairs)) for pairs in query_pairs]
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = scores
+        ndcg = np.mean([ndcg_at_k(ref, s, args.k) for ref, s in zip(reference, scores) if len(ref)])
+        top1 = np.mean([ref.argmax() == s.argmax() for ref, s in zip(reference, scores) if len(ref)])
+        print(f"{backend:>10} {total_pairs / elapsed:9.1f} {ndcg:9.4f} {top1:10.2%}")
+
+
+if __name__ == "__main__":
+    main()
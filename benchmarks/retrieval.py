@@ -0,0 +1,223 @@
+"""Латентность этапов каскада BM25PrfRerankRetriever и качество поиска на размеченных запросах.
+
+Индекс строится из SQLite-базы в схеме WarhammerDatabase, запросы — JSONL вида
+{"query": "...", "relevant": ["Заголовок статьи", ...]}. Для каждой конфигурации
+печатаются p50/p95 (мс) этапов stage1, PRF, stage2, rerank и всего запроса, recall@k
+и MRR по заголовкам статей в выдаче. --grid перебирает декартово произведение значений
+полей ретривера.
+
+Всё работает офлайн: --make-fixture создаёт синтетическую базу и запросы, реранкер по
+умолчанию — overlap, локальная замена CrossEncoder (доля лемм запроса в чанке). Настоящие
+модели — --reranker torch|onnx|onnx-int8 (нужны веса RERANKER_MODEL).
+
+    python -m benchmarks.retrieval --db fixture.db --queries fixture.jsonl --make-fixture 2000
+    python -m benchmarks.retrieval --db fixture.db --queries fixture.jsonl \\
+        --grid top_k_stage1=50,200 --grid prf_top_docs=10,30 --grid prf_top_terms=4,7
+"""
+import json
+import time
+import random
+import argparse
+import itertools
+import tempfile
+from pathlib import Path
+from collections import defaultdict
+
+import numpy as np
+
+from app.bm25 import BM25SparseRetriever
+from app.fts import FtsRetriever
+from app.config import FTS_CANDIDATES, RERANKER_MODEL, RERANKER_ONNX_DIR
+from app.embedder import BM25PrfRerankRetriever, build_fts_index, build_segment, lemmatize_text
+from app.loader import DatabaseTextLoader
+from app.reranker import RERANKER_BACKENDS, load_reranker
+
+STAGES = ("stage1", "prf", "stage2", "rerank", "total")
+# конфигурация ретривера бота (build_or_load_vectorstore), кроме top_k_final и порога
+BASE_CONFIG = {
+    "top_k_stage1": 50, "prf_enable": True, "prf_top_docs": 30, "prf_top_terms": 7, "prf_max_repeat": 3,
+}
+
+COMMON_WORDS = (
+    "император империум легион орден флот война битва мир сектор планета крепость корабль "
+    "воин командир крестовый поход враг оружие броня древний священный тёмный великий "
+    "победа поражение осада штурм защита союз предательство история летопись эпоха"
+).split()
+TOPIC_WORDS = (
+    "варп хаос демон псайкер астропат навигатор кузница механикус техножрец титан "
+    "инквизиция ересь еретик культ мутант ксенос орк эльдар тиранид некрон тау "
+    "космодесант примарх терминатор дредноут библиарий капеллан апотекарий гвардия "
+    "комиссар танк артиллерия улей шпиль губернатор торговец вольный капер"
+).split()
+SYLLABLES = "ка ра мор дан ис ул тар вен гор ам ел кс тор ри зал фен дор ак ну ви".split()
+
+
+class OverlapReranker:
+    """Замена CrossEncoder без модели: доля лемм запроса, встречающихся в тексте кандидата"""
+
+    def predict(self, pairs, **kwargs) -> np.ndarray:
+        scores = []
+        for query, text in pairs:
+            query_lemmas = set(lemmatize_text(query).split())
+            text_lemmas = set(lemmatize_text(text).split())
+            scores.append(len(query_lemmas & text_lemmas) / len(query_lemmas) if query_lemmas else 0.0)
+        return np.asarray(scores, dtype=np.float32)
+
+
+def make_fixture(db_path: Path, queries_path: Path, n_articles: int, n_queries: int, seed: int = 0):
+    """Синтетическая база статей о выдуманных сущностях и размеченные запросы к ней"""
+    from parser.warhammer_wiki import WarhammerDatabase
+
+    rnd = random.Random(seed)
+    names = set()
+    while len(names) < n_articles:
+        names.add("".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))).capitalize())
+    names = sorted(names)
+    topics = {name: rnd.sample(TOPIC_WORDS, 3) for name in names}
+
+    articles = []
+    for revid, name in enumerate(names, 1):
+        paragraphs = []
+        for _ in range(rnd.randint(2, 12)):
+            words = rnd.choices(COMMON_WORDS, k=rnd.randint(40, 120))
+            words += rnd.choices(topics[name], k=rnd.randint(2, 8)) + [name] * rnd.randint(0, 2)
+            # упоминания других сущностей — чтобы имя не было однозначным признаком
+            words += rnd.sample(names, 2)
+            rnd.shuffle(words)
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        articles.append((name, name, "\n\n".join(paragraphs) + "\n", 0, revid, None))
+
+    db = WarhammerDatabase(str(db_path))
+    for lo in range(0, len(articles), 200):
+        db.save_articles(articles[lo:lo + 200])
+    db.close()
+
+    with open(queries_path, "w", encoding="utf-8") as f:
+        for name in rnd.sample(names, min(n_queries, len(names))):
+            kind = rnd.random()
+            if kind < 0.4:
+                query, relevant = f"кто такой {name}", [name]
+            elif kind < 0.8:
+                query, relevant = f"{name} {' '.join(rnd.sample(topics[name], 2))}", [name]
+            else:
+                # без имени: релевантны все статьи с теми же двумя темами
+                pair = rnd.sample(topics[name], 2)
+                query = " и ".join(pair)
+                relevant = [other for other in names if set(pair) <= set(topics[other])]
+            f.write(json.dumps({"query": query, "relevant": relevant}, ensure_ascii=False) + "\n")
+    print(f"fixture: {len(articles)} articles in {db_path}, queries in {queries_path}")
+
+
+def read_labeled_queries(path: Path) -> list[tuple[str, set[str]]]:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["query"], set(row["relevant"])) for row in rows]
+
+
+def build_first_stage(db_path: Path, workdir: Path, backend: str, workers: int):
+    loader = DatabaseTextLoader(str(db_path))
+    start = time.perf_counter()
+    if backend == "fts":
+        build_fts_index(workdir / "fts.db", loader.iter_chunks(), workers=workers)
+        first_stage = FtsRetriever.load(workdir / "fts.db", candidates=FTS_CANDIDATES, k=200)
+    else:
+        first_stage = BM25SparseRetriever.create(
+            workdir / "bm25", lambda path: build_segment(path, loader.iter_chunks(), workers=workers), k=200,
+        )
+    print(f"{backend} index: {len(first_stage.index)} chunks in {time.perf_counter() - start:.1f}s")
+    return first_stage
+
+
+def parse_grid(specs: list[str]) -> list[dict]:
+    """["top_k_stage1=50,200", "prf_enable=true,false"] -> декартово произведение значений"""
+    axes = []
+    for spec in specs:
+        field, _, values = spec.partition("=")
+        axes.append([(field, json.loads(value)) for value in values.split(",")])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def evaluate(retriever: BM25PrfRerankRetriever, queries: list, ks: list[int], repeat: int) -> dict:
+    timings = defaultdict(list)
+    retriever.stage_timer = lambda stage, seconds: timings[stage].append(seconds)
+    recall = {k: [] for k in ks}
+    reciprocal_ranks = []
+    for run in range(repeat):
+        for query, relevant in queries:
+            start = time.perf_counter()
+            docs = retriever.invoke(query)
+            timings["total"].append(time.perf_counter() - start)
+            if run:
+                continue
+            # ранжирование статей: первое вхождение статьи среди чанков выдачи
+            titles = list(dict.fromkeys(doc.metadata.get("title") for doc in docs))
+            for k in ks:
+                recall[k].append(len(relevant & set(titles[:k])) / len(relevant))
+            rank = next((i for i, title in enumerate(titles, 1) if title in relevant), None)
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+    retriever.stage_timer = None
+    return {
+        "latency": {stage: np.percentile(timings[stage], [50, 95]) * 1000 if timings[stage] else None
+                    for stage in STAGES},
+        "runs": {stage: len(timings[stage]) for stage in STAGES},
+        "recall": {k: float(np.mean(v)) for k, v in recall.items()},
+        "mrr": float(np.mean(reciprocal_ranks)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, required=True, help="база в схеме WarhammerDatabase")
+    parser.add_argument("--queries", type=Path, required=True, help="JSONL {query, relevant: [заголовки]}")
+    parser.add_argument("--make-fixture", type=int, default=0, metavar="N",
+                        help="сначала создать синтетическую базу из N статей и запросы к ней")
+    parser.add_argument("--fixture-queries", type=int, default=200)
+    parser.add_argument("--backend", choices=["bm25", "fts"], default="bm25")
+    parser.add_argument("--reranker", choices=["overlap", *RERANKER_BACKENDS], default="overlap")
+    parser.add_argument("--grid", action="append", default=[], metavar="FIELD=V1,V2",
+                        help="значения поля BM25PrfRerankRetriever; можно повторять")
+    parser.add_argument("--k", default="1,5,10", help="k для recall@k")
+    parser.add_argument("--threshold", type=float, default=0.0, help="score_threshold реранкера")
+    parser.add_argument("--repeat", type=int, default=3, help="проходов по запросам для латентности")
+    parser.add_argument("--workers", type=int, default=1, help="процессов лемматизации при сборке индекса")
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        make_fixture(args.db, args.queries, args.make_fixture, args.fixture_queries)
+    if not args.db.exists():
+        parser.error(f"{args.db} does not exist (use --make-fixture N)")
+    queries = read_labeled_queries(args.queries)
+    ks = sorted(int(k) for k in args.k.split(","))
+
+    reranker = OverlapReranker()
+    if args.reranker != "overlap":
+        reranker = load_reranker(args.reranker, RERANKER_MODEL, RERANKER_ONNX_DIR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        first_stage = build_first_stage(args.db, Path(tmp), args.backend, args.workers)
+        print(f"{len(queries)} queries, reranker {args.reranker}, {args.repeat} runs per query\n")
+        header = " ".join(f"{stage:>13}" for stage in STAGES)
+        quality = " ".join(f"{f'R@{k}':>6}" for k in ks)
+        print(f"{'config':<40} {header} {quality} {'MRR':>6}")
+        print(f"{'':<40} " + " ".join(f"{'p50/p95, ms':>13}" for _ in STAGES))
+
+        for overrides in parse_grid(args.grid):
+            config = {**BASE_CONFIG, **overrides}
+            retriever = BM25PrfRerankRetriever(
+                bm25_retriever=first_stage, reranker=reranker,
+                top_k_final=max(ks), score_threshold=args.threshold, **config,
+            )
+            retriever.invoke(queries[0][0])  # прогрев кэша лемм
+            result = evaluate(retriever, queries, ks, args.repeat)
+
+            cells = []
+            for stage in STAGES:
+                latency = result["latency"][stage]
+                cells.append(f"{latency[0]:6.1f}/{latency[1]:6.1f}" if latency is not None else f"{'-':>13}")
+            name = " ".join(f"{field}={value}" for field, value in overrides.items()) or "default"
+            recall = " ".join(f"{result['recall'][k]:6.3f}" for k in ks)
+            print(f"{name:<40} {' '.join(cells)} {recall} {result['mrr']:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Скорость записи статей краулером в SQLite: по статье с коммитом vs батчи в WAL.
+
+Первый проход вставляет синтетический корпус, второй перезаписывает его изменённым
+текстом (путь обновления при повторном обходе). После проходов считается, у скольких
+статей сменился id (по нему индекс связывает чанки со статьёй, так что каждая смена —
+переиндексация под новым id) и сколько осталось осиротевших источников и FTS-строк.
+Строка legacy — прежний путь записи (INSERT OR REPLACE, повторная вставка в FTS, коммит
+на статью, rollback-журнал).
+
+    python -m benchmarks.sqlite_writes --articles 2000 --batch-sizes 1,50,200
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from urllib.parse import quote
+
+from parser.warhammer_wiki import WarhammerDatabase
+
+WORDS = (
+    "император хорус ересь варп легион космодесант примарх терра хаос кузница "
+    "инквизиция орден крестовый поход демон корабль сектор мир улей битва"
+).split()
+
+
+class _LegacyDatabase(WarhammerDatabase):
+    """Запись статьи в том виде, в каком она была до upsert (копия прежнего кода)"""
+
+    def _save_article(self, cursor, original_title, final_title, content, redirects, revid=None, touched=None):
+        safe_title = quote(final_title.replace(' ', '_'))
+        article_url = f"https://warhammer40k.fandom.com/ru/wiki/{safe_title}"
+
+        cursor.execute('SELECT id, content FROM articles WHERE final_title = ?', (final_title,))
+        row = cursor.fetchone()
+        if row is not None and row[1] == content:
+            cursor.execute('UPDATE articles SET revid = ?, touched = ? WHERE id = ?', (revid, touched, row[0]))
+            return article_url
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO articles 
+        (original_title, final_title, article_url, content, content_length, redirects_count, revid, touched)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (original_title, final_title, article_url, content, len(content), redirects, revid, touched))
+
+        article_id = cursor.lastrowid
+        if article_id == 0:
+            cursor.execute('SELECT id FROM articles WHERE final_title = ?', (final_title,))
+            article_id = cursor.fetchone()[0]
+
+        self._extract_and_save_sources(cursor, article_id, content)
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO articles_fts (rowid, title, content)
+        VALUES (?, ?, ?)
+        ''', (article_id, final_title, content))
+        return article_url
+
+
+def _make_corpus(n_articles: int, paragraphs: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(n_articles):
+        text = "\n".join(" ".join(rnd.choices(WORDS, k=60)) for _ in range(paragraphs))
+        sources = "\n".join(f"Кодекс: {' '.join(rnd.choices(WORDS, k=3))} ({rnd.randint(1990, 2025)})"
+                            for _ in range(rnd.randint(1, 6)))
+        corpus.append((f"Статья {i}", f"Статья {i}", f"{text}\nИСТОЧНИКИ\n{sources}\n", 0, i + 1, None))
+    return corpus
+
+
+def _write(db: WarhammerDatabase, corpus: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    if batch_size == 1:
+        for original_title, final_title, content, redirects, revid, touched in corpus:
+            db.save_article(original_title, final_title, content, redirects, revid, touched)
+    else:
+        for lo in range(0, len(corpus), batch_size):
+            db.save_articles(corpus[lo:lo + batch_size])
+    return time.perf_counter() - start
+
+
+def _run(corpus: list, database: type, journal_mode: str, batch_size: int) -> tuple[float, float, int, int]:
+    """(вставок/с, обновлений/с, статей со сменившимся id, осиротевших строк sources и FTS)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = database(os.path.join(tmp, "bench.db"), journal_mode=journal_mode)
+        insert = _write(db, corpus, batch_size)
+        ids = dict(db.conn.execute("SELECT final_title, id FROM articles").fetchall())
+
+        edited = [(o, f, c + "Дополнение к статье после правки.\n", r, revid + len(corpus), t)
+                  for o, f, c, r, revid, t in corpus]
+        update = _write(db, edited, batch_size)
+        new_ids = dict(db.conn.execute("SELECT final_title, id FROM articles").fetchall())
+        changed = sum(ids[title] != new_ids.get(title) for title in ids)
+        orphans = sum(db.conn.execute(query).fetchone()[0] for query in (
+            "SELECT COUNT(*) FROM sources WHERE article_id NOT IN (SELECT id FROM articles)",
+            "SELECT COUNT(*) FROM articles_fts WHERE rowid NOT IN (SELECT id FROM articles)",
+        ))
+        db.close()
+    return len(corpus) / insert, len(corpus) / update, changed, orphans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--paragraphs", type=int, default=8, help="абзацев по 60 слов в статье")
+    parser.add_argument("--batch-sizes", default="1,50,200",
+                        help="статей на транзакцию (1 — save_article с коммитом на каждую)")
+    args = parser.parse_args()
+
+    corpus = _make_corpus(args.articles, args.paragraphs)
+    print(f"{'writer':>8} {'journal':>8} {'batch':>6} {'insert/s':>10} {'update/s':>10} "
+          f"{'ids changed':>12} {'orphans':>8}")
+    configs = [("legacy", _LegacyDatabase, "delete", 1), ("upsert", WarhammerDatabase, "delete", 1)]
+    configs += [("upsert", WarhammerDatabase, "wal", int(b)) for b in args.batch_sizes.split(",")]
+    for name, database, journal_mode, batch_size in configs:
+        insert, update, changed, orphans = _run(corpus, database, journal_mode, batch_size)
+        print(f"{name:>8} {journal_mode:>8} {batch_size:>6} {insert:10.0f} {update:10.0f} {changed:12d} {orphans:8d}")
+
+
+if __name__ == "__main__":
+    main()
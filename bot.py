@@ -8,13 +8,14 @@ from aiogram.types import Message
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 from app.formatter import TelegramMarkdownFormatter
 from app.loader import DatabaseTextLoader
-from app.embedder import build_or_load_vectorstore, lemmatize_text
-from app.llm import get_llm
-from app.rag import build_rag_chain
-from app.config import CHROMA_PERSIST_DIR
+from app.rag import collect_sources
+from app.pipeline import build_rag_executor
+from app.indexer import BackgroundIndexer
+from app.config import STREAM_ANSWERS, STREAM_EDIT_INTERVAL, INDEX_UPDATE_INTERVAL
 
 
 logging.basicConfig(
@@ -24,18 +25,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-if CHROMA_PERSIST_DIR.exists() and any(CHROMA_PERSIST_DIR.iterdir()):
-    logger.info("Loading existing vectorstore from %s", CHROMA_PERSIST_DIR)
-    retriever = build_or_load_vectorstore([])
-else:
-    logger.info("Creating new vectorstore")
-    loader = DatabaseTextLoader()
-    chunks, _ = loader.load_and_split_documents()
-    retriever = build_or_load_vectorstore(chunks)
-    logger.info("Vectorstore created and persisted at %s", CHROMA_PERSIST_DIR)
-
-llm = get_llm()
-rag_chain = build_rag_chain(llm, retriever)
+loader = DatabaseTextLoader()
+rag_executor = build_rag_executor(loader)
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 bot = Bot(
@@ -44,34 +35,99 @@ bot = Bot(
 )
 dp = Dispatcher(storage=MemoryStorage())
 
+def _format_sources(sources: list[tuple[str, str]]) -> str:
+    sources_text = ""
+    if sources:
+        sources_text = "\n\nИспользованные источники:\n"
+        sources_text += "\n".join(
+            f"{i}. [{title}]({source})"
+            for i, (title, source) in enumerate(sources, 1)
+        )
+    return sources_text
+
+
+async def _edit(message: Message, text: str, shown: str, wait: bool = True) -> str:
+    """edit_text с учётом лимитов Telegram; возвращает текст, видимый пользователю.
+
+    wait=False — не ждать при TelegramRetryAfter, а пробросить его вызывающему.
+    """
+    if not text or text == shown:
+        return shown
+    try:
+        await message.edit_text(text)
+        return text
+    except TelegramRetryAfter as e:
+        if not wait:
+            raise
+        logger.warning("Edit rate limit hit, retry after %ds", e.retry_after)
+        await asyncio.sleep(e.retry_after)
+        await message.edit_text(text)
+        return text
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return text
+        raise
+
+
+async def _answer_streaming(message: Message):
+    cached = await rag_executor.cached(message.text)
+    if cached is not None:
+        for part in TelegramMarkdownFormatter.split(cached["answer"] + _format_sources(cached["sources"])):
+            await message.answer(part)
+        return
+
+    placeholder = await message.answer(TelegramMarkdownFormatter.format("⏳ Ищу ответ..."))
+    shown = ""
+    try:
+        source_documents = await rag_executor.retrieve(message.text)
+        sources = collect_sources(source_documents)
+
+        raw_response = ""
+        next_edit = 0.0
+        loop = asyncio.get_running_loop()
+        async for token in rag_executor.stream(message.text, source_documents):
+            raw_response += token
+            if loop.time() < next_edit:
+                continue
+            try:
+                shown = await _edit(placeholder, TelegramMarkdownFormatter.format_partial(raw_response), shown,
+                                    wait=False)
+                next_edit = loop.time() + STREAM_EDIT_INTERVAL
+            except TelegramRetryAfter as e:
+                # стрим держит слот LLM — не спим в нём, а пропускаем правки до конца паузы
+                logger.warning("Edit rate limit hit while streaming, next edit in %ds", e.retry_after)
+                next_edit = loop.time() + e.retry_after
+
+        await rag_executor.remember(message.text, raw_response, sources)
+        raw_response = raw_response or "Failed to get answer"
+        # длинный ответ: первая часть — в плейсхолдер, остальные — новыми сообщениями
+        first, *rest = TelegramMarkdownFormatter.split(raw_response + _format_sources(sources))
+        shown = await _edit(placeholder, first, shown)
+        for part in rest:
+            await message.answer(part)
+    except Exception as e:
+        logger.error("Error streaming answer: %s", str(e), exc_info=True)
+        await _edit(placeholder, TelegramMarkdownFormatter.format(f"🚫 Error: {str(e)}"), shown)
+
+
+async def _answer(message: Message):
+    result = await rag_executor.answer(message.text)
+    raw_response = result.get("answer") or "Failed to get answer"
+
+    for part in TelegramMarkdownFormatter.split(raw_response + _format_sources(result["sources"])):
+        await message.answer(part)
+
+
 @dp.message()
 async def handle_message(message: Message):
     try:
         logger.info("Received message from user %d: %s", message.from_user.id, message.text)
 
-        result = rag_chain.invoke({"input": message.text})
-        raw_response = result.get("answer", "Failed to get answer")
-        source_documents = result.get("context", [])
-
-        unique_sources = {
-            (
-                doc.metadata.get("document_title", doc.metadata.get("title", "Без названия")),
-                doc.metadata.get("source")
-            )
-            for doc in source_documents
-            if doc.metadata.get("source")
-        }
-
-        sources_text = ""
-        if unique_sources:
-            sources_text = "\n\nИспользованные источники:\n"
-            sources_text += "\n".join(
-                f"{i}. [{title}]({source})"
-                for i, (title, source) in enumerate(sorted(unique_sources), 1)
-            )
-
-        response = TelegramMarkdownFormatter.format(raw_response + sources_text)
-        await message.answer(response)
+        async with rag_executor.user_turn(message.from_user.id):
+            if STREAM_ANSWERS:
+                await _answer_streaming(message)
+            else:
+                await _answer(message)
 
         logger.info("Response sent to user %d", message.from_user.id)
 
@@ -84,7 +140,18 @@ async def handle_message(message: Message):
 async def main():
     logger.info("Starting bot...")
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    indexer = None
+    if INDEX_UPDATE_INTERVAL > 0:
+        indexer = BackgroundIndexer(loader, INDEX_UPDATE_INTERVAL)
+        indexer.start()
+    try:
+        # handle_as_tasks: каждый апдейт обрабатывается отдельной задачей,
+        # поэтому долгие вопросы не блокируют получение новых сообщений
+        await dp.start_polling(bot, handle_as_tasks=True)
+    finally:
+        if indexer is not None:
+            indexer.stop()
+        rag_executor.shutdown()
 
 
 if __name__ == "__main__":
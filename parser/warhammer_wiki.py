@@ -1,9 +1,18 @@
+import os
 import re
+import queue
 import sqlite3
 import requests
 import time
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional fast backend for clean_html
+    LexborHTMLParser = None
 from urllib.parse import quote
 from datetime import datetime
 
@@ -18,9 +27,90 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+API_URL = "https://warhammer40k.fandom.com/ru/api.php"
+CRAWL_DELAY = 1.5  # seconds between API requests (Crawl-delay), shared by all fetch threads
+BULK_TITLES = 50  # titles per action=query request (API limit for revision content)
+MAX_REDIRECTS = 3
+RESULT_WAIT = 5  # seconds the writer waits for a fetched page before checking the fetch threads
+
+class TokenBucket:
+    """Thread-safe token bucket: on average `rate` acquisitions per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# Elements dropped before text extraction; real CSS selectors, so class filters apply.
+# Cite on fandom renders <sup class="reference"><a>[1]</a></sup> markers in the text and
+# <div class="mw-references-wrap"><ol class="references">...</ol></div> at the end of the article
+REMOVE_SELECTORS = (
+    "script", "style", "table", "div.portable-infobox",
+    "sup.reference", "div.mw-references-wrap", "ol.references", "div.references",
+    "div.toc", "span.mw-editsection", "div.notice",
+    "div.hatnote", "div.redirectMsg", "nav", "footer",
+    "aside", "figure", "img", "svg", "noscript",
+)
+TEXT_TAGS = ("p", "h1", "h2", "h3", "h4", "li")
+CLEAN_BACKEND = "selectolax" if LexborHTMLParser is not None else "bs4"
+
+def _join_text_parts(elements):
+    """Builds the stored text from (tag, text) pairs of TEXT_TAGS elements in document order"""
+    text_parts = []
+    for tag, text in elements:
+        if text and len(text) > 10:  # Ignore short fragments
+            if tag.startswith('h'):
+                text = f"\n{text.upper()}\n"
+            text_parts.append(text)
+    return '\n'.join(text_parts)
+
+def _clean_html_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    # children before parents: a nested match is never touched after its ancestor is gone
+    for element in reversed(soup.select(", ".join(REMOVE_SELECTORS))):
+        element.decompose()
+    return _join_text_parts((el.name, el.get_text(' ', strip=True)) for el in soup.find_all(TEXT_TAGS))
+
+def _node_text(node):
+    # same as BeautifulSoup get_text(' ', strip=True): whitespace-only strings are skipped
+    return ' '.join(part for part in node.text(deep=True, separator='\x1f', strip=True).split('\x1f') if part)
+
+def _clean_html_selectolax(html):
+    tree = LexborHTMLParser(html)
+    for node in reversed(tree.css(", ".join(REMOVE_SELECTORS))):
+        node.decompose()
+    return _join_text_parts((node.tag, _node_text(node)) for node in tree.css(", ".join(TEXT_TAGS)))
+
+CLEANERS = {"bs4": _clean_html_bs4, "selectolax": _clean_html_selectolax}
+
+def clean_html(html, backend=None):
+    """Cleans HTML and extracts text (module-level so it can run in a process pool).
+
+    Uses selectolax (lexbor, C) when installed, BeautifulSoup otherwise."""
+    return CLEANERS[backend or CLEAN_BACKEND](html)
+
 class WarhammerDatabase:
-    def __init__(self, db_name='warhammer_articles.db'):
+    def __init__(self, db_name='warhammer_articles.db', journal_mode='wal'):
         self.conn = sqlite3.connect(db_name)
+        # WAL: a commit is one sequential append instead of a rollback-journal round trip,
+        # and readers (indexer, bot) are not blocked while the crawler writes
+        self.conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        if journal_mode.lower() == 'wal':
+            self.conn.execute('PRAGMA synchronous=NORMAL')
         self.create_tables()
         
     def create_tables(self):
@@ -37,9 +127,12 @@ class WarhammerDatabase:
             article_url TEXT NOT NULL,
             redirects_count INTEGER DEFAULT 0,
             last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revid INTEGER,
+            touched TEXT,
             UNIQUE(final_title)
         )
         ''')
+        self._add_columns(cursor, 'articles', {'revid': 'INTEGER', 'touched': 'TEXT'})
         
         # Sources table
         cursor.execute('''
@@ -50,6 +143,7 @@ class WarhammerDatabase:
             FOREIGN KEY (article_id) REFERENCES articles(id) ON DELETE CASCADE
         )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sources_article_id ON sources(article_id)')
         
         # Full-text search table
         cursor.execute('''
@@ -66,39 +160,47 @@ class WarhammerDatabase:
         )
         ''')
         
+        # Crawl progress: titles of the current crawl in listing order, so an interrupted
+        # crawl resumes from the pending ones without listing the wiki again
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_queue (
+            position INTEGER PRIMARY KEY,
+            title TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revid INTEGER,
+            touched TEXT
+        )
+        ''')
+        self._add_columns(cursor, 'crawl_queue', {'revid': 'INTEGER', 'touched': 'TEXT'})
+        
+        self._purge_orphans(cursor)
+        
         self.conn.commit()
         logger.info("Database tables created/verified")
 
-    def save_article(self, original_title, final_title, content, redirects=0):
+    def _purge_orphans(self, cursor):
+        """Removes sources and FTS rows left behind by INSERT OR REPLACE of older versions"""
+        cursor.execute('DELETE FROM sources WHERE article_id NOT IN (SELECT id FROM articles)')
+        sources = cursor.rowcount
+        cursor.execute('DELETE FROM articles_fts WHERE rowid NOT IN (SELECT id FROM articles)')
+        if sources or cursor.rowcount:
+            logger.info(f"Removed {sources} orphaned sources and {cursor.rowcount} orphaned FTS rows")
+
+    def _add_columns(self, cursor, table, columns):
+        """Migrates databases created before these columns existed"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+                logger.info(f"Added column {table}.{name}")
+
+    def save_article(self, original_title, final_title, content, redirects=0, revid=None, touched=None):
         cursor = self.conn.cursor()
         
         try:
-            # Формируем безопасный URL статьи
-            safe_title = quote(final_title.replace(' ', '_'))
-            article_url = f"https://warhammer40k.fandom.com/ru/wiki/{safe_title}"
-            
-            # Insert or update article с новым полем article_url
-            cursor.execute('''
-            INSERT OR REPLACE INTO articles 
-            (original_title, final_title, article_url, content, content_length, redirects_count)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (original_title, final_title, article_url, content, len(content), redirects))
-            
-            # Получаем ID статьи
-            article_id = cursor.lastrowid
-            if article_id == 0:
-                cursor.execute('SELECT id FROM articles WHERE final_title = ?', (final_title,))
-                article_id = cursor.fetchone()[0]
-            
-            # Извлекаем и сохраняем источники
-            self._extract_and_save_sources(cursor, article_id, content)
-            
-            # Обновляем индекс полнотекстового поиска
-            cursor.execute('''
-            INSERT OR REPLACE INTO articles_fts (rowid, title, content)
-            VALUES (?, ?, ?)
-            ''', (article_id, final_title, content))
-            
+            article_url = self._save_article(cursor, original_title, final_title, content, redirects, revid, touched)
             self.conn.commit()
             logger.debug(f"Successfully saved article: {final_title} ({article_url})")
             return True
@@ -106,6 +208,147 @@ class WarhammerDatabase:
             logger.error(f"Error saving article {final_title}: {e}")
             return False
 
+    def save_articles(self, articles, failed_titles=()):
+        """Saves a batch of articles in one transaction and marks them in crawl_queue.
+
+        `articles` is a list of (original_title, final_title, content, redirects, revid, touched);
+        `failed_titles` are crawl titles that could not be fetched.
+        Returns the number of saved articles."""
+        cursor = self.conn.cursor()
+        statuses = [('failed', title) for title in failed_titles]
+        saved = 0
+        for original_title, final_title, content, redirects, revid, touched in articles:
+            # savepoint: a failed article does not leave half of its rows in the batch
+            cursor.execute('SAVEPOINT article')
+            try:
+                self._save_article(cursor, original_title, final_title, content, redirects, revid, touched)
+                cursor.execute('RELEASE article')
+                statuses.append(('done', original_title))
+                saved += 1
+            except sqlite3.Error as e:
+                cursor.execute('ROLLBACK TO article')
+                cursor.execute('RELEASE article')
+                logger.error(f"Error saving article {final_title}: {e}")
+                statuses.append(('failed', original_title))
+
+        cursor.executemany(
+            "UPDATE crawl_queue SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE title = ?",
+            statuses,
+        )
+        self.conn.commit()
+        logger.debug(f"Saved batch of {saved} articles ({len(statuses) - saved} failed)")
+        return saved
+
+    def _save_article(self, cursor, original_title, final_title, content, redirects, revid=None, touched=None):
+        # Формируем безопасный URL статьи
+        safe_title = quote(final_title.replace(' ', '_'))
+        article_url = f"https://warhammer40k.fandom.com/ru/wiki/{safe_title}"
+        
+        # Новая ревизия с тем же текстом (правка шаблона, инфобокса) — запоминаем ревизию,
+        # но не трогаем last_updated, источники и FTS: индексатор не увидит лишних изменений
+        cursor.execute('SELECT id, content FROM articles WHERE final_title = ?', (final_title,))
+        row = cursor.fetchone()
+        if row is not None and row[1] == content:
+            cursor.execute('UPDATE articles SET revid = ?, touched = ? WHERE id = ?', (revid, touched, row[0]))
+            return article_url
+        
+        # Upsert: обновлённая статья сохраняет свой id (INSERT OR REPLACE выдавал новый,
+        # а источники и FTS-строки старого id оставались сиротами)
+        cursor.execute('''
+        INSERT INTO articles 
+        (original_title, final_title, article_url, content, content_length, redirects_count, revid, touched)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(final_title) DO UPDATE SET
+            original_title = excluded.original_title,
+            article_url = excluded.article_url,
+            content = excluded.content,
+            content_length = excluded.content_length,
+            redirects_count = excluded.redirects_count,
+            revid = excluded.revid,
+            touched = excluded.touched,
+            last_updated = CURRENT_TIMESTAMP
+        ''', (original_title, final_title, article_url, content, len(content), redirects, revid, touched))
+        
+        # Получаем ID статьи
+        article_id = row[0] if row is not None else cursor.lastrowid
+        
+        # Извлекаем и сохраняем источники
+        self._extract_and_save_sources(cursor, article_id, content)
+        
+        # Обновляем индекс полнотекстового поиска
+        if row is not None:
+            cursor.execute('DELETE FROM articles_fts WHERE rowid = ?', (article_id,))
+        cursor.execute('''
+        INSERT INTO articles_fts (rowid, title, content)
+        VALUES (?, ?, ?)
+        ''', (article_id, final_title, content))
+        return article_url
+
+    def start_crawl(self, pages, changed_only=True):
+        """Replaces crawl_queue with a new list of pages to crawl.
+
+        `pages` are titles or (title, revid, touched) tuples from FandomParser.fetch_page_info.
+        With changed_only=True pages whose revid equals the stored article's revid are
+        marked 'unchanged' and not fetched."""
+        pages = [(page, None, None) if isinstance(page, str) else tuple(page) for page in pages]
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM crawl_queue')
+        cursor.executemany(
+            'INSERT OR IGNORE INTO crawl_queue (position, title, revid, touched) VALUES (?, ?, ?, ?)',
+            [(position, *page) for position, page in enumerate(pages)],
+        )
+        unchanged = 0
+        if changed_only:
+            cursor.execute('''
+            UPDATE crawl_queue SET status = 'unchanged'
+            WHERE revid IS NOT NULL
+              AND revid = (SELECT a.revid FROM articles a WHERE a.final_title = crawl_queue.title)
+            ''')
+            unchanged = cursor.rowcount
+        self.conn.commit()
+        logger.info(f"Started a new crawl of {len(pages)} titles ({unchanged} unchanged since the last crawl)")
+
+    def pending_titles(self, limit=None):
+        """Titles of the current crawl that are not processed yet, in listing order"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT title FROM crawl_queue WHERE status = 'pending' ORDER BY position LIMIT ?",
+            (limit if limit else -1,),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def pending_revisions(self, titles):
+        """Listed revisions of crawl titles as a dict title -> (revid, touched)"""
+        cursor = self.conn.cursor()
+        revisions = {}
+        for start in range(0, len(titles), 500):
+            batch = titles[start:start + 500]
+            cursor.execute(
+                f"SELECT title, revid, touched FROM crawl_queue WHERE title IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            revisions.update((title, (revid, touched)) for title, revid, touched in cursor.fetchall())
+        return revisions
+
+    def skip_until(self, title):
+        """Marks pending titles up to and including `title` as skipped.
+        Returns False if `title` is not in the current crawl."""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT position FROM crawl_queue WHERE title = ?', (title,))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        cursor.execute(
+            "UPDATE crawl_queue SET status = 'skipped', updated_at = CURRENT_TIMESTAMP "
+            "WHERE status = 'pending' AND position <= ?",
+            (row[0],),
+        )
+        self.conn.commit()
+        return True
+
+    def close(self):
+        self.conn.close()
+
     def _extract_and_save_sources(self, cursor, article_id, content):
         """Extracts and saves sources from article content"""
         cursor.execute('DELETE FROM sources WHERE article_id = ?', (article_id,))
@@ -141,12 +384,10 @@ class WarhammerDatabase:
                 if source_line.strip() != '':
                     sources.append(source_line.strip())
         
-        # Save each source separately
-        for source in sources:
-            cursor.execute(
-                'INSERT INTO sources (article_id, source_text) VALUES (?, ?)',
-                (article_id, source)
-            )
+        cursor.executemany(
+            'INSERT INTO sources (article_id, source_text) VALUES (?, ?)',
+            [(article_id, source) for source in sources]
+        )
         logger.debug(f"Extracted {len(sources)} sources for article ID {article_id}")
 
     def log_update(self, count):
@@ -158,18 +399,34 @@ class WarhammerDatabase:
         logger.info(f"Logged update with {count} articles processed")
 
 class FandomParser:
-    def __init__(self, db):
-        self.base_url = "https://warhammer40k.fandom.com/ru/api.php"
+    def __init__(self, db, base_url=API_URL, crawl_delay=CRAWL_DELAY):
+        self.base_url = base_url
         self.session = requests.Session()
         self.db = db
+        self.rate_limiter = TokenBucket(rate=1 / crawl_delay) if crawl_delay else None
         self.session.headers.update({
             "User-Agent": "MyRAGBot/1.0 (contact@example.com)",
             "Accept": "application/json"
         })
         logger.info("FandomParser initialized")
 
+    def _get(self, params, timeout):
+        """GET to the API; waits for the global rate limiter first"""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        response = self.session.get(self.base_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
     def get_article_text(self, title, max_redirects=3, redirect_chain=None):
         """Recursively gets article text with redirect handling"""
+        html_content, redirect_chain = self.fetch_article_html(title, max_redirects, redirect_chain)
+        if not html_content:
+            return None, redirect_chain
+        return self.clean_html(html_content), redirect_chain
+
+    def fetch_article_html(self, title, max_redirects=3, redirect_chain=None):
+        """Recursively gets raw article HTML with redirect handling"""
         if redirect_chain is None:
             redirect_chain = []
             
@@ -187,9 +444,7 @@ class FandomParser:
         }
 
         try:
-            response = self.session.get(self.base_url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
+            data = self._get(params, timeout=15)
 
             if "error" in data:
                 logger.error(f"API error for '{title}': {data['error']['info']}")
@@ -202,7 +457,7 @@ class FandomParser:
                 new_title = parse_data["redirects"][0]["to"]
                 logger.info(f"Redirect: {title} → {new_title}")
                 redirect_chain.append((title, new_title))
-                return self.get_article_text(new_title, max_redirects-1, redirect_chain)
+                return self.fetch_article_html(new_title, max_redirects-1, redirect_chain)
 
             # Get content
             html_content = parse_data.get("text", {}).get("*")
@@ -210,7 +465,7 @@ class FandomParser:
                 logger.warning(f"Empty content for: {title}")
                 return None, redirect_chain
 
-            return self.clean_html(html_content), redirect_chain
+            return html_content, redirect_chain
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Network error for '{title}': {str(e)}")
@@ -221,28 +476,119 @@ class FandomParser:
 
     def clean_html(self, html):
         """Cleans HTML and extracts text"""
-        soup = BeautifulSoup(html, "html.parser")
-        
-        # Remove unwanted elements
-        for element in soup([
-            "script", "style", "table", "div.portable-infobox", 
-            "div.references", "span.mw-editsection", "div.notice",
-            "div.hatnote", "div.redirectMsg", "nav", "footer", 
-            "aside", "figure", "img", "svg", "noscript"
-        ]):
-            element.decompose()
-        
-        # Extract structured text
-        text_parts = []
-        
-        for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li']):
-            text = element.get_text(' ', strip=True)
-            if text and len(text) > 10:  # Ignore short fragments
-                if element.name.startswith('h'):
-                    text = f"\n{text.upper()}\n"
-                text_parts.append(text)
-        
-        return '\n'.join(text_parts)
+        return clean_html(html)
+
+    def fetch_articles_html(self, titles):
+        """Bulk variant of fetch_article_html: parsed HTML of up to BULK_TITLES pages per request.
+
+        Uses action=query&prop=revisions|info with rvparse; redirects are resolved
+        server-side. Returns {title: (html or None, redirect_chain)}. Pages the API
+        returns without parsed content are fetched one by one with action=parse."""
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": 2,
+            "titles": "|".join(titles),
+            "redirects": 1,
+            "prop": "revisions|info",
+            "rvprop": "content|ids|timestamp",
+            "rvparse": 1,
+        }
+        normalized, redirects, pages = {}, {}, {}
+        try:
+            while True:
+                data = self._get(params, timeout=30)
+                if "error" in data:
+                    logger.error(f"API error for batch of {len(titles)} titles: {data['error']['info']}")
+                    break
+
+                query = data.get("query", {})
+                normalized.update((item["from"], item["to"]) for item in query.get("normalized", []))
+                redirects.update((item["from"], item["to"]) for item in query.get("redirects", []))
+                for page in query.get("pages", []):
+                    # large batches come back in parts: revisions of the rest follow in `continue`
+                    known = pages.setdefault(page["title"], page)
+                    if page.get("revisions"):
+                        known["revisions"] = page["revisions"]
+
+                if "continue" not in data:
+                    break
+                params.update(data["continue"])
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Network error for batch of {len(titles)} titles: {str(e)}")
+        except Exception as e:
+            logger.error(f"Unexpected error for batch of {len(titles)} titles: {str(e)}", exc_info=True)
+
+        results = {}
+        for title in titles:
+            page_title, redirect_chain = normalized.get(title, title), []
+            while page_title in redirects and len(redirect_chain) < MAX_REDIRECTS:
+                redirect_chain.append((title if not redirect_chain else page_title, redirects[page_title]))
+                page_title = redirects[page_title]
+            for source, target in redirect_chain:
+                logger.info(f"Redirect: {source} → {target}")
+
+            page = pages.get(page_title)
+            if page is not None and page.get("missing"):
+                logger.warning(f"Empty content for: {title}")
+                results[title] = None, redirect_chain
+                continue
+            html_content = self._revision_html(page)
+            if html_content:
+                results[title] = html_content, redirect_chain
+            else:
+                results[title] = self.fetch_article_html(title)
+        return results
+
+    @staticmethod
+    def _revision_html(page):
+        if not page or not page.get("revisions"):
+            return None
+        revision = page["revisions"][0]
+        main = revision.get("slots", {}).get("main", {})
+        return main.get("content") or revision.get("content") or revision.get("*")
+
+    def fetch_page_info(self, limit=None):
+        """Lists all articles with their current revision as (title, revid, touched).
+
+        One generator=allpages&prop=info request per 500 pages; redirect pages are left
+        out, their targets are listed on their own."""
+        pages = []
+        params = {
+            "action": "query",
+            "generator": "allpages",
+            "gaplimit": 500,
+            "gapfilterredir": "nonredirects",
+            "prop": "info",
+            "format": "json",
+            "formatversion": 2,
+        }
+
+        try:
+            while True:
+                data = self._get(params, timeout=20)
+
+                if "query" not in data or "pages" not in data["query"]:
+                    break
+
+                # pages of a generator come in arbitrary order; keep the listing order
+                batch = sorted(data["query"]["pages"], key=lambda page: page["title"])
+                pages.extend((page["title"], page.get("lastrevid"), page.get("touched")) for page in batch)
+
+                if limit and len(pages) >= limit:
+                    pages = pages[:limit]
+                    break
+
+                if "continue" not in data:
+                    break
+
+                params.update(data["continue"])
+
+        except Exception as e:
+            logger.error(f"Error fetching article list: {str(e)}", exc_info=True)
+
+        logger.info(f"Fetched revision info for {len(pages)} articles")
+        return pages
 
     def fetch_all_articles(self, limit=None):
         """Gets list of all articles with pagination"""
@@ -256,9 +602,7 @@ class FandomParser:
 
         try:
             while True:
-                response = self.session.get(self.base_url, params=params, timeout=20)
-                response.raise_for_status()
-                data = response.json()
+                data = self._get(params, timeout=20)
 
                 if "query" not in data or "allpages" not in data["query"]:
                     break
@@ -273,7 +617,6 @@ class FandomParser:
                     break
                     
                 params.update(data["continue"])
-                time.sleep(1.5)
 
         except Exception as e:
             logger.error(f"Error fetching article list: {str(e)}", exc_info=True)
@@ -281,87 +624,141 @@ class FandomParser:
         logger.info(f"Fetched {len(articles)} articles")
         return articles
 
-    def process_and_save_articles(self, limit=None):
-        """Main method for processing and saving articles"""
-        articles = self.fetch_all_articles(limit)
-        success_count = 0
-        
-        for i, title in enumerate(articles, 1):
-            try:
-                start_time = time.time()
-                
-                # Get text and redirect history
-                content, redirects = self.get_article_text(title)
-                
-                if content:
-                    # Determine final title (after all redirects)
-                    final_title = redirects[-1][1] if redirects else title
-                    
-                    # Save to database
-                    if self.db.save_article(
-                        original_title=title,
-                        final_title=final_title,
-                        content=content,
-                        redirects=len(redirects)
-                    ):
-                        success_count += 1
-                
-                elapsed = time.time() - start_time
-                logger.info(f"[{i}/{len(articles)}] {'✓' if content else '✗'} {title} ({elapsed:.1f}s)")
-                
-            except Exception as e:
-                logger.error(f"Critical error processing '{title}': {str(e)}", exc_info=True)
-            finally:
-                time.sleep(1.5)  # Respect Crawl-delay
+    def process_and_save_articles(self, limit=None, resume=True, fetch_workers=2, clean_workers=None,
+                                  batch_size=50, bulk=True, changed_only=True):
+        """Main method for processing and saving articles.
+
+        Runs as a pipeline: fetch threads (all behind one token bucket, so the crawl delay
+        holds globally) -> clean_html in a process pool -> a single writer (this thread)
+        saving batches of articles in one transaction each.
+        Progress is kept in crawl_queue: with resume=True an interrupted crawl continues
+        with its pending titles instead of listing the wiki again.
+        With bulk=True content is fetched BULK_TITLES pages per request (fetch_articles_html).
+        A new crawl lists revisions first; with changed_only=True only pages edited since
+        the last crawl are downloaded."""
+        titles = self.db.pending_titles(limit) if resume else []
+        if titles:
+            logger.info(f"Resuming crawl: {len(titles)} pending articles")
+        else:
+            self.db.start_crawl(self.fetch_page_info(limit), changed_only=changed_only)
+            titles = self.db.pending_titles(limit)
+
+        success_count = self._run_pipeline(titles, fetch_workers, clean_workers, batch_size, bulk)
         
         # Log update results
         self.db.log_update(success_count)
-        logger.info(f"Completed! Successfully saved {success_count}/{len(articles)} articles")
+        logger.info(f"Completed! Successfully saved {success_count}/{len(titles)} articles")
         
         return success_count
 
+    def _run_pipeline(self, titles, fetch_workers, clean_workers, batch_size, bulk):
+        todo = queue.Queue()
+        step = BULK_TITLES if bulk else 1
+        for start in range(0, len(titles), step):
+            todo.put(titles[start:start + step])
+        fetched = queue.Queue()
+        revisions = self.db.pending_revisions(titles)
+        success_count = 0
+
+        # spawn: the pool is started from fetch threads, and forking a multithreaded process is unsafe
+        with ProcessPoolExecutor(max_workers=clean_workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context("spawn")) as cleaners:
+            def fetch_worker():
+                while True:
+                    try:
+                        batch_titles = todo.get_nowait()
+                    except queue.Empty:
+                        return
+                    start_time = time.time()
+                    results = {}
+                    try:
+                        if bulk:
+                            results = self.fetch_articles_html(batch_titles)
+                        else:
+                            results = {batch_titles[0]: self.fetch_article_html(batch_titles[0])}
+                    except Exception as e:
+                        logger.error(f"Critical error processing {batch_titles}: {str(e)}", exc_info=True)
+                    finally:
+                        # the writer waits for exactly one result per title, even if cleaning can't start
+                        for title in batch_titles:
+                            html_content, redirects = results.get(title, (None, []))
+                            cleaned = None
+                            if html_content:
+                                try:
+                                    cleaned = cleaners.submit(clean_html, html_content)
+                                except Exception as e:
+                                    logger.error(f"Error submitting '{title}' for cleaning: {str(e)}")
+                            fetched.put((title, redirects, cleaned, start_time))
+
+            def next_result():
+                """Next fetched page, or None when all fetch threads are gone and nothing is left"""
+                while True:
+                    try:
+                        return fetched.get(timeout=RESULT_WAIT)
+                    except queue.Empty:
+                        # threads put their results before exiting: check them first, then the queue
+                        if not any(thread.is_alive() for thread in threads) and fetched.empty():
+                            return None
+
+            threads = [
+                threading.Thread(target=fetch_worker, name=f"fetch-{i}", daemon=True)
+                for i in range(min(fetch_workers, todo.qsize()))
+            ]
+            for thread in threads:
+                thread.start()
+
+            batch, failed = [], []
+            try:
+                for i in range(1, len(titles) + 1):
+                    result = next_result()
+                    if result is None:
+                        logger.error(f"Fetch threads stopped with {len(titles) - i + 1} titles left, they stay pending")
+                        break
+                    title, redirects, cleaned, start_time = result
+                    content = None
+                    if cleaned is not None:
+                        try:
+                            content = cleaned.result()
+                        except Exception as e:
+                            logger.error(f"Error cleaning '{title}': {str(e)}")
+
+                    if content:
+                        # Determine final title (after all redirects)
+                        final_title = redirects[-1][1] if redirects else title
+                        batch.append((title, final_title, content, len(redirects), *revisions.get(title, (None, None))))
+                    else:
+                        failed.append(title)
+                    logger.info(f"[{i}/{len(titles)}] {'✓' if content else '✗'} {title} ({time.time() - start_time:.1f}s)")
+
+                    if len(batch) + len(failed) >= batch_size:
+                        success_count += self.db.save_articles(batch, failed)
+                        batch, failed = [], []
+            finally:
+                # on interruption the unsaved titles stay pending in crawl_queue
+                success_count += self.db.save_articles(batch, failed)
+
+        return success_count
+
 def resume_from_article(start_title, limit=None):
-    """Resumes parsing from specific article"""
+    """Resumes parsing after a specific article of the current crawl"""
     try:
         db = WarhammerDatabase()
         parser = FandomParser(db)
-        
-        # Get all articles
-        all_articles = parser.fetch_all_articles()
-        
-        # Find starting position
-        try:
-            start_idx = all_articles.index(start_title) + 1  # Start from next article
-            logger.info(f"Resuming from article #{start_idx}: {all_articles[start_idx]}")
-        except ValueError:
-            logger.error(f"Article '{start_title}' not found in list")
-            return
-
-        # Process remaining articles
-        articles_to_process = all_articles[start_idx:start_idx+limit] if limit else all_articles[start_idx:]
-        total_count = len(all_articles)
-        
-        for i, title in enumerate(articles_to_process, start_idx+1):
-            try:
-                start_time = time.time()
-                content, redirects = parser.get_article_text(title)
-                
-                if content:
-                    final_title = redirects[-1][1] if redirects else title
-                    db.save_article(title, final_title, content, len(redirects))
-                
-                logger.info(f"[{i}/{total_count}] Processed: {title} ({time.time()-start_time:.1f}s)")
-                time.sleep(1.5)
-                
-            except Exception as e:
-                logger.error(f"Error processing {title}: {str(e)}")
-                time.sleep(5)  # Longer delay on error
+
+        # The wiki is listed again only if there is no crawl to resume
+        if not db.pending_titles(1) or not db.skip_until(start_title):
+            db.start_crawl(parser.fetch_page_info())
+            if not db.skip_until(start_title):
+                logger.error(f"Article '{start_title}' not found in list")
+                return
+
+        parser.process_and_save_articles(limit=limit, resume=True)
 
     except Exception as e:
         logger.critical(f"Fatal error: {str(e)}", exc_info=True)
     finally:
         if 'db' in locals():
-            db.conn.close()
+            db.close()
 
 if __name__ == "__main__":
     db = WarhammerDatabase()
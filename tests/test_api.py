@@ -0,0 +1,17 @@
+"""HTTP API on a stub executor (the lifespan that builds the real pipeline is not run)."""
+from fastapi.testclient import TestClient
+
+from app.api import app
+
+
+class FailingCacheExecutor:
+    async def cached(self, question):
+        raise OSError("answer cache is not readable")
+
+
+def test_stream_reports_cache_errors_as_an_error_event():
+    app.state.rag_executor = FailingCacheExecutor()
+    response = TestClient(app).post("/ask/stream", json={"query": "Кто такой Хорус?"})
+
+    assert response.status_code == 200
+    assert response.text == 'event: error\ndata: {"detail": "answer cache is not readable"}\n\n'
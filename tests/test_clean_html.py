@@ -0,0 +1,40 @@
+"""clean_html on fandom article markup (parse API output with infobox, TOC and Cite references)."""
+import re
+from pathlib import Path
+
+import pytest
+
+from parser.warhammer_wiki import CLEANERS, LexborHTMLParser, clean_html
+
+ARTICLE = (Path(__file__).parent / "fixtures" / "fandom_article.html").read_text(encoding="utf-8")
+BACKENDS = [
+    "bs4",
+    pytest.param("selectolax", marks=pytest.mark.skipif(LexborHTMLParser is None, reason="selectolax is not installed")),
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_article_text_is_kept(backend):
+    text = clean_html(ARTICLE, backend)
+
+    assert text.startswith("Хорус Луперкаль — примарх легиона Лунных Волков")
+    assert "поддался влиянию Хаоса." in text
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_references_and_page_chrome_are_removed(backend):
+    text = clean_html(ARTICLE, backend)
+
+    assert not re.search(r"\[\d+\]", text)  # inline <sup class="reference"> markers
+    for dropped in ("Возвышение Хоруса", "Лживые боги", "↑",  # <ol class="references">
+                    "Сыны Хоруса",  # infobox
+                    "Примечания", "Содержание",  # table of contents
+                    "править", "другие значения"):  # edit links, hatnote
+        assert dropped not in text, dropped
+
+
+@pytest.mark.skipif(LexborHTMLParser is None, reason="selectolax is not installed")
+def test_backends_give_the_same_text():
+    columns = ARTICLE.replace('"mw-references-wrap"', '"mw-references-wrap mw-references-columns"')
+    for html in (ARTICLE, columns):
+        assert CLEANERS["selectolax"](html) == CLEANERS["bs4"](html)
@@ -0,0 +1,221 @@
+"""Crawler against a stub MediaWiki API served by http.server on localhost."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from parser import warhammer_wiki
+from parser.warhammer_wiki import FandomParser, TokenBucket, WarhammerDatabase
+
+ARTICLES = {
+    "Абаддон": "Магистр войны Чёрного легиона.",
+    "Варп": "Измерение, из которого черпают силу псайкеры.",
+    "Император": "Повелитель Человечества на Золотом Троне.",
+    "Кадия": "Мир-крепость у Ока Ужаса.",
+    "Хорус": "Примарх Лунных Волков, предавший Императора.",
+}
+REDIRECTS = {"Магистр войны": "Хорус"}
+LISTING_PAGE = 2  # pages per listing response, so the crawler has to follow `continue`
+
+
+class StubWiki(BaseHTTPRequestHandler):
+    """api.php with the calls the crawler makes: allpages listing, bulk query, parse"""
+
+    requests = []
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        type(self).requests.append(params)
+        if params.get("generator") == "allpages":
+            body = self._listing(params)
+        elif params.get("action") == "query":
+            body = self._query(params)
+        else:
+            body = self._parse(params)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _listing(self, params):
+        titles = sorted(ARTICLES)
+        if params.get("gapfilterredir") != "nonredirects":
+            titles = sorted([*titles, *REDIRECTS])
+        start = titles.index(params["gapcontinue"]) if "gapcontinue" in params else 0
+        pages = [{"title": title, "lastrevid": 100 + titles.index(title), "touched": "2026-01-01T00:00:00Z"}
+                 for title in titles[start:start + LISTING_PAGE]]
+        body = {"query": {"pages": pages[::-1]}}  # generators do not keep the order
+        if start + LISTING_PAGE < len(titles):
+            body["continue"] = {"gapcontinue": titles[start + LISTING_PAGE], "continue": "gapcontinue||"}
+        return body
+
+    def _query(self, params):
+        redirects, pages = [], []
+        for title in params["titles"].split("|"):
+            if title in REDIRECTS:
+                redirects.append({"from": title, "to": REDIRECTS[title]})
+                title = REDIRECTS[title]
+            if title in ARTICLES:
+                html = f"<div><p>{ARTICLES[title]}</p><script>x()</script></div>"
+                pages.append({"title": title, "revisions": [{"slots": {"main": {"content": html}}}]})
+            else:
+                pages.append({"title": title, "missing": True})
+        return {"query": {"redirects": redirects, "pages": pages}}
+
+    def _parse(self, params):
+        title = params["page"]
+        if title in REDIRECTS:
+            return {"parse": {"redirects": [{"from": title, "to": REDIRECTS[title]}]}}
+        if title not in ARTICLES:
+            return {"error": {"info": "The page you specified doesn't exist."}}
+        return {"parse": {"text": {"*": f"<p>{ARTICLES[title]}</p>"}}}
+
+
+@pytest.fixture
+def wiki():
+    StubWiki.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWiki)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api.php"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = WarhammerDatabase(str(tmp_path / "wiki.db"))
+    yield db
+    db.close()
+
+
+def _articles(db):
+    return dict(db.conn.execute("SELECT final_title, content FROM articles").fetchall())
+
+
+def _resume_crawl_in_thread(db_path, wiki, timeout=30):
+    """Resumes the crawl in a separate thread (with its own connection); None if it hangs"""
+    result = []
+
+    def crawl():
+        db = WarhammerDatabase(str(db_path))
+        try:
+            result.append(FandomParser(db, base_url=wiki, crawl_delay=0).process_and_save_articles(resume=True))
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=crawl, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def test_listing_follows_continue_and_skips_redirects(wiki, db):
+    pages = FandomParser(db, base_url=wiki, crawl_delay=0).fetch_page_info()
+
+    assert [title for title, _, _ in pages] == sorted(ARTICLES)
+    assert all(revid is not None for _, revid, _ in pages)
+    listing = [params for params in StubWiki.requests if params.get("generator") == "allpages"]
+    assert len(listing) == -(-len(ARTICLES) // LISTING_PAGE)
+    assert all(params["gapfilterredir"] == "nonredirects" for params in listing)
+
+
+def test_bulk_fetch_resolves_redirects(wiki, db):
+    results = FandomParser(db, base_url=wiki, crawl_delay=0).fetch_articles_html(["Магистр войны", "Нет такой"])
+
+    html, chain = results["Магистр войны"]
+    assert ARTICLES["Хорус"] in html
+    assert chain == [("Магистр войны", "Хорус")]
+    assert results["Нет такой"] == (None, [])
+
+
+def test_token_bucket_spaces_acquisitions_across_threads():
+    rate = 20
+    bucket = TokenBucket(rate)
+    stamps, lock = [], threading.Lock()
+
+    def worker():
+        for _ in range(4):
+            bucket.acquire()
+            with lock:
+                stamps.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stamps.sort()
+    gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+    assert min(gaps) >= 0.9 / rate
+    assert stamps[-1] - stamps[0] >= (len(stamps) - 1) * 0.9 / rate
+
+
+def test_crawl_saves_cleaned_articles(wiki, db):
+    parser = FandomParser(db, base_url=wiki, crawl_delay=0)
+    saved = parser.process_and_save_articles(fetch_workers=2, clean_workers=1, batch_size=2)
+
+    assert saved == len(ARTICLES)
+    articles = _articles(db)
+    assert sorted(articles) == sorted(ARTICLES)
+    assert all(ARTICLES[title] in content and "x()" not in content for title, content in articles.items())
+    assert not db.pending_titles()
+
+
+def test_resume_fetches_only_pending_titles(wiki, db):
+    db.start_crawl([(title, 1, None) for title in sorted(ARTICLES)])
+    done = sorted(ARTICLES)[:2]
+    db.conn.executemany("UPDATE crawl_queue SET status = 'done' WHERE title = ?", [(t,) for t in done])
+    db.conn.commit()
+
+    parser = FandomParser(db, base_url=wiki, crawl_delay=0)
+    saved = parser.process_and_save_articles(resume=True, fetch_workers=1, clean_workers=1)
+
+    assert saved == len(ARTICLES) - len(done)
+    assert sorted(_articles(db)) == sorted(ARTICLES)[2:]
+    # the interrupted crawl is resumed from crawl_queue without listing the wiki again
+    assert not any(params.get("generator") == "allpages" for params in StubWiki.requests)
+
+
+def test_failed_clean_submit_does_not_stall_the_writer(wiki, db, tmp_path, monkeypatch):
+    class BrokenPool:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def submit(self, *args, **kwargs):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(warhammer_wiki, "ProcessPoolExecutor", BrokenPool)
+    db.start_crawl([(title, 1, None) for title in sorted(ARTICLES)])
+    assert _resume_crawl_in_thread(tmp_path / "wiki.db", wiki) == 0
+    statuses = db.conn.execute("SELECT DISTINCT status FROM crawl_queue").fetchall()
+    assert statuses == [("failed",)]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_writer_stops_when_fetch_threads_die(wiki, db, tmp_path, monkeypatch):
+    def malformed(self, titles):
+        # not (html, redirects): the worker thread dies before it reports the titles
+        return {title: "<p>html</p>" for title in titles}
+
+    monkeypatch.setattr(FandomParser, "fetch_articles_html", malformed)
+    monkeypatch.setattr(warhammer_wiki, "RESULT_WAIT", 0.1)
+    db.start_crawl([(title, 1, None) for title in sorted(ARTICLES)])
+    assert _resume_crawl_in_thread(tmp_path / "wiki.db", wiki) == 0
+    # titles nobody reported stay pending for the next run
+    assert db.pending_titles() == sorted(ARTICLES)
@@ -0,0 +1,87 @@
+"""RagExecutor with the answer cache on a fake retriever and answer chain."""
+import asyncio
+
+import pytest
+
+from app.answer_cache import AnswerCache
+from app.executor import RagExecutor
+
+
+class FakeRetriever:
+    """First stage whose index can be "rebuilt" on disk: refresh() picks up the new id"""
+
+    def __init__(self):
+        self.index_id = "v1"
+        self.on_disk = "v1"
+        self.calls = 0
+
+    def refresh(self) -> bool:
+        changed = self.on_disk != self.index_id
+        self.index_id = self.on_disk
+        return changed
+
+    def invoke(self, question):
+        return self.retrieve_many([question])[0]
+
+    def retrieve_many(self, questions):
+        self.refresh()
+        self.calls += len(questions)
+        return [[] for _ in questions]
+
+
+class FakeChain:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        return f"ответ {self.calls} на {inputs['input']!r}"
+
+
+@pytest.fixture
+def executor():
+    executor = RagExecutor(FakeRetriever(), FakeChain(), retrieval_workers=1, llm_concurrency=1,
+                           answer_cache=AnswerCache())
+    yield executor
+    executor.shutdown()
+
+
+def test_cached_answer_is_reused_for_the_same_question(executor):
+    async def scenario():
+        return await executor.answer("Кто такой Хорус?"), await executor.answer("хорус кто такой")
+
+    first, second = asyncio.run(scenario())
+
+    assert not first["cached"]
+    assert second["cached"] and second["answer"] == first["answer"]
+
+
+def test_short_questions_are_not_cached_together(executor):
+    async def scenario():
+        return await executor.answer("ok"), await executor.answer("hi")
+
+    ok, hi = asyncio.run(scenario())
+
+    assert not hi["cached"]
+    assert hi["answer"] != ok["answer"]
+    assert executor.answer_chain.calls == 2
+
+
+def test_batch_does_not_merge_short_questions(executor):
+    results = asyncio.run(executor.answer_many(["ок?", "🙂", "ок?"]))
+
+    assert len({result["answer"] for result in results}) == 3
+    assert not any(result["cached"] for result in results)
+
+
+def test_rebuilt_index_invalidates_cached_answer(executor):
+    async def scenario():
+        first = await executor.answer("Кто такой Хорус?")
+        executor.retriever.on_disk = "v2"  # python -m app.indexer build in another process
+        return first, await executor.answer("Кто такой Хорус?")
+
+    first, again = asyncio.run(scenario())
+
+    assert not again["cached"]
+    assert again["answer"] != first["answer"]
+    assert executor.answer_cache.index_id == "v2"
@@ -0,0 +1,158 @@
+"""Seeded property tests of TelegramMarkdownFormatter on random markdown-like answers."""
+import random
+import re
+
+import pytest
+
+from app.config import MAX_MESSAGE_LENGTH
+from app.formatter import TelegramMarkdownFormatter
+
+# ```language\n...``` with escaped '`' and '\\' inside
+_PRE = re.compile(r'```(?:[\w+#.-]*\n)?((?:\\.|[^`\\])*)(?:```|$)', re.DOTALL)
+SPECIAL = set('_*[]()~`>#+-=|{}.!\\')
+WORDS = ["Император", "Хорус", "ересь", "примарх", "легион", "космодесант", "варп", "C#", "x_y"]
+LINKS = [
+    "[Ересь Хоруса](https://warhammer40k.fandom.com/ru/wiki/Ересь_Хоруса)",
+    "[Хорус](https://warhammer40k.fandom.com/ru/wiki/Хорус_(примарх))",
+]
+PUNCTUATION = ["\\", ".", "!", "-", "1.", "(M31)", ">", "|", "{", "}", "~", "=", "+"]
+# anything an LLM may emit, including unpaired markers and broken links
+FRAGMENTS = [
+    *WORDS, *LINKS, *PUNCTUATION,
+    "**", "*", "#", "## ", "\n", "\n\n", "\n### Заголовок\n", " ", " ", " ", "`", "```", "```python\n",
+    "[", "]", "(", ")",
+]
+# a finished answer with balanced markup (no stray '*' or '`' to merge with the markers):
+# what a streamed answer grows into
+BALANCED_FRAGMENTS = [
+    *WORDS, *LINKS, *PUNCTUATION,
+    "**жирный текст**", "#", "\n", "\n\n", "\n### Заголовок\n", " ", " ", " ",
+    "\n```python\nprint('x')\n```\n", "[", "]", "(", ")",
+]
+LIMITS = [MAX_MESSAGE_LENGTH, 300, 100]
+SEEDS = range(8)
+TEXTS_PER_SEED = 30
+
+
+def validate(message: str) -> str | None:
+    """Checks MarkdownV2 markup of a message; None if it is valid, otherwise what is wrong"""
+    i, n, bold = 0, len(message), False
+    while i < n:
+        c = message[i]
+        if c == '\\':
+            if i + 1 == n:
+                return "dangling backslash"
+            i += 2
+            continue
+        if message.startswith('```', i):
+            i += 3
+            while i < n and not message.startswith('```', i):
+                if message[i] == '\\':
+                    i += 1
+                elif message[i] == '`':
+                    return f"unescaped ` in pre at {i}"
+                i += 1
+            if i >= n:
+                return "unclosed pre"
+            i += 3
+            continue
+        if c == '*':
+            bold = not bold
+        elif c == '[':
+            i += 1
+            while i < n and message[i] != ']':
+                if message[i] == '\\':
+                    i += 1
+                elif message[i] in SPECIAL:
+                    return f"unescaped {message[i]!r} in link text at {i}"
+                i += 1
+            if not message.startswith('](', i):
+                return "broken link"
+            i += 2
+            while i < n and message[i] != ')':
+                i += 2 if message[i] == '\\' else 1
+            if i >= n:
+                return "unclosed link url"
+        elif c in SPECIAL:
+            return f"unescaped {c!r} at {i}"
+        i += 1
+    return "unclosed bold" if bold else None
+
+
+def visible_text(message: str) -> str:
+    """Text without markup and whitespace, as the user sees it.
+
+    The code block language is dropped: split repeats it in every part of a cut block.
+    """
+    out, i, n = [], 0, len(message)
+    while i < n:
+        if message[i] == '\\':
+            out.append(message[i + 1:i + 2])
+            i += 2
+        elif message.startswith('```', i):
+            m = _PRE.match(message, i)
+            out.append(re.sub(r'\\(.)', r'\1', m.group(1), flags=re.DOTALL))
+            i = m.end()
+        else:
+            if message[i] not in '*[]()':
+                out.append(message[i])
+            i += 1
+    return re.sub(r'\s+', '', ''.join(out))
+
+
+def random_texts(seed: int, fragments: list[str]):
+    rnd = random.Random(seed)
+    for _ in range(TEXTS_PER_SEED):
+        yield ''.join(rnd.choices(fragments, k=rnd.randint(1, rnd.choice([20, 200, 2000]))))
+
+
+@pytest.mark.parametrize("limit", LIMITS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_split_messages_fit_and_are_valid(seed, limit):
+    for text in random_texts(seed, FRAGMENTS):
+        messages = TelegramMarkdownFormatter.split(text, limit)
+        assert messages, text
+        for message in messages:
+            assert len(message) <= limit, text
+            assert validate(message) is None, (validate(message), text)
+        # nothing lost or duplicated at the cuts
+        assert ''.join(map(visible_text, messages)) == visible_text(TelegramMarkdownFormatter.format(text)), text
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_format_is_valid_and_escapes_everything(seed):
+    for text in random_texts(seed, FRAGMENTS):
+        formatted = TelegramMarkdownFormatter.format(text)
+        assert validate(formatted) is None, (validate(formatted), text)
+    text = "C# 1.0 (M31) x_y {a} ~b~ >c| d=e+f! [g]"
+    assert TelegramMarkdownFormatter.format(text) == r"C\# 1\.0 \(M31\) x\_y \{a\} \~b\~ \>c\| d\=e\+f\! \[g\]"
+
+
+@pytest.mark.parametrize("limit", LIMITS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_format_partial_is_a_prefix_of_the_final_answer(seed, limit):
+    """Every streamed state is valid, fits the placeholder and shows the beginning of the final answer.
+
+    Markup differs while it is still open (a cut code block is closed; an unfinished link,
+    header or fence and an unpaired '**' are held back), so the prefix property holds for
+    the text the user sees.
+    """
+    rnd = random.Random(seed)
+    for text in random_texts(seed, BALANCED_FRAGMENTS):
+        final = visible_text(TelegramMarkdownFormatter.format(text))
+        for end in sorted(rnd.sample(range(1, len(text) + 1), min(len(text), 10))):
+            partial = TelegramMarkdownFormatter.format_partial(text[:end], limit)
+            assert len(partial) <= limit, text[:end]
+            assert validate(partial) is None, (validate(partial), text[:end])
+            assert final.startswith(visible_text(partial)), text[:end]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("**", ""),
+    ("a **b", "a b"),
+    ("```py\nx = 1``", "```py\nx = 1\n```"),
+    ("см. [Хорус](https://wiki/Хорус_(при", r"см\. "),
+    ("текст\n## ", "текст\n"),
+])
+def test_format_partial_holds_back_unfinished_markup(text, expected):
+    assert TelegramMarkdownFormatter.format_partial(text) == expected
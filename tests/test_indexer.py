@@ -0,0 +1,69 @@
+"""Full build and incremental update of the BM25 index from a crawler database."""
+import numpy as np
+import pytest
+
+from app import indexer
+from app.bm25 import read_manifest
+from app.loader import DatabaseTextLoader
+from parser.warhammer_wiki import WarhammerDatabase
+
+TEXT = "Примарх Хорус возглавил Лунных Волков в Великом крестовом походе. " * 3
+CLOCK = "2026-01-01 12:00:00"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexer, "LEMMA_CACHE_FILE", tmp_path / "lemmas.json")
+    db = WarhammerDatabase(str(tmp_path / "wiki.db"))
+    yield db
+    db.close()
+
+
+def _save(db, title, last_updated):
+    db.save_article(title, title, f"{title}. {TEXT}")
+    db.conn.execute("UPDATE articles SET last_updated = ? WHERE final_title = ?", (last_updated, title))
+    db.conn.commit()
+
+
+def _indexed_titles(index_dir, loader):
+    manifest = read_manifest(index_dir)
+    ids = set()
+    for seg in indexer._open_segments(index_dir, manifest):
+        ids.update(np.unique(seg.doc_article[seg.live_ids()]).tolist())
+    rows = loader._query("SELECT id, final_title FROM articles")
+    return sorted(title for article_id, title in rows if article_id in ids)
+
+
+def test_article_saved_in_the_build_second_is_picked_up_by_update(db, tmp_path, monkeypatch):
+    loader = DatabaseTextLoader(str(tmp_path / "wiki.db"))
+    index_dir = tmp_path / "index"
+    _save(db, "Хорус", "2026-01-01 11:59:59")
+    # the build reads the clock, then the crawler saves an article within the same second
+    # and after the keyset stream has already passed it
+    monkeypatch.setattr(loader, "current_timestamp", lambda: CLOCK)
+    _save(db, "Абаддон", CLOCK)
+
+    indexer.rebuild_index(loader, index_dir, workers=1)
+    assert _indexed_titles(index_dir, loader) == ["Хорус"]
+    assert read_manifest(index_dir)["watermark"] == CLOCK
+
+    monkeypatch.setattr(loader, "current_timestamp", lambda: "2026-01-01 12:00:01")
+    assert indexer.update_index(loader, index_dir) is not None
+    assert _indexed_titles(index_dir, loader) == ["Абаддон", "Хорус"]
+    # nothing new since: the update does not pick the same articles again
+    assert indexer.update_index(loader, index_dir) is None
+
+
+def test_fts_index_is_stale_while_an_article_is_not_older_than_the_watermark(db, tmp_path, monkeypatch):
+    loader = DatabaseTextLoader(str(tmp_path / "wiki.db"))
+    path = tmp_path / "fts.db"
+    _save(db, "Хорус", "2026-01-01 11:59:59")
+    monkeypatch.setattr(loader, "current_timestamp", lambda: CLOCK)
+    _save(db, "Абаддон", CLOCK)
+
+    assert indexer.rebuild_fts_index(loader, path, workers=1)["watermark"] == CLOCK
+    assert indexer.update_fts_index(loader, path) is not None  # Абаддон is not in the index yet
+
+    monkeypatch.setattr(loader, "current_timestamp", lambda: "2026-01-01 12:00:01")
+    assert indexer.update_fts_index(loader, path) is not None
+    assert indexer.update_fts_index(loader, path) is None